@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+"""Benchmark map generation, dungeon construction and path finding
+
+Runs without opening a window. Every stage is timed at each map size, and its
+peak Python memory is recorded with tracemalloc. The results are written as
+JSON and can be compared against a stored baseline to catch regressions.
+
+    python benchmark.py --output results.json
+    python benchmark.py --baseline baseline.json
+"""
+import argparse
+import contextlib
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import time
+import tracemalloc
+import types
+
+GAME_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'game')
+sys.path.insert(0, GAME_DIR)
+
+# pylint: disable=wrong-import-position
+import panda3d.core as p3d  # noqa: E402
+
+from nitrogen.mapgen import bsp  # noqa: E402
+from nitrogen.mapgen import static  # noqa: E402
+from nitrogen.mapgen.dungeon import Dungeon  # noqa: E402
+from nitrogen.mapgen.tilegrid import FLOOR, ENCOUNTER, START, EXIT, TELEPORTER  # noqa: E402
+from nitrogen.navigation import NavGrid  # noqa: E402
+
+import standin  # noqa: E402
+
+
+DEFAULT_SIZES = [50, 200, 500, 1000]
+SEED = 1
+
+
+def _prepare_bsp(size):
+    return bsp.gen(size, size, seed=SEED)
+
+
+def _prepare_static(size):
+    return static.gen(size, size, seed=SEED)
+
+
+NAV_QUERIES = 100
+
+
+def _prepare_nav(size):
+    """Return an uncached NavGrid over a bsp map and NAV_QUERIES random (start, goal) pairs"""
+    tilemap = _prepare_bsp(size)
+    nav = NavGrid(types.SimpleNamespace(tilemap=tilemap), cache_size=0)
+    rng = random.Random(SEED)
+    tiles = [tuple(i) for i in tilemap.coords(FLOOR, ENCOUNTER, START, EXIT, TELEPORTER).tolist()]
+    queries = [(rng.choice(tiles), rng.choice(tiles)) for _ in range(NAV_QUERIES)]
+    return nav, queries
+
+
+def _run_nav(nav, queries):
+    for start, goal in queries:
+        nav.find_path(start, goal)
+
+
+STAGES = {
+    'split': (
+        lambda size: None,
+        lambda size, _: bsp.split(1, 1, size - 1, size - 1, 5, 5),
+    ),
+    'bsp.gen': (
+        lambda size: None,
+        lambda size, _: bsp.gen(size, size, seed=SEED),
+    ),
+    'static.gen': (
+        lambda size: None,
+        lambda size, _: static.gen(size, size, seed=SEED),
+    ),
+    'find_connected_components': (
+        _prepare_bsp,
+        lambda size, tilemap: bsp.find_connected_components(tilemap),
+    ),
+    'Dungeon.bsp': (
+        _prepare_bsp,
+        lambda size, tilemap: Dungeon('bsp', size, size, seed=SEED, tilemap=tilemap),
+    ),
+    'NavGrid.find_path': (
+        _prepare_nav,
+        lambda size, data: _run_nav(*data),
+    ),
+    'Dungeon.static': (
+        _prepare_static,
+        lambda size, tilemap: Dungeon('static', size, size, seed=SEED, tilemap=tilemap),
+    ),
+}
+
+
+def init_panda(model_path):
+    p3d.load_prc_file_data('', '\n'.join([
+        'window-type none',
+        'audio-library-name null',
+        'model-path {}'.format(model_path),
+    ]))
+
+
+def has_dungeon_models():
+    return bool(p3d.Loader.get_global_ptr().load_sync('dungeon.bam'))
+
+
+def run_stage(name, size, repeat):
+    prepare, run = STAGES[name]
+
+    # Silence the generators' progress output while timing
+    with open(os.devnull, 'w', encoding='utf8') as devnull, contextlib.redirect_stdout(devnull):
+        data = prepare(size)
+        times = []
+        for _ in range(repeat):
+            starttime = time.perf_counter()
+            run(size, data)
+            times.append(time.perf_counter() - starttime)
+
+        tracemalloc.start()
+        run(size, data)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+    return {
+        'stage': name,
+        'size': size,
+        'repeat': repeat,
+        'time': statistics.median(times),
+        'time_min': min(times),
+        'peak_memory': peak,
+    }
+
+
+def compare(results, baseline, tolerance, min_time):
+    basemap = {(i['stage'], i['size']): i for i in baseline['results']}
+    regressions = []
+    for result in results['results']:
+        base = basemap.get((result['stage'], result['size']))
+        if base is None:
+            continue
+
+        for key in ('time', 'peak_memory'):
+            ratio = result[key] / base[key] if base[key] else 1.0
+            result[key + '_ratio'] = ratio
+            if key == 'time' and base[key] < min_time:
+                # Too fast to time reliably
+                continue
+            if ratio > 1.0 + tolerance:
+                regressions.append((result['stage'], result['size'], key, ratio))
+
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES)
+    parser.add_argument('--stages', nargs='+', choices=sorted(STAGES), default=sorted(STAGES))
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--output', default='benchmark_results.json')
+    parser.add_argument('--baseline', help='results file to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='allowed slowdown relative to the baseline (0.2 = 20%%)')
+    parser.add_argument('--min-time', type=float, default=0.005,
+                        help='ignore timing regressions for stages faster than this (seconds)')
+    parser.add_argument('--model-path', default=os.path.join(GAME_DIR, 'assets'))
+    parser.add_argument('--stand-in-models', action='store_true',
+                        help='use generated boxes instead of dungeon.bam (see standin.py)')
+    args = parser.parse_args()
+    if args.stand_in_models:
+        args.model_path = standin.write_stand_in_models()
+
+    init_panda(args.model_path)
+    stages = args.stages
+    if any(i.startswith('Dungeon') for i in stages) and not has_dungeon_models():
+        print("Could not find dungeon.bam in {}, skipping Dungeon stages".format(args.model_path))
+        stages = [i for i in stages if not i.startswith('Dungeon')]
+
+    results = {
+        'meta': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'panda3d': p3d.PandaSystem.get_version_string(),
+            'timestamp': time.time(),
+        },
+        'results': [],
+    }
+
+    for size in args.sizes:
+        for stage in stages:
+            result = run_stage(stage, size, args.repeat)
+            results['results'].append(result)
+            print('{:<28}{:>6}  {:>10.4f}s  {:>10.1f}KiB'.format(
+                stage,
+                size,
+                result['time'],
+                result['peak_memory'] / 1024
+            ))
+
+    retcode = 0
+    if args.baseline:
+        with open(args.baseline, encoding='utf8') as basefile:
+            baseline = json.load(basefile)
+        regressions = compare(results, baseline, args.tolerance, args.min_time)
+        for stage, size, key, ratio in regressions:
+            print("Regression: {} at {} {} is {:.2f}x the baseline".format(stage, size, key, ratio))
+        retcode = 1 if regressions else 0
+
+    with open(args.output, 'w', encoding='utf8') as outfile:
+        json.dump(results, outfile, indent=4)
+
+    return retcode
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,12 +1,18 @@
 import os
 import sys
 
-from direct.showbase.ShowBase import ShowBase
 import panda3d.core as p3d
-import blenderpanda
-import inputmapper
 
-from nitrogen import gamestates
+from nitrogen import startup
+from nitrogen.gpucache import get_gpu_cache
+from nitrogen.timestep import FixedTimestep
+
+# Imported through startup so each one's cost can be reported
+ShowBase = startup.import_module('direct.showbase.ShowBase').ShowBase
+blenderpanda = startup.import_module('blenderpanda')
+inputmapper = startup.import_module('inputmapper')
+gamestates = startup.import_module('nitrogen.gamestates')
+assets = startup.import_module('nitrogen.assets')
 
 if hasattr(sys, 'frozen'):
     APP_ROOT_DIR = os.path.dirname(sys.executable)
@@ -35,8 +41,34 @@ for config_file in CONFIG_FILES:
 
 class GameApp(ShowBase):
     def __init__(self):
-        ShowBase.__init__(self)
-        blenderpanda.init(self)
+        with startup.timed('ShowBase'):
+            ShowBase.__init__(self)
+
+        with startup.timed('render manager'):
+            blenderpanda.init(self)
+
+        # Start reading models while the rest of the app is set up, the
+        # render manager puts the exported models on the model path
+        assets.get_asset_manager(self.taskMgr).prefetch('dungeon.bam')
+
+        if isinstance(self._bpbase.rendermanager, blenderpanda.rendermanager.BasicRenderManager):
+            # The basic render manager draws the scene onto a quad with an
+            # sRGB shader, warm that shader up with the rest. The quad is the
+            # parent of the camera that now draws the main display region.
+            cameras = [region.get_camera() for region in self.win.get_display_regions()]
+            post_quads = [
+                camera.get_parent() for camera in cameras
+                if not camera.is_empty() and camera.get_name() == 'filter-quad-cam'
+            ]
+            if post_quads:
+                shader = post_quads[0].get_shader()
+                # Shader.make() hands back the same (but modifiable) shader for the same source
+                srgb_shader = p3d.Shader.make(
+                    shader.get_language(),
+                    shader.get_text(p3d.Shader.ST_vertex),
+                    shader.get_text(p3d.Shader.ST_fragment)
+                )
+                get_gpu_cache().register('blenderpanda.srgb', lambda: srgb_shader)
 
         self.input_mapper = inputmapper.InputMapper(os.path.join(CONFIG_ROOT_DIR, 'input.conf'))
 
@@ -49,12 +81,39 @@ class GameApp(ShowBase):
         winprops.set_mouse_mode(p3d.WindowProperties.M_confined)
         self.win.request_properties(winprops)
 
-        self.current_state = gamestates.MainState()
+        # Loading phase: draw a frame that compiles shaders and uploads textures
+        # for registered resources, then get the first layer's textures and
+        # geometry onto the GPU before it is shown
+        gsg = self.win.get_gsg()
+        with startup.timed('GPU warm-up'):
+            get_gpu_cache().warm(gsg)
+            self.graphicsEngine.render_frame()
+
+        with startup.timed('MainState'):
+            self.current_state = gamestates.MainState()
+            self.render.prepare_scene(gsg)
+
+        self.timestep = FixedTimestep()
+
+        def restore_gamestate(task):
+            self.current_state.end_interpolation()
+            return task.cont
+        # Sorted before input and events so they see the simulated transforms
+        self.taskMgr.add(restore_gamestate, 'GameStateRestore', sort=-60)
 
         def update_gamestate(task):
-            self.current_state.update(p3d.ClockObject.get_global_clock().get_dt())
+            steps, alpha = self.timestep.advance(p3d.ClockObject.get_global_clock().get_dt())
+            for _ in range(steps):
+                self.current_state.update(self.timestep.step)
+            self.current_state.interpolate(alpha)
             return task.cont
-        self.taskMgr.add(update_gamestate, 'GameState')
+        # Sorted just before igLoop so drawing sees the interpolated transforms
+        self.taskMgr.add(update_gamestate, 'GameState', sort=40)
+
+        def report_startup(_task):
+            startup.report()
+        # Sorted after igLoop so the first frame has been drawn
+        self.taskMgr.add(report_startup, 'StartupReport', sort=60)
 
     def change_state(self, next_state):
         self.current_state.cleanup()
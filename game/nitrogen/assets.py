@@ -0,0 +1,138 @@
+import panda3d.core as p3d
+
+
+class AssetManager:
+    """Load every model file once and keep named sub-models around
+
+    Models can be prefetched with the loader's asynchronous requests. Requests
+    are polled from a task so that callbacks always run on the main thread; a
+    load() of a file that is still being prefetched waits for that request
+    instead of reading the file again.
+    """
+
+    def __init__(self, taskmgr=None, loader=None):
+        self.taskmgr = taskmgr
+        self.loader = loader if loader is not None else p3d.Loader.get_global_ptr()
+        self.hits = 0
+        self.misses = 0
+        self._models = {}
+        self._submodels = {}
+        self._derived = {}
+        self._pending = {}
+        self._task = None
+
+    def _add_model(self, filename, node):
+        model = p3d.NodePath(node)
+        if not model.is_empty():
+            # Models are placed by code, so nothing in them should start out hidden
+            for child in model.find_all_matches('**'):
+                child.show()
+        self._models[filename] = model
+        return model
+
+    def is_loaded(self, filename):
+        return filename in self._models
+
+    def _get_root(self, filename):
+        model = self._models.get(filename)
+        if model is not None:
+            return model
+
+        node = None
+        callbacks = []
+        pending = self._pending.pop(filename, None)
+        if pending is not None:
+            request, callbacks = pending
+            node = request.result()
+        if node is None:
+            # Not prefetched, or the prefetch failed (the model path may have
+            # changed since), so try again now
+            node = self.loader.load_sync(filename)
+        if node is None:
+            raise OSError("Could not find model {} on the model path".format(filename))
+
+        model = self._add_model(filename, node)
+        for callback in callbacks:
+            callback(model)
+        return model
+
+    def load(self, filename):
+        """Return the root of a model file, loading it now if needed"""
+        if filename in self._models:
+            self.hits += 1
+        else:
+            self.misses += 1
+        return self._get_root(filename)
+
+    def get_model(self, filename, name):
+        """Return the first node called name in a model file"""
+        key = (filename, name)
+        submodel = self._submodels.get(key)
+        if submodel is not None:
+            self.hits += 1
+            return submodel
+
+        self.misses += 1
+        submodel = self._get_root(filename).find('**/{}'.format(name))
+        self._submodels[key] = submodel
+        return submodel
+
+    def get_derived(self, key, factory):
+        """Return factory() computed once for key, for data built from models"""
+        if key in self._derived:
+            self.hits += 1
+            return self._derived[key]
+
+        self.misses += 1
+        value = factory()
+        self._derived[key] = value
+        return value
+
+    def prefetch(self, filename, callback=None):
+        """Start loading a model file in the background
+
+        callback is called with the model root once it is loaded. It is called
+        right away if the file is already loaded.
+        """
+        if filename in self._models:
+            if callback is not None:
+                callback(self._models[filename])
+            return
+
+        pending = self._pending.get(filename)
+        if pending is None:
+            request = self.loader.make_async_request(p3d.Filename(filename))
+            self.loader.load_async(request)
+            pending = (request, [])
+            self._pending[filename] = pending
+        if callback is not None:
+            pending[1].append(callback)
+
+        if self.taskmgr is not None and self._task is None:
+            self._task = self.taskmgr.add(self._poll_task, 'AssetPrefetch')
+
+    def poll(self):
+        """Finish any prefetched files that are done loading"""
+        for filename, (request, _) in list(self._pending.items()):
+            if request.done():
+                self._get_root(filename)
+        return bool(self._pending)
+
+    def _poll_task(self, task):
+        if self.poll():
+            return task.cont
+        self._task = None
+        return task.done
+
+
+_ASSET_MANAGER = None
+
+
+def get_asset_manager(taskmgr=None):
+    """Return the shared AssetManager, giving it taskmgr if it does not have one"""
+    global _ASSET_MANAGER  # pylint: disable=global-statement
+    if _ASSET_MANAGER is None:
+        _ASSET_MANAGER = AssetManager()
+    if taskmgr is not None and _ASSET_MANAGER.taskmgr is None:
+        _ASSET_MANAGER.taskmgr = taskmgr
+    return _ASSET_MANAGER
@@ -0,0 +1,194 @@
+import collections
+
+import numpy as np
+import panda3d.core as p3d
+
+from .mapgen import tilemesh
+from .mapgen.tilegrid import EMPTY
+
+
+FOV_RADIUS = p3d.ConfigVariableInt(
+    'fov-radius', 12,
+    'How many tiles the player can see'
+)
+
+
+# Transforms from octant space (col, row) to tile space as (colx, rowx, coly, rowy)
+_OCTANTS = [
+    (1, 0, 0, 1),
+    (0, 1, 1, 0),
+    (0, -1, 1, 0),
+    (-1, 0, 0, 1),
+    (-1, 0, 0, -1),
+    (0, -1, -1, 0),
+    (0, 1, -1, 0),
+    (1, 0, 0, -1),
+]
+
+
+class FieldOfView:
+    """Fog of war over a Dungeon using recursive shadowcasting
+
+    Visibility is only recomputed when the origin moves to another tile and
+    the visible tiles are cached per origin tile. The visible and explored
+    masks are (height, width) bool arrays, which are turned into a single
+    channel texture (unexplored, explored or visible per tile) in one upload.
+    """
+
+    CACHE_SIZE = 64
+    EXPLORED_LEVEL = 96
+    VISIBLE_LEVEL = 255
+
+    def __init__(self, dungeon, radius=None, cache_size=None):
+        self.dungeon = dungeon
+        self.radius = FOV_RADIUS.get_value() if radius is None else radius
+        self.cache_size = self.CACHE_SIZE if cache_size is None else cache_size
+        self.origin = None
+        self.hits = 0
+        self.misses = 0
+
+        tilemap = dungeon.tilemap
+        self.visible = np.zeros(tilemap.tiles.shape, dtype=bool)
+        self.explored = np.zeros(tilemap.tiles.shape, dtype=bool)
+        self._visible_tiles = np.zeros(0, dtype=np.int64)
+        self._cache = collections.OrderedDict()
+
+        # Pad the map with opaque tiles so rays never leave the grid
+        self._pad = self.radius + 1
+        opaque = np.pad(tilemap.tiles == EMPTY, self._pad, constant_values=True)
+        self._stride = opaque.shape[1]
+        self._opaque = opaque.reshape(-1).tolist()
+
+        self.texture = p3d.Texture('FieldOfView')
+        self.texture.setup_2d_texture(
+            tilemap.width,
+            tilemap.height,
+            p3d.Texture.T_unsigned_byte,
+            p3d.Texture.F_luminance
+        )
+        self.texture.set_wrap_u(p3d.SamplerState.WM_border_color)
+        self.texture.set_wrap_v(p3d.SamplerState.WM_border_color)
+        self.texture.set_border_color((0, 0, 0, 1))
+        self._dirty = True
+        self.upload()
+
+    def update(self, x, y):
+        """Move the origin to world position (x, y), return True if visibility changed"""
+        origin = self.dungeon.world_to_tile(x, y)
+        if origin == self.origin:
+            return False
+        self.origin = origin
+
+        tiles = self._cache.get(origin)
+        if tiles is not None:
+            self.hits += 1
+            self._cache.move_to_end(origin)
+        else:
+            self.misses += 1
+            tiles = self._compute(*origin)
+            self._cache[origin] = tiles
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+        visible = self.visible.reshape(-1)
+        visible[self._visible_tiles] = False
+        visible[tiles] = True
+        self.explored.reshape(-1)[tiles] = True
+        self._visible_tiles = tiles
+        self._dirty = True
+        return True
+
+    def _compute(self, tilex, tiley):
+        """Return the flat indices of the tiles visible from (tilex, tiley)"""
+        tilemap = self.dungeon.tilemap
+        if not (0 <= tilex < tilemap.width and 0 <= tiley < tilemap.height):
+            return np.zeros(0, dtype=np.int64)
+
+        origin = (tiley + self._pad) * self._stride + tilex + self._pad
+        lit = {origin}
+        for octant in _OCTANTS:
+            self._cast_light(origin, 1, 1.0, 0.0, octant, lit)
+
+        lit = np.fromiter(lit, dtype=np.int64, count=len(lit))
+        posy, posx = np.divmod(lit, self._stride)
+        posx -= self._pad
+        posy -= self._pad
+        inside = (posx >= 0) & (posx < tilemap.width) & (posy >= 0) & (posy < tilemap.height)
+        return posy[inside] * tilemap.width + posx[inside]
+
+    def _cast_light(self, origin, row, start, end, octant, lit):
+        if start < end:
+            return
+
+        opaque = self._opaque
+        stride = self._stride
+        radius = self.radius
+        radius_squared = radius * radius
+        colx, rowx, coly, rowy = octant
+        # Step between neighboring tiles along a row and between rows
+        colstep = colx + coly * stride
+        rowstep = -(rowx + rowy * stride)
+
+        new_start = start
+        for depth in range(row, radius + 1):
+            blocked = False
+            rowstart = origin + depth * rowstep
+            for col in range(-depth, 1):
+                left_slope = (col - 0.5) / (-depth + 0.5)
+                right_slope = (col + 0.5) / (-depth - 0.5)
+                if start < right_slope:
+                    continue
+                if end > left_slope:
+                    break
+
+                tile = rowstart + col * colstep
+                if col * col + depth * depth < radius_squared:
+                    lit.add(tile)
+
+                if blocked:
+                    if opaque[tile]:
+                        new_start = right_slope
+                    else:
+                        blocked = False
+                        start = new_start
+                elif opaque[tile] and depth < radius:
+                    # Scan the rows past the start of this wall separately
+                    blocked = True
+                    self._cast_light(origin, depth + 1, start, left_slope, octant, lit)
+                    new_start = right_slope
+            if blocked:
+                break
+
+    def upload(self):
+        """Copy the masks into the texture if they changed since the last upload"""
+        if not self._dirty:
+            return
+        levels = np.where(
+            self.visible,
+            self.VISIBLE_LEVEL,
+            np.where(self.explored, self.EXPLORED_LEVEL, 0)
+        ).astype(np.uint8)
+        self.texture.set_ram_image(levels.tobytes())
+        self._dirty = False
+
+    def apply_to(self, nodepath):
+        """Darken nodepath with the fog texture, projected over the dungeon in world space"""
+        tilemap = self.dungeon.tilemap
+        stage = p3d.TextureStage('FieldOfView')
+        stage.set_sort(100)
+        stage.set_mode(p3d.TextureStage.M_modulate)
+        nodepath.set_texture(stage, self.texture)
+        nodepath.set_tex_gen(stage, p3d.TexGenAttrib.M_world_position)
+
+        # Tile (x, y) covers world x - width / 2 - 0.5 to x - width / 2 + 0.5
+        width, height = tilemap.width, tilemap.height
+        transform = p3d.TransformState.make_pos_hpr_scale(
+            ((width / 2 + 0.5) / width, (height / 2 + 0.5) / height, 0),
+            (0, 0, 0),
+            (1 / width, 1 / height, 1)
+        )
+        nodepath.set_tex_transform(stage, transform)
+
+        # Instanced tiles use their own shader, which reads the same thing from inputs
+        nodepath.set_shader_input(tilemesh.FOV_TEXTURE_INPUT, self.texture, 1)
+        nodepath.set_shader_input(tilemesh.FOV_TRANSFORM_INPUT, transform.get_mat(), 1)
@@ -1,8 +1,36 @@
+import random
+
 from direct.showbase.DirectObject import DirectObject
 import panda3d.core as p3d
 
+from .assets import get_asset_manager
+from .fov import FieldOfView
+from .mapgen.cache import GenerationCache
+from .mapgen.chunked import ChunkedDungeon
 from .mapgen.dungeon import Dungeon
+from .layerstore import LayerStore
+from .navigation import NavGrid, FlowField
+from .prefetch import LayerPrefetcher
 from .rangeindicator import RangeIndicator
+from .spatialhash import SpatialHash
+
+
+MAPGEN_GENERATOR = p3d.ConfigVariableString(
+    'mapgen-generator', 'static',
+    'Tile generator to use for dungeon layers (static, bsp or endless)'
+)
+MAPGEN_SEED = p3d.ConfigVariableInt(
+    'mapgen-seed', -1,
+    'Seed used to generate dungeon layers, -1 picks a random seed'
+)
+MAPGEN_CACHE_DIR = p3d.ConfigVariableFilename(
+    'mapgen-cache-dir', '',
+    'Directory to cache generated tile maps in, leave empty to disable caching'
+)
+MAPGEN_CACHE_MAX_ENTRIES = p3d.ConfigVariableInt(
+    'mapgen-cache-max-entries', 256,
+    'Most tile maps to keep in mapgen-cache-dir, least recently used maps are removed first'
+)
 
 
 class GameState(DirectObject):
@@ -19,11 +47,19 @@ class GameState(DirectObject):
     def update(self, dt):
         pass
 
+    def interpolate(self, alpha):
+        """Place drawn nodes alpha of the way from the previous tick to the latest one"""
+
+    def end_interpolation(self):
+        """Put nodes moved by interpolate() back to where the latest tick left them"""
+
 
 class MainState(GameState):
     PLAYER_SPEED = 15
+    PLAYER_RADIUS = 0.3
     CAM_MOVE_BORDER = 0.8
     CAM_MOVE_SPEED = 50
+    BOX_RANGE = 5
 
     DUNGEON_SX = 50
     DUNGEON_SY = 50
@@ -38,8 +74,21 @@ class MainState(GameState):
         self.accept('ability3', self.toggle_range, [2])
         self.accept('ability4', self.toggle_range, [3])
 
-        self.mapgen = 'static'
-        dungeon = Dungeon(self.mapgen, self.DUNGEON_SX, self.DUNGEON_SY)
+        self.mapgen = MAPGEN_GENERATOR.get_value()
+        seed = MAPGEN_SEED.get_value()
+        if seed < 0:
+            seed = random.randrange(2 ** 32)
+        print("Using map generation seed:", seed)
+        self._layer_seeds = random.Random(seed)
+        cache_dir = MAPGEN_CACHE_DIR.get_value()
+        self.gen_cache = None
+        if cache_dir:
+            self.gen_cache = GenerationCache(
+                cache_dir.to_os_specific(),
+                MAPGEN_CACHE_MAX_ENTRIES.get_value()
+            )
+        self.prefetcher = LayerPrefetcher(base.taskMgr)
+        dungeon = self.create_dungeon(self._layer_seeds.getrandbits(32))
         dungeon.model_root.reparent_to(self.root_node)
 
         dlight = p3d.DirectionalLight('sun')
@@ -59,13 +108,14 @@ class MainState(GameState):
         dlnp2 = self.root_node.attach_new_node(dlight2)
         self.root_node.set_light(dlnp2)
 
-        loader = p3d.Loader.get_global_ptr()
-        player = p3d.NodePath(loader.load_sync('dungeon.bam')).find('**/MonsterSpawn').node()
-        playernp = self.root_node.attach_new_node(player)
+        # The cached node is instanced under every spawner, so move a copy of it
+        playernp = get_asset_manager().get_model('dungeon.bam', 'MonsterSpawn').copy_to(
+            self.root_node
+        )
         playernp.set_pos(dungeon.player_start)
         playernp.set_z(1.5)
         self.player_ranges = [
-            RangeIndicator('box', length=5, width=1),
+            RangeIndicator('box', length=self.BOX_RANGE, width=1),
             RangeIndicator('circle', radius=2),
             RangeIndicator('circle', radius=3),
             RangeIndicator('circle', radius=4),
@@ -77,14 +127,77 @@ class MainState(GameState):
         # self.root_node.ls()
         # self.root_node.analyze()
 
-        self.dungeons = [dungeon]
+        self.layers = LayerStore()
+        self.layers.add(0, dungeon)
+        self.layers.set_current(0)
         self.dungeon_idx = 0
         self.dungeon = dungeon
+        self.nav = None
+        self.flow_field = None
+        self.fov = None
+        self.entities = None
+        self.setup_layer(dungeon)
         self.player = playernp
         self.last_tele_loc = None
         self.target = self.player.get_pos()
+        self.destination = None
+        self.waypoints = []
         self.debug_cam = False
+        # (player pos, player quat, camera pos) before and after the latest tick
+        self._prev_transforms = None
+        self._sim_transforms = None
+        self._interpolated = False
         self.reset_camera()
+        self.prefetch_next_dungeon()
+
+    def cleanup(self):
+        self.prefetcher.shutdown()
+        super().cleanup()
+
+    def create_dungeon(self, seed):
+        if self.mapgen == 'endless':
+            return ChunkedDungeon(seed=seed, gen_cache=self.gen_cache)
+
+        return Dungeon(
+            self.mapgen,
+            self.DUNGEON_SX,
+            self.DUNGEON_SY,
+            seed=seed,
+            gen_cache=self.gen_cache
+        )
+
+    def setup_layer(self, dungeon):
+        if isinstance(dungeon, ChunkedDungeon):
+            # Chunks come and go, so endless layers keep straight-line movement and no fog
+            self.nav = None
+            self.flow_field = None
+            self.fov = None
+            self.entities = None
+            return
+
+        self.nav = NavGrid(dungeon)
+        # Shared by everything chasing the player
+        self.flow_field = FlowField(dungeon)
+        self.fov = FieldOfView(dungeon)
+        self.fov.apply_to(dungeon.model_root)
+        self.entities = SpatialHash(dungeon)
+        for spawner in dungeon.spawners:
+            self.entities.insert(spawner, *spawner.get_pos().xy)
+
+    def prefetch_next_dungeon(self):
+        next_didx = self.dungeon_idx + 1
+        if next_didx in self.layers or self.mapgen == 'endless':
+            # Endless layers only build the chunks around the player up front
+            return
+
+        self.prefetcher.request(
+            next_didx,
+            self.mapgen,
+            self.DUNGEON_SX,
+            self.DUNGEON_SY,
+            self._layer_seeds.getrandbits(32),
+            self.gen_cache
+        )
 
     def toggle_debug_cam(self):
         if not self.debug_cam:
@@ -109,14 +222,55 @@ class MainState(GameState):
         base.camera.set_mat(p3d.LMatrix4.ident_mat())
         base.cam.set_pos(campos)
         base.cam.look_at(self.player.get_pos())
+        # Jump straight there instead of interpolating from the old spot, this
+        # also runs from event handlers between ticks
+        self._sim_transforms = self.get_transforms()
+        self._prev_transforms = self._sim_transforms
+
+    def get_transforms(self):
+        return (
+            self.player.get_pos(),
+            self.player.get_quat(),
+            base.cam.get_pos(),
+        )
 
     def update(self, dt):
+        self._prev_transforms = self.get_transforms()
+        self.simulate(dt)
+        self._sim_transforms = self.get_transforms()
+
+    def interpolate(self, alpha):
+        prevpos, prevquat, prevcampos = self._prev_transforms
+        simpos, simquat, simcampos = self._sim_transforms
+        # Take the short way around
+        if prevquat.dot(simquat) < 0:
+            simquat = -simquat
+        quat = prevquat + (simquat - prevquat) * alpha
+        quat.normalize()
+
+        self.player.set_pos_quat(prevpos + (simpos - prevpos) * alpha, quat)
+        base.cam.set_pos(prevcampos + (simcampos - prevcampos) * alpha)
+        self._interpolated = True
+
+    def end_interpolation(self):
+        if not self._interpolated:
+            return
+
+        simpos, simquat, simcampos = self._sim_transforms
+        self.player.set_pos_quat(simpos, simquat)
+        base.cam.set_pos(simcampos)
+        self._interpolated = False
+
+    def simulate(self, dt):
+        """Advance the game by one tick of dt seconds"""
         # Update player position
         movvec = self.target - self.player.get_pos()
         newpos = self.player.get_pos()
         if movvec.length_squared() < 0.4:
             newpos.set_x(self.target.x)
             newpos.set_y(self.target.y)
+            if self.waypoints:
+                self.next_waypoint()
         else:
             movvec.normalize()
             movvec *= self.PLAYER_SPEED * dt
@@ -124,14 +278,34 @@ class MainState(GameState):
             newpos.set_y(self.player.get_y() + movvec.y)
             self.player.look_at(newpos)
 
-        if self.dungeon.is_walkable(*newpos.xy):
-            self.player.set_pos(newpos)
+        # Sweep the move so the player slides along walls instead of passing through them
+        curpos = self.player.get_pos()
+        newpos.x, newpos.y = self.dungeon.move_and_slide(
+            curpos.x,
+            curpos.y,
+            newpos.x - curpos.x,
+            newpos.y - curpos.y,
+            self.PLAYER_RADIUS
+        )
+        self.player.set_pos(newpos)
+        self.clip_ranges()
+
+        if isinstance(self.dungeon, ChunkedDungeon):
+            self.dungeon.update_focus(*self.player.get_pos().xy)
+        else:
+            self.flow_field.set_goal(*self.player.get_pos().xy)
+            if self.fov.update(*self.player.get_pos().xy):
+                self.fov.upload()
 
         if self.dungeon.is_exit(*newpos.xy):
             next_didx = self.dungeon_idx + 1
-            if next_didx >= len(self.dungeons):
-                # Create a new dungeon
-                self.dungeons.append(Dungeon(self.mapgen, self.DUNGEON_SX, self.DUNGEON_SY))
+            if next_didx not in self.layers:
+                if self.mapgen == 'endless':
+                    next_dungeon = self.create_dungeon(self._layer_seeds.getrandbits(32))
+                else:
+                    # Grab the new dungeon from the prefetcher
+                    next_dungeon = self.prefetcher.get(next_didx)
+                self.layers.add(next_didx, next_dungeon)
             self.switch_to_dungeon(next_didx)
 
         if self.last_tele_loc is not None:
@@ -146,6 +320,9 @@ class MainState(GameState):
                 self.target = p3d.LVector3(newpos)
                 self.player.set_pos(newpos)
                 self.reset_camera()
+                if self.waypoints:
+                    # Continue on from the other side of the teleporter
+                    self.set_destination(*self.destination)
 
         if not self.debug_cam and base.mouseWatcherNode.has_mouse():
             mousex, mousey = base.mouseWatcherNode.get_mouse()
@@ -169,6 +346,37 @@ class MainState(GameState):
             campos.y += camdelta.y
             base.cam.set_pos(campos)
 
+    def clip_ranges(self):
+        """Stop box range indicators at the first wall in front of the player"""
+        playerpos = self.player.get_pos()
+        forward = self.root_node.get_relative_vector(self.player, p3d.LVector3.forward())
+        for rangeindicator in self.player_ranges:
+            if rangeindicator.shape != 'box' or not rangeindicator.visible:
+                continue
+            hit = self.dungeon.raycast(
+                playerpos.x,
+                playerpos.y,
+                playerpos.x + forward.x * self.BOX_RANGE,
+                playerpos.y + forward.y * self.BOX_RANGE
+            )
+            reach = self.BOX_RANGE if hit is None else hit.fraction * self.BOX_RANGE
+            # Keep a sliver so the card never gets a singular scale
+            rangeindicator.length = max(reach, 0.01)
+
+    def entities_in_range(self, ability):
+        """Return the entities covered by an ability's range indicator"""
+        if self.entities is None:
+            return []
+        rangeindicator = self.player_ranges[ability]
+        playerpos = self.player.get_pos(self.root_node)
+        return self.entities.query_shape(
+            rangeindicator.shape,
+            playerpos.x,
+            playerpos.y,
+            self.player.get_h(self.root_node),
+            **rangeindicator.params
+        )
+
     def move_player(self):
         if not base.mouseWatcherNode.has_mouse() or self.debug_cam:
             return
@@ -183,17 +391,39 @@ class MainState(GameState):
         plane = p3d.Plane(p3d.LVector3.up(), p3d.LPoint3())
         worldpos = p3d.LPoint3()
         if plane.intersects_line(worldpos, near, far):
-            self.target.set_x(worldpos.x)
-            self.target.set_y(worldpos.y)
+            self.set_destination(worldpos.x, worldpos.y)
+
+    def set_destination(self, x, y):
+        if self.nav is None:
+            self.target.set_x(x)
+            self.target.set_y(y)
+            return
+
+        waypoints = self.nav.find_world_path(self.player.get_pos().xy, (x, y))
+        if waypoints is None:
+            # Nowhere to go
+            return
+
+        self.destination = (x, y)
+        self.waypoints = waypoints
+        self.next_waypoint()
+
+    def next_waypoint(self):
+        x, y = self.waypoints.pop(0)
+        self.target.set_x(x)
+        self.target.set_y(y)
 
     def switch_to_dungeon(self, dungeon_idx):
         # Switch to next layer
         print("Switching to dungeon layer {}".format(dungeon_idx))
         self.dungeon.model_root.detach_node()
-        self.dungeon = self.dungeons[dungeon_idx]
+        self.dungeon = self.layers.set_current(dungeon_idx)
         self.dungeon.model_root.reparent_to(self.root_node)
         self.dungeon_idx = dungeon_idx
+        self.setup_layer(self.dungeon)
+        self.waypoints = []
         self.player.set_pos(self.dungeon.player_start)
         self.player.set_z(1.5)
         self.target = self.player.get_pos()
         self.reset_camera()
+        self.prefetch_next_dungeon()
@@ -0,0 +1,41 @@
+class GpuCache:
+    """Accessors for shaders and textures that are made on first use
+
+    Modules register an accessor for every GPU resource they will need instead
+    of making it at import time. Accessors make their resource the first time
+    they are called and return the same object afterwards. warm() calls them
+    and queues the results on a GSG, so shaders are compiled and textures are
+    uploaded by the next rendered frame (a loading frame) rather than by the
+    first frame that draws them.
+    """
+
+    def __init__(self):
+        self._accessors = {}
+
+    def register(self, name, accessor):
+        self._accessors[name] = accessor
+
+    def get(self, name):
+        """Return the resource registered as name, making it if needed"""
+        return self._accessors[name]()
+
+    def warm(self, gsg, names=None):
+        """Make the named resources (all by default) and queue them for preparing on gsg"""
+        if names is None:
+            names = list(self._accessors)
+
+        prepared_objects = gsg.get_prepared_objects() if gsg is not None else None
+        for name in names:
+            resource = self.get(name)
+            if prepared_objects is not None:
+                resource.prepare(prepared_objects)
+
+
+_GPU_CACHE = None
+
+
+def get_gpu_cache():
+    global _GPU_CACHE  # pylint: disable=global-statement
+    if _GPU_CACHE is None:
+        _GPU_CACHE = GpuCache()
+    return _GPU_CACHE
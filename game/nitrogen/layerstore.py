@@ -0,0 +1,176 @@
+import collections
+import time
+import zlib
+
+import panda3d.core as p3d
+
+from .mapgen import tilemesh
+from .mapgen.chunked import ChunkedDungeon
+from .mapgen.dungeon import Dungeon
+
+
+LAYER_HISTORY = p3d.ConfigVariableInt(
+    'layer-history', 2,
+    'Number of previously visited dungeon layers to keep fully built'
+)
+LAYER_MEMORY_BUDGET = p3d.ConfigVariableInt(
+    'layer-memory-budget', 64,
+    'Memory in MiB that built dungeon layers may use before older ones are shrunk'
+)
+
+
+def estimate_size(dungeon, seen=None):
+    """Rough number of bytes used by a dungeon's tile maps and geometry
+
+    Vertex and index arrays and textures shared between nodes (such as the
+    single tile Geom drawn by every instanced chunk) are counted once. Pass
+    the same seen set to several calls to count them once across dungeons.
+    """
+    if seen is None:
+        seen = set()
+    if isinstance(dungeon, ChunkedDungeon):
+        return sum(estimate_size(chunk, seen) for chunk in dungeon.chunks.values())
+
+    def count_once(data):
+        # Keyed by the underlying object, Python wrappers are made per call
+        if data.this in seen:
+            return 0
+        seen.add(data.this)
+        return data.get_data_size_bytes()
+
+    size = dungeon.tilemap.tiles.nbytes
+    for geomnp in dungeon.model_root.find_all_matches('**/+GeomNode'):
+        geomnode = geomnp.node()
+        for idx in range(geomnode.get_num_geoms()):
+            geom = geomnode.get_geom(idx)
+            vdata = geom.get_vertex_data()
+            for arrayidx in range(vdata.get_num_arrays()):
+                size += count_once(vdata.get_array(arrayidx))
+            for primidx in range(geom.get_num_primitives()):
+                vertices = geom.get_primitive(primidx).get_vertices()
+                if vertices is not None:
+                    size += count_once(vertices)
+
+    textures = list(dungeon.model_root.find_all_textures())
+    # Instanced tiles keep their offsets in shader input textures
+    for geomnp in dungeon.model_root.find_all_matches('**/+GeomNode'):
+        offsets = geomnp.get_shader_input(tilemesh.TILE_OFFSETS_INPUT)
+        if offsets.get_value_type() == p3d.ShaderInput.M_texture:
+            textures.append(offsets.get_texture())
+    for texture in textures:
+        if texture.this not in seen:
+            seen.add(texture.this)
+            size += texture.get_ram_image_size()
+
+    return size
+
+
+class LayerStore:
+    """Dungeon layers by index, only the most recently used ones fully built
+
+    The current layer and the last live_layers layers keep their scene graph.
+    Older layers, and any layer that pushes the live ones over memory_budget
+    bytes, are shrunk to a compressed tile map and seed (or just the seed
+    for endless layers) and rebuilt when they are needed again.
+    """
+
+    def __init__(self, live_layers=None, memory_budget=None):
+        if live_layers is None:
+            live_layers = LAYER_HISTORY.get_value()
+        if memory_budget is None:
+            memory_budget = LAYER_MEMORY_BUDGET.get_value() * 1024 * 1024
+        self.live_layers = live_layers
+        self.memory_budget = memory_budget
+        self.current = None
+        self.evictions = 0
+        self.rebuilds = 0
+        self.rebuild_time = 0.0
+        self.last_rebuild_time = 0.0
+        self._live = collections.OrderedDict()
+        self._sizes = {}
+        self._records = {}
+
+    def __contains__(self, idx):
+        return idx in self._live or idx in self._records
+
+    def __len__(self):
+        return len(self._live) + len(self._records)
+
+    def is_live(self, idx):
+        return idx in self._live
+
+    def add(self, idx, dungeon):
+        self._records.pop(idx, None)
+        self._live[idx] = dungeon
+        self._sizes[idx] = estimate_size(dungeon)
+        self._trim(idx)
+
+    def get(self, idx):
+        """Return the layer at idx, rebuilding it if it was shrunk"""
+        if idx in self._live:
+            self._live.move_to_end(idx)
+            return self._live[idx]
+
+        starttime = time.perf_counter()
+        dungeon = self._rebuild(self._records.pop(idx))
+        self.last_rebuild_time = time.perf_counter() - starttime
+        self.rebuild_time += self.last_rebuild_time
+        self.rebuilds += 1
+
+        self._live[idx] = dungeon
+        self._sizes[idx] = estimate_size(dungeon)
+        self._trim(idx)
+        return dungeon
+
+    def set_current(self, idx):
+        """Make idx the layer that is never shrunk and return it"""
+        if self.current in self._live:
+            # Endless layers grow and shrink while they are played
+            self._sizes[self.current] = estimate_size(self._live[self.current])
+        dungeon = self.get(idx)
+        self.current = idx
+        self._trim(idx)
+        return dungeon
+
+    def live_size(self):
+        return sum(self._sizes.values())
+
+    def memory_usage(self):
+        """Estimated bytes used by live layers and shrunk records"""
+        return self.live_size() + sum(len(i.get('tiles', b'')) for i in self._records.values())
+
+    def _trim(self, keep):
+        # Least recently used first, the current layer and keep always stay
+        candidates = [i for i in self._live if i not in (self.current, keep)]
+        excess = len(candidates) - self.live_layers
+        for idx in candidates:
+            if excess <= 0 and self.live_size() <= self.memory_budget:
+                break
+            self._evict(idx)
+            excess -= 1
+
+    def _evict(self, idx):
+        dungeon = self._live.pop(idx)
+        del self._sizes[idx]
+        if isinstance(dungeon, ChunkedDungeon):
+            record = {
+                'chunked': (
+                    dungeon.chunk_generator,
+                    dungeon.seed,
+                    dungeon.gen_cache,
+                    dict(dungeon.gen_params)
+                ),
+            }
+        else:
+            record = {'tiles': zlib.compress(dungeon.dumps())}
+        self._records[idx] = record
+        dungeon.model_root.remove_node()
+        self.evictions += 1
+
+    @staticmethod
+    def _rebuild(record):
+        if 'chunked' in record:
+            chunk_generator, seed, gen_cache, gen_params = record['chunked']
+            return ChunkedDungeon(chunk_generator, seed=seed, gen_cache=gen_cache, **gen_params)
+
+        return Dungeon.from_buffer(zlib.decompress(record['tiles']))
@@ -1,5 +1,9 @@
 __all__ = [
-    'dungeon'
+    'chunked',
+    'dungeon',
+    'tilegrid',
 ]
 
+from . import chunked
 from . import dungeon
+from . import tilegrid
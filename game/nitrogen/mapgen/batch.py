@@ -0,0 +1,212 @@
+"""Generate many maps in parallel and report statistics about them
+
+Per-seed statistics are streamed as JSON lines or CSV and a summary with
+percentiles is printed at the end:
+
+    python -m nitrogen.mapgen.batch bsp --count 10000 --output stats.jsonl
+"""
+import argparse
+from concurrent import futures
+import contextlib
+import csv
+import json
+import os
+import random
+import sys
+import time
+
+from . import bsp
+from .cache import get_generator
+from .tilegrid import EMPTY, FLOOR, ENCOUNTER, START, EXIT, TELEPORTER
+
+
+FIELDS = [
+    'seed',
+    'ok',
+    'error',
+    'time',
+    'islands',
+    'teleporters',
+    'encounters',
+    'floor_ratio',
+]
+NUMERIC_FIELDS = ['time', 'islands', 'teleporters', 'encounters', 'floor_ratio']
+PERCENTILES = [0, 50, 90, 99, 100]
+
+
+def map_stats(tilemap):
+    islands, _ = bsp.find_connected_components(
+        tilemap,
+        codes=(FLOOR, ENCOUNTER, START, EXIT, TELEPORTER)
+    )
+    return {
+        'islands': len(islands),
+        'teleporters': len(tilemap.teleporter_pairs()),
+        'encounters': tilemap.count(ENCOUNTER),
+        'floor_ratio': 1.0 - tilemap.count(EMPTY) / (tilemap.width * tilemap.height),
+    }
+
+
+def gen_stats(generator, width, height, seeds, params):
+    results = []
+    with open(os.devnull, 'w', encoding='utf8') as devnull:
+        for seed in seeds:
+            stats = dict.fromkeys(FIELDS)
+            stats['seed'] = seed
+            starttime = time.perf_counter()
+            try:
+                with contextlib.redirect_stdout(devnull):
+                    tilemap = get_generator(generator).gen(width, height, seed=seed, **params)
+            except Exception as exc:  # pylint: disable=broad-except
+                stats['ok'] = False
+                stats['error'] = '{}: {}'.format(type(exc).__name__, exc)
+                stats['time'] = time.perf_counter() - starttime
+            else:
+                stats['ok'] = True
+                stats['time'] = time.perf_counter() - starttime
+                stats.update(map_stats(tilemap))
+            results.append(stats)
+
+    return results
+
+
+class StatsAggregator:
+    """Summarize a stream of per-seed statistics in constant memory
+
+    Percentiles are computed from a fixed-size reservoir sample, so they are
+    exact until more than RESERVOIR_SIZE maps have been generated.
+    """
+
+    RESERVOIR_SIZE = 10000
+
+    def __init__(self):
+        self.count = 0
+        self.failures = {}
+        self._rng = random.Random(0)
+        self._seen = 0
+        self._reservoir = []
+
+    def add(self, stats):
+        self.count += 1
+        if not stats['ok']:
+            error = stats['error'].split(':', 1)[0]
+            self.failures[error] = self.failures.get(error, 0) + 1
+            return
+
+        values = [stats[i] for i in NUMERIC_FIELDS]
+        self._seen += 1
+        if len(self._reservoir) < self.RESERVOIR_SIZE:
+            self._reservoir.append(values)
+        else:
+            idx = self._rng.randrange(self._seen)
+            if idx < self.RESERVOIR_SIZE:
+                self._reservoir[idx] = values
+
+    def summary(self):
+        percentiles = {}
+        for idx, field in enumerate(NUMERIC_FIELDS):
+            values = sorted(i[idx] for i in self._reservoir)
+            if not values:
+                continue
+            percentiles[field] = {
+                'p{}'.format(pct): values[min(len(values) - 1, pct * len(values) // 100)]
+                for pct in PERCENTILES
+            }
+
+        num_failures = sum(self.failures.values())
+        return {
+            'count': self.count,
+            'failures': num_failures,
+            'failure_rate': num_failures / self.count if self.count else 0.0,
+            'failures_by_type': self.failures,
+            'percentiles': percentiles,
+        }
+
+
+def run_batch(generator, width, height, seeds, params, workers=None, batch_size=16):
+    """Yield statistics for every seed, generating maps in a process pool
+
+    Only a bounded number of batches are queued at once, so memory use does
+    not depend on the number of seeds.
+    """
+    workers = workers or os.cpu_count() or 1
+    seeds = iter(seeds)
+
+    def next_batch():
+        batch = []
+        for seed in seeds:
+            batch.append(seed)
+            if len(batch) == batch_size:
+                break
+        return batch
+
+    with futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = set()
+        while True:
+            while len(pending) < workers * 2:
+                batch = next_batch()
+                if not batch:
+                    break
+                pending.add(executor.submit(gen_stats, generator, width, height, batch, params))
+            if not pending:
+                break
+
+            done, pending = futures.wait(pending, return_when=futures.FIRST_COMPLETED)
+            for future in done:
+                yield from future.result()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('generator', choices=['bsp', 'static'])
+    parser.add_argument('--count', type=int, default=1000, help='number of maps to generate')
+    parser.add_argument('--first-seed', type=int, default=0)
+    parser.add_argument('--width', type=int, default=50)
+    parser.add_argument('--height', type=int, default=50)
+    parser.add_argument('--param', action='append', default=[], metavar='NAME=VALUE',
+                        help='extra generator parameter, the value is parsed as JSON')
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--format', choices=['jsonl', 'csv'], default='jsonl')
+    parser.add_argument('--output', default='-', help='per-seed statistics file (- for stdout)')
+    parser.add_argument('--summary', help='also write the summary as JSON to this file')
+    args = parser.parse_args(argv)
+
+    params = {}
+    for param in args.param:
+        name, value = param.split('=', 1)
+        params[name] = json.loads(value)
+
+    seeds = range(args.first_seed, args.first_seed + args.count)
+    aggregator = StatsAggregator()
+
+    if args.output == '-':
+        outstream = sys.stdout
+    else:
+        outstream = open(args.output, 'w', encoding='utf8', newline='')
+
+    try:
+        if args.format == 'csv':
+            writer = csv.DictWriter(outstream, FIELDS)
+            writer.writeheader()
+            write = writer.writerow
+        else:
+            def write(stats):
+                outstream.write(json.dumps(stats) + '\n')
+
+        for stats in run_batch(args.generator, args.width, args.height, seeds, params,
+                               args.workers):
+            write(stats)
+            aggregator.add(stats)
+    finally:
+        if outstream is not sys.stdout:
+            outstream.close()
+
+    summary = aggregator.summary()
+    print(json.dumps(summary, indent=4), file=sys.stderr)
+    if args.summary:
+        with open(args.summary, 'w', encoding='utf8') as summaryfile:
+            json.dump(summary, summaryfile, indent=4)
+
+
+if __name__ == '__main__':
+    main()
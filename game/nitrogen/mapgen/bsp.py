@@ -1,7 +1,13 @@
 from collections import namedtuple
 import random
 import time
-import sys
+
+import numpy as np
+
+from .tilegrid import TileGrid, EMPTY, FLOOR, ENCOUNTER, START, EXIT
+
+
+VERSION = 4
 
 
 Room = namedtuple('Room', 'x y width height')
@@ -17,57 +23,74 @@ class Vertex:
         self.island_idx = island_idx
 
 
-def find_connected_components(dmap):
-    graph = {}
-
-    rlimit = sys.getrecursionlimit()
-    # print(rlimit, len(dmap)*len(dmap[0]))
-    sys.setrecursionlimit(len(dmap) * len(dmap[0]))
-
-    for idxy, tiley in enumerate(dmap):
-        for idxx, tilex in enumerate(tiley):
-            if tilex in ('#', '$'):
-                coord = (idxy, idxx)
-                graph[coord] = Vertex(0, tilex, coord, -1)
-
-    def dfs_visit(vert, island_idx):
-        def adj():
-            vert_list = []
-
-            if dmap[vert.coord[0] + 1][vert.coord[1]] in ('#', '$'):
-                vert_list.append(graph[(vert.coord[0] + 1, vert.coord[1])])
-            if dmap[vert.coord[0]][vert.coord[1] + 1] in ('#', '$'):
-                vert_list.append(graph[(vert.coord[0], vert.coord[1] + 1)])
-            if dmap[vert.coord[0] - 1][vert.coord[1]] in ('#', '$'):
-                vert_list.append(graph[(vert.coord[0] - 1, vert.coord[1])])
-            if dmap[vert.coord[0]][vert.coord[1] - 1] in ('#', '$'):
-                vert_list.append(graph[(vert.coord[0], vert.coord[1] - 1)])
-
-            return vert_list
-
-        retval = []
-
-        vert.vstate = 1
-        for next_vert in adj():
-            if next_vert.vstate == 0:
-                retval += dfs_visit(next_vert, island_idx)
-
-        vert.island_idx = island_idx
-        vert.vstate = 2
-        return retval + [vert]
-
-    island_idx = 0
-    connected_components = []
-    for vert in graph.values():
-        if vert.vstate == 0:
-            connected_components.append(dfs_visit(vert, island_idx))
-            island_idx += 1
-
-    sys.setrecursionlimit(rlimit)
-    return connected_components
-
-
-def split(startx, starty, endx, endy, min_room_x, min_room_y):
+def _label_islands(mask):
+    """Label the tiles of mask, return (labels, number of islands)
+
+    Runs of tiles along each row get their own id, runs that touch the run
+    below are joined with a union-find done on whole arrays at once, then
+    islands are numbered in the order their first tile appears in the map.
+    """
+    height, width = mask.shape
+    starts = mask.copy()
+    starts[:, 1:] &= ~mask[:, :-1]
+    runs = np.cumsum(starts.reshape(-1), dtype=np.int32).reshape(height, width) - 1
+
+    # Runs joined through a tile and the tile below it
+    below = mask[:-1] & mask[1:]
+    upper = runs[:-1][below]
+    lower = runs[1:][below]
+
+    # Hook the larger of two roots onto the smaller one and fully compress
+    # the paths after every round, so parent is always a root
+    parent = np.arange(int(starts.sum()), dtype=np.int32)
+    while True:
+        rootu = parent[upper]
+        rootl = parent[lower]
+        apart = rootu != rootl
+        if not apart.any():
+            break
+        rootu = rootu[apart]
+        rootl = rootl[apart]
+        np.minimum.at(parent, np.maximum(rootu, rootl), np.minimum(rootu, rootl))
+        while True:
+            grandparent = parent[parent]
+            if np.array_equal(grandparent, parent):
+                break
+            parent = grandparent
+
+    # A root is the first run of its island, so sorting them keeps map order
+    roots, island_of_run = np.unique(parent, return_inverse=True)
+    labels = np.full((height, width), -1, dtype=np.int32)
+    labels[mask] = island_of_run.astype(np.int32)[runs[mask]]
+    return labels, len(roots)
+
+
+def find_connected_components(dmap, codes=(FLOOR, ENCOUNTER)):
+    """Find islands of orthogonally connected tiles with one of codes
+
+    Returns (islands, labels). Each island is an (n, 2) array of the (y, x)
+    coordinates of its tiles in row major order, and labels is a (height,
+    width) grid of island indices with -1 for tiles outside every island.
+    """
+    labels, num_islands = _label_islands(dmap.mask(*codes))
+
+    flat = labels.reshape(-1)
+    tiles = np.flatnonzero(flat >= 0)
+    tiles = tiles[np.argsort(flat[tiles], kind='stable')]
+    coords = np.stack(np.divmod(tiles, dmap.width), axis=1)
+    ends = np.cumsum(np.bincount(flat[tiles], minlength=num_islands))[:-1]
+    return np.split(coords, ends) if num_islands else [], labels
+
+
+def island_vertices(dmap, island, island_idx):
+    """Return a Vertex for every tile of an island from find_connected_components"""
+    return [
+        Vertex(2, int(dmap.tiles[posy, posx]), (posy, posx), island_idx)
+        for posy, posx in island.tolist()
+    ]
+
+
+def split(startx, starty, endx, endy, min_room_x, min_room_y, rng=random):
     rangex = endx - startx
     rangey = endy - starty
 
@@ -76,129 +99,279 @@ def split(startx, starty, endx, endy, min_room_x, min_room_y):
 
     if rangex > rangey:
         # Split x
-        part = random.randint(int(rangex * 0.25), int(rangex * 0.75))
-        return split(startx, starty, startx + part, endy, min_room_x, min_room_y) + \
-            split(startx + part, starty, endx, endy, min_room_x, min_room_y)
+        part = rng.randint(int(rangex * 0.25), int(rangex * 0.75))
+        return split(startx, starty, startx + part, endy, min_room_x, min_room_y, rng) + \
+            split(startx + part, starty, endx, endy, min_room_x, min_room_y, rng)
 
     # Split y
-    part = random.randint(int(rangey * 0.25), int(rangey * 0.75))
-    return split(startx, starty, endx, starty + part, min_room_x, min_room_y) + \
-        split(startx, starty + part, endx, endy, min_room_x, min_room_y)
+    part = rng.randint(int(rangey * 0.25), int(rangey * 0.75))
+    return split(startx, starty, endx, starty + part, min_room_x, min_room_y, rng) + \
+        split(startx, starty + part, endx, endy, min_room_x, min_room_y, rng)
+
+
+def _erosion_chance(num_empty):
+    # Chance that random.random() * factor > 0.5 where factor = 0.5 + num_empty
+    return 1.0 - 0.5 / (0.5 + num_empty)
+
+
+_EROSION_CHANCES = [_erosion_chance(i) for i in range(5)]
+
+
+def erode(dungeon, count, rng=random):
+    """Turn count floor tiles into empty tiles
+
+    Tiles with more empty neighbors are more likely to be removed. Instead of
+    rejection sampling the whole map, floor tiles are kept in buckets by their
+    number of empty neighbors, and buckets are picked by their total weight.
+    """
+    width = dungeon.width
+    height = dungeon.height
+    floormask = dungeon.mask(FLOOR, ENCOUNTER)
+    tiles = dungeon.tiles.reshape(-1)
+    empty_counts = dungeon.neighbor_counts(EMPTY).reshape(-1).tolist()
+
+    buckets = [[] for _ in _EROSION_CHANCES]
+    bucket_pos = {}
+    for idx in np.flatnonzero(floormask).tolist():
+        bucket = buckets[empty_counts[idx]]
+        bucket_pos[idx] = len(bucket)
+        bucket.append(idx)
+
+    def bucket_remove(idx):
+        bucket = buckets[empty_counts[idx]]
+        pos = bucket_pos.pop(idx)
+        last = bucket.pop()
+        if last != idx:
+            bucket[pos] = last
+            bucket_pos[last] = pos
+
+    while count > 0:
+        weights = [len(bucket) * chance for bucket, chance in zip(buckets, _EROSION_CHANCES)]
+        total = sum(weights)
+        if total <= 0:
+            break
+
+        pick = rng.random() * total
+        for bucket, weight in zip(buckets, weights):
+            if pick < weight and bucket:
+                break
+            pick -= weight
+        else:
+            bucket = next(i for i in reversed(buckets[1:]) if i)
+
+        idx = bucket[rng.randrange(len(bucket))]
+        bucket_remove(idx)
+        tiles[idx] = EMPTY
+        count -= 1
+
+        # Removing a tile adds an empty neighbor to the adjacent floor tiles
+        posy, posx = divmod(idx, width)
+        for adjx, adjy in ((posx, posy - 1), (posx, posy + 1), (posx - 1, posy), (posx + 1, posy)):
+            if not (0 <= adjx < width and 0 <= adjy < height):
+                continue
+            adjidx = adjy * width + adjx
+            if adjidx in bucket_pos:
+                bucket_remove(adjidx)
+                empty_counts[adjidx] += 1
+                bucket = buckets[empty_counts[adjidx]]
+                bucket_pos[adjidx] = len(bucket)
+                bucket.append(adjidx)
+
+
+def _island_centroids(islands):
+    return np.array([island.mean(axis=0) for island in islands]).reshape(-1, 2)
+
+
+def link_islands(islands, extra_links=0):
+    """Pick pairs of islands to connect with teleporters
+
+    Islands are linked along a minimum spanning tree over their centroids, so
+    every island is reachable with len(islands) - 1 links. The extra_links
+    shortest remaining pairs are then added to give some alternate routes.
+    """
+    num_islands = len(islands)
+    if num_islands < 2:
+        return []
+
+    centroids = _island_centroids(islands)
+
+    def distances(idx):
+        return np.sum((centroids - centroids[idx]) ** 2, axis=1)
+
+    # Prim's algorithm, computing one row of the distance matrix at a time
+    in_tree = np.zeros(num_islands, dtype=bool)
+    in_tree[0] = True
+    best = distances(0)
+    parent = np.zeros(num_islands, dtype=np.int64)
+    links = []
+    for _ in range(num_islands - 1):
+        nextidx = int(np.argmin(np.where(in_tree, np.inf, best)))
+        links.append((int(parent[nextidx]), nextidx))
+        in_tree[nextidx] = True
+
+        dists = distances(nextidx)
+        closer = dists < best
+        best[closer] = dists[closer]
+        parent[closer] = nextidx
+
+    if extra_links > 0:
+        linked = {tuple(sorted(link)) for link in links}
+        candidates = []
+        for idx in range(num_islands):
+            dists = distances(idx)
+            for other in np.argsort(dists, kind='stable')[1:extra_links + 2].tolist():
+                link = tuple(sorted((idx, other)))
+                if link not in linked:
+                    candidates.append((float(dists[other]), link))
+        for _, link in sorted(set(candidates))[:extra_links]:
+            links.append(link)
+
+    return links
+
+
+def place_teleporters(dungeon, islands, links):
+    """Place a teleporter pair for each link between two islands
+
+    Each end is the free floor tile of its island that is closest to the other
+    island's centroid. A link can not be placed if one of its islands has no
+    free floor tiles left, which would cut off a whole branch of the spanning
+    tree. So once every link has been tried, groups of islands that are still
+    apart are joined by the closest pair of islands between them that both
+    have a free tile. Only an island with no free floor tile at all can be left
+    unreachable.
+    """
+    centroids = _island_centroids(islands)
+    island_coords = []
+    island_free = []
+    for island in islands:
+        coords = island.reshape(-1, 2)
+        island_coords.append(coords)
+        island_free.append(dungeon.tiles[coords[:, 0], coords[:, 1]] == FLOOR)
+
+    # Union-find over islands joined by placed teleporters
+    group = list(range(len(islands)))
+
+    def find_group(idx):
+        while group[idx] != idx:
+            group[idx] = group[group[idx]]
+            idx = group[idx]
+        return idx
+
+    def find_coord(idx, target):
+        free = island_free[idx]
+        if not free.any():
+            return None
+        dists = np.sum((island_coords[idx] - target) ** 2, axis=1)
+        tileidx = int(np.argmin(np.where(free, dists, np.inf)))
+        return tileidx
 
+    telcounter = 0
 
-def gen(width, height, min_room_x=5, min_room_y=5, erosion=0.1, num_encounters=5):
-    seed = time.time()
+    def place_link(idx1, idx2):
+        nonlocal telcounter
+        tile1 = find_coord(idx1, centroids[idx2])
+        tile2 = find_coord(idx2, centroids[idx1])
+        if tile1 is None or tile2 is None:
+            return False
+
+        island_free[idx1][tile1] = False
+        island_free[idx2][tile2] = False
+        coord1 = island_coords[idx1][tile1]
+        coord2 = island_coords[idx2][tile2]
+        dungeon.set_teleporter(int(coord1[1]), int(coord1[0]), telcounter)
+        dungeon.set_teleporter(int(coord2[1]), int(coord2[0]), telcounter)
+        group[find_group(idx1)] = find_group(idx2)
+        telcounter += 1
+        return True
+
+    for idx1, idx2 in links:
+        place_link(idx1, idx2)
+
+    num_groups = len({find_group(idx) for idx in range(len(islands))})
+    if num_groups < 2:
+        return
+
+    # Fall back to the next cheapest links between groups that are still apart
+    candidates = sorted(
+        (float(np.sum((centroids[idx1] - centroids[idx2]) ** 2)), idx1, idx2)
+        for idx1 in range(len(islands))
+        for idx2 in range(idx1 + 1, len(islands))
+    )
+    for _, idx1, idx2 in candidates:
+        if num_groups < 2:
+            break
+        if find_group(idx1) != find_group(idx2) and place_link(idx1, idx2):
+            num_groups -= 1
+
+
+def gen(width, height, min_room_x=5, min_room_y=5, erosion=0.1, num_encounters=5,
+        connectivity='mst', extra_links=0, seed=None):
+    if seed is None:
+        seed = int(time.time() * 1000)
     print("Generating dungeon with seed:", seed)
-    random.seed(seed)
+    rng = random.Random(seed)
 
-    dungeon = [['.' for _ in range(width)] for _ in range(height)]
+    dungeon = TileGrid(width, height)
     rooms = []
 
-    rooms = split(1, 1, width - 1, height - 1, min_room_x, min_room_y)
+    rooms = split(1, 1, width - 1, height - 1, min_room_x, min_room_y, rng)
 
     # Remove half the rooms at random
-    rooms = random.sample(rooms, len(rooms)//2)
+    rooms = rng.sample(rooms, len(rooms)//2)
 
-    num_tiles = 0
     for room in rooms:
-        for y in range(room.y, room.height):
-            for x in range(room.x, room.width):
-                dungeon[y][x] = '#'
-                num_tiles += 1
+        dungeon.fill(FLOOR, room.x, room.y, room.width, room.height)
+    num_tiles = dungeon.count(FLOOR)
 
     # Create encounters
-    for room in random.sample(rooms, num_encounters):
+    for room in rng.sample(rooms, num_encounters):
         # Mutate one tile into an encounter
-        y = int((room.height - room.y) * random.gauss(0.5, 0.1) + room.y)
-        x = int((room.width - room.x) * random.gauss(0.5, 0.1) + room.x)
-        dungeon[y][x] = '$'
+        y = int((room.height - room.y) * rng.gauss(0.5, 0.1) + room.y)
+        x = int((room.width - room.x) * rng.gauss(0.5, 0.1) + room.x)
+        dungeon[x, y] = ENCOUNTER
 
     # Erosion
     # Remove x% of tiles
     remaining = int(num_tiles * erosion)
     # print("Eroding", remaining, "tiles")
-    while remaining != 0:
-        randx = random.randint(0, width - 1)
-        randy = random.randint(0, height - 1)
-
-        tile = dungeon[randy][randx]
-        if tile not in ('#', '$'):
-            continue
-
-        factor = 0.5
-        if randy > 0 and dungeon[randy - 1][randx] == '.':
-            factor += 1
-        if randy < height - 1 and dungeon[randy + 1][randx] == '.':
-            factor += 1
-        if randx > 0 and dungeon[randy][randx - 1] == '.':
-            factor += 1
-        if randx < width - 1 and dungeon[randy][randx + 1] == '.':
-            factor += 1
-
-        if random.random() * factor > 0.5:
-            dungeon[randy][randx] = '.'
-            remaining -= 1
+    erode(dungeon, remaining, rng)
 
     # Connected components
-    ccl = find_connected_components(dungeon)
+    ccl, _ = find_connected_components(dungeon)
     # print(len(ccl))
-    # for island in ccl:
-    #     for tile in island:
-    #         dungeon[tile.coord[0]][tile.coord[1]] = str(tile.island_idx)
+    # for island_idx, island in enumerate(ccl):
+    #     for tile in island_vertices(dungeon, island, island_idx):
+    #         dungeon.set_teleporter(tile.coord[1], tile.coord[0], tile.island_idx)
 
     # Remove islands that are too small
-    for island in ccl[:]:
-        if len(island) < 5:
-            ccl.remove(island)
+    ccl = [island for island in ccl if len(island) >= 5]
 
     # Pick a start tile
-    island = random.choice(ccl)
-    coord = random.choice(island).coord
-    dungeon[coord[0]][coord[1]] = '*'
+    island = rng.choice(ccl)
+    posy, posx = rng.choice(island).tolist()
+    dungeon[posx, posy] = START
 
     # Pick an exit tile
-    island = random.choice(ccl)
-    coord = random.choice(island).coord
-    dungeon[coord[0]][coord[1]] = '&'
+    island = rng.choice(ccl)
+    posy, posx = rng.choice(island).tolist()
+    dungeon[posx, posy] = EXIT
 
     # Place teleporters
-    def find_coord(island):
-        tile = '.'
-        coord = None
-
-        while tile not in ('#', '$'):
-            x = random.choice(island)
-            tile = x.tile
-            coord = x.coord
+    if connectivity == 'mst':
+        links = link_islands(ccl, extra_links)
+    elif connectivity == 'all':
+        links = [(i, j) for i in range(len(ccl)) for j in range(i + 1, len(ccl))]
+    else:
+        raise ValueError("Unknown island connectivity: {}".format(connectivity))
 
-        return coord
-
-    telcounter = 0
-    islands = ccl[:]
-    for island in ccl:
-        for other in islands:
-            if other == island:
-                continue
-            coord1 = find_coord(island)
-            coord2 = find_coord(other)
-
-            dungeon[coord1[0]][coord1[1]] = str(telcounter)
-            dungeon[coord2[0]][coord2[1]] = str(telcounter)
-
-            telcounter += 1
-
-        islands.remove(island)
+    place_teleporters(dungeon, ccl, links)
 
     return dungeon
 
 
 def _test_gen():
     dungeon = gen(50, 50)
-
-    for y in dungeon:
-        for x in y:
-            print(x, end=" ")
-        print()
+    print(dungeon)
 
 
 if __name__ == '__main__':
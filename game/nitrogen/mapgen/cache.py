@@ -0,0 +1,124 @@
+import hashlib
+import json
+import os
+
+from . import bsp
+from . import static
+from . import tilefile
+
+
+GENERATORS = {
+    'bsp': bsp,
+    'static': static,
+}
+
+
+def get_generator(name):
+    try:
+        return GENERATORS[name]
+    except KeyError:
+        raise RuntimeError("Unrecognized tile generator {}".format(name)) from None
+
+
+def cache_key(generator, width, height, seed, params=None):
+    """Content address for a generated tile map
+
+    The generator's VERSION is part of the key so that changes to a generator
+    never serve stale maps.
+    """
+    desc = json.dumps({
+        'generator': generator,
+        'version': get_generator(generator).VERSION,
+        'width': width,
+        'height': height,
+        'seed': seed,
+        'params': params or {},
+    }, sort_keys=True)
+    return hashlib.sha1(desc.encode('utf8')).hexdigest()
+
+
+class GenerationCache:
+    """Generated tile maps stored on disk by cache_key()
+
+    Caching is best effort: a map that can not be read is generated again and
+    a map that can not be written is simply not cached. When max_entries is
+    set, the least recently used maps past that many are removed after every
+    put so the cache does not grow without bound.
+    """
+
+    def __init__(self, cache_dir, max_entries=None):
+        self.cache_dir = cache_dir
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+
+    def _get_path(self, key):
+        return os.path.join(self.cache_dir, key[:2], key + '.tilemap')
+
+    def get(self, key):
+        path = self._get_path(key)
+        try:
+            tilemap, _ = tilefile.load(path)
+        except (OSError, ValueError):
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        try:
+            # Mark as recently used for pruning
+            os.utime(path)
+        except OSError:
+            pass
+        return tilemap
+
+    def put(self, key, tilemap, seed=None):
+        try:
+            tilefile.save(self._get_path(key), tilemap, seed)
+        except OSError:
+            return
+
+        if self.max_entries:
+            self.prune(self.max_entries)
+
+    def prune(self, max_entries):
+        """Remove the least recently used maps past max_entries"""
+        entries = []
+        try:
+            with os.scandir(self.cache_dir) as subdirs:
+                for subdir in subdirs:
+                    if not subdir.is_dir():
+                        continue
+                    with os.scandir(subdir.path) as files:
+                        entries.extend(
+                            (entry.stat().st_mtime, entry.path) for entry in files
+                            if entry.name.endswith('.tilemap')
+                        )
+        except OSError:
+            return
+
+        if len(entries) <= max_entries:
+            return
+
+        entries.sort()
+        for _, path in entries[:len(entries) - max_entries]:
+            try:
+                os.remove(path)
+            except OSError:
+                # Another process may have pruned it already
+                pass
+
+
+def generate(generator, width, height, seed, cache=None, **params):
+    key = None
+    if cache is not None:
+        key = cache_key(generator, width, height, seed, params)
+        tilemap = cache.get(key)
+        if tilemap is not None:
+            return tilemap
+
+    tilemap = get_generator(generator).gen(width, height, seed=seed, **params)
+
+    if cache is not None:
+        cache.put(key, tilemap, seed)
+
+    return tilemap
@@ -0,0 +1,232 @@
+import hashlib
+import math
+import random
+import time
+
+import numpy as np
+import panda3d.core as p3d
+
+from . import cache
+from . import gridcast
+from .dungeon import Dungeon
+from .tilegrid import TileGrid, EMPTY, FLOOR
+
+
+class ChunkedDungeon:
+    """An unbounded dungeon made of fixed-size chunks generated on demand
+
+    Every chunk is generated from (seed, chunk coordinate), so chunks can be
+    evicted once the player is far away and regenerated identically when they
+    come back. Chunks are connected to their neighbors by corridors along their
+    center row and column.
+    """
+
+    CHUNK_SIZE = 48
+    LOAD_RADIUS = 1
+    EVICT_RADIUS = 2
+    FRAME_BUDGET = 0.004
+    GEN_ATTEMPTS = 4
+
+    def __init__(self, chunk_generator='bsp', seed=None, gen_cache=None, **gen_params):
+        if seed is None:
+            seed = random.randrange(2 ** 32)
+        self.seed = seed
+        self.chunk_generator = chunk_generator
+        self.gen_cache = gen_cache
+        self.gen_params = gen_params
+        self.gen_params.setdefault('num_encounters', 2)
+        self.model_root = p3d.NodePath('ChunkedDungeon')
+        self.chunks = {}
+        self._building = None
+
+        origin = self._load_chunk(0, 0)
+        self.player_start = p3d.LVector3(origin.player_start)
+        self.exit_loc = p3d.LVector3(origin.exit_loc)
+
+    @property
+    def spawners(self):
+        return [spawner for chunk in self.chunks.values() for spawner in chunk.spawners]
+
+    def chunk_seed(self, chunkx, chunky):
+        key = '{}:{}:{}'.format(self.seed, chunkx, chunky).encode('utf8')
+        return int.from_bytes(hashlib.sha1(key).digest()[:4], 'little')
+
+    def gen_chunk(self, chunkx, chunky):
+        size = self.CHUNK_SIZE
+        seed = self.chunk_seed(chunkx, chunky)
+        tilemap = None
+        for attempt in range(self.GEN_ATTEMPTS):
+            try:
+                tilemap = cache.generate(
+                    self.chunk_generator,
+                    size,
+                    size,
+                    seed + attempt,
+                    self.gen_cache,
+                    **self.gen_params
+                )
+                break
+            except (ValueError, IndexError):
+                # Not enough rooms or islands for this seed, try the next one
+                continue
+        else:
+            tilemap = TileGrid(size, size)
+
+        # Corridors through the center of the chunk line up with the neighbors
+        mid = size // 2
+        row = tilemap.tiles[mid, :]
+        row[row == EMPTY] = FLOOR
+        column = tilemap.tiles[:, mid]
+        column[column == EMPTY] = FLOOR
+
+        return tilemap
+
+    def _chunk_offset(self, chunkx, chunky):
+        return chunkx * self.CHUNK_SIZE, chunky * self.CHUNK_SIZE
+
+    def _new_chunk(self, chunkx, chunky):
+        chunk = Dungeon(
+            self.chunk_generator,
+            self.CHUNK_SIZE,
+            self.CHUNK_SIZE,
+            seed=self.chunk_seed(chunkx, chunky),
+            tilemap=self.gen_chunk(chunkx, chunky),
+            build=False
+        )
+        offsetx, offsety = self._chunk_offset(chunkx, chunky)
+        chunk.model_root.set_pos(offsetx, offsety, 0)
+        return chunk
+
+    def _load_chunk(self, chunkx, chunky):
+        chunk = self._new_chunk(chunkx, chunky)
+        for _ in chunk.build_steps():
+            pass
+        self._add_chunk((chunkx, chunky), chunk)
+        return chunk
+
+    def _add_chunk(self, coord, chunk):
+        chunk.model_root.reparent_to(self.model_root)
+        self.chunks[coord] = chunk
+
+    def world_to_chunk(self, x, y):
+        size = self.CHUNK_SIZE
+        tilex = math.floor(x + 0.5 + size / 2.0)
+        tiley = math.floor(y + 0.5 + size / 2.0)
+        return tilex // size, tiley // size
+
+    def _get_chunk(self, x, y):
+        coord = self.world_to_chunk(x, y)
+        chunk = self.chunks.get(coord)
+        if chunk is None:
+            return None, 0, 0
+
+        offsetx, offsety = self._chunk_offset(*coord)
+        return chunk, x - offsetx, y - offsety
+
+    def update_focus(self, x, y):
+        """Load chunks around (x, y) and evict the ones that are far away"""
+        focusx, focusy = self.world_to_chunk(x, y)
+
+        for coord in list(self.chunks):
+            if max(abs(coord[0] - focusx), abs(coord[1] - focusy)) > self.EVICT_RADIUS:
+                self.chunks.pop(coord).model_root.remove_node()
+
+        if self._building is None:
+            radius = self.LOAD_RADIUS
+            missing = [
+                (focusx + offx, focusy + offy)
+                for offy in range(-radius, radius + 1)
+                for offx in range(-radius, radius + 1)
+                if (focusx + offx, focusy + offy) not in self.chunks
+            ]
+            if not missing:
+                return
+            coord = min(missing, key=lambda i: abs(i[0] - focusx) + abs(i[1] - focusy))
+            chunk = self._new_chunk(*coord)
+            self._building = (coord, chunk, chunk.build_steps())
+
+        # Build the pending chunk a little bit each frame
+        coord, chunk, steps = self._building
+        starttime = time.perf_counter()
+        for _ in steps:
+            if time.perf_counter() - starttime > self.FRAME_BUDGET:
+                return
+        self._building = None
+        if max(abs(coord[0] - focusx), abs(coord[1] - focusy)) <= self.EVICT_RADIUS:
+            self._add_chunk(coord, chunk)
+
+    def get_tele_loc(self, x, y):
+        chunk, localx, localy = self._get_chunk(x, y)
+        if chunk is None:
+            return None
+
+        loc = chunk.get_tele_loc(localx, localy)
+        if loc is not None:
+            offsetx, offsety = self._chunk_offset(*self.world_to_chunk(x, y))
+            loc = loc[0] + offsetx, loc[1] + offsety
+
+        return loc
+
+    def is_exit(self, x, y):
+        chunk, localx, localy = self._get_chunk(x, y)
+        return chunk is not None and chunk.is_exit(localx, localy)
+
+    def is_walkable(self, x, y):
+        chunk, localx, localy = self._get_chunk(x, y)
+        return chunk is not None and chunk.is_walkable(localx, localy)
+
+    def is_blocked_tile(self, tilex, tiley):
+        """Like Dungeon.is_blocked_tile() with tiles counted from the origin chunk"""
+        size = self.CHUNK_SIZE
+        chunk = self.chunks.get((tilex // size, tiley // size))
+        return chunk is None or chunk.is_blocked_tile(tilex % size, tiley % size)
+
+    def raycast(self, startx, starty, endx, endy):
+        offset = 0.5 + self.CHUNK_SIZE / 2.0
+        return gridcast.raycast(
+            self.is_blocked_tile, startx + offset, starty + offset, endx + offset, endy + offset
+        )
+
+    def has_line_of_sight(self, startx, starty, endx, endy):
+        return self.raycast(startx, starty, endx, endy) is None
+
+    def move_and_slide(self, x, y, deltax, deltay, radius):
+        offset = 0.5 + self.CHUNK_SIZE / 2.0
+        x, y = gridcast.move_and_slide(
+            self.is_blocked_tile, x + offset, y + offset, deltax, deltay, radius
+        )
+        return x - offset, y - offset
+
+    def _group_by_chunk(self, positions):
+        """Yield (chunk, indices, local positions) for positions in loaded chunks"""
+        size = self.CHUNK_SIZE
+        coords = np.floor(positions + 0.5 + size / 2.0).astype(np.int64) // size
+        keys, inverse = np.unique(coords, axis=0, return_inverse=True)
+        inverse = inverse.reshape(-1)
+        for keyidx, key in enumerate(keys.tolist()):
+            chunk = self.chunks.get(tuple(key))
+            if chunk is None:
+                continue
+            indices = np.flatnonzero(inverse == keyidx)
+            yield chunk, indices, positions[indices] - self._chunk_offset(*key)
+
+    def are_exits(self, positions):
+        positions = np.asarray(positions, dtype=np.float64).reshape(-1, 2)
+        result = np.zeros(len(positions), dtype=bool)
+        for chunk, indices, local in self._group_by_chunk(positions):
+            result[indices] = chunk.are_exits(local)
+        return result
+
+    def are_walkable(self, positions):
+        positions = np.asarray(positions, dtype=np.float64).reshape(-1, 2)
+        result = np.zeros(len(positions), dtype=bool)
+        for chunk, indices, local in self._group_by_chunk(positions):
+            result[indices] = chunk.are_walkable(local)
+        return result
+
+    def get_tele_locs(self, positions):
+        positions = np.asarray(positions, dtype=np.float64).reshape(-1, 2)
+        result = np.full((len(positions), 2), np.nan)
+        for chunk, indices, local in self._group_by_chunk(positions):
+            result[indices] = chunk.get_tele_locs(local) + (positions[indices] - local)
+        return result
@@ -1,135 +1,280 @@
+import math
 import random
 
+import numpy as np
 import panda3d.core as p3d
-from . import bsp
-from . import static
+
+from ..assets import get_asset_manager
+from . import cache
+from . import gridcast
+from . import tilefile
+from . import tilemesh
+from .tilegrid import FLOOR, ENCOUNTER, START, EXIT, TELEPORTER
+
+
+TILE_INSTANCING = p3d.ConfigVariableBool(
+    'tile-instancing', False,
+    'Draw floor tiles with hardware instancing instead of a merged mesh'
+)
 
 
 class Dungeon:
-    def __init__(self, tile_generator, sizex, sizey):
+    BUILD_BATCH_SIZE = 256
+    TILE_CHUNK_SIZE = 16
+
+    def __init__(self, tile_generator, sizex, sizey, seed=None, gen_cache=None, tilemap=None,
+                 build=True, instanced=None):
+        if seed is None:
+            seed = random.randrange(2 ** 32)
+        self.seed = seed
         self.sizex = sizex
         self.sizey = sizey
+        self.instanced = TILE_INSTANCING.get_value() if instanced is None else instanced
         self.model_root = p3d.NodePath('Dungeon')
         self._tile_root = self.model_root.attach_new_node('Tiles')
         self.player_start = p3d.LVector3(0, 0, 0)
-        self._telemap = {}
         self.spawners = []
         self.exit_loc = p3d.LVector3(0, 0, 0)
 
-        # Load models
-        loader = p3d.Loader.get_global_ptr()
-        models = p3d.NodePath(loader.load_sync('dungeon.bam'))
-        for model in models.find_all_matches('**'):
-            # Make sure all placed models are visible
-            model.show()
-        tile_model = models.find('**/DungeonTile')
-        spawn_model = models.find('**/MonsterSpawn')
-        tele_model = models.find('**/Teleporter')
-        telelink_model = models.find('**/TeleLink')
-
         # Generate dungeon tile map
-        if tile_generator == 'bsp':
-            tile_generator = bsp
-        elif tile_generator == 'static':
-            tile_generator = static
-        else:
-            raise RuntimeError("Unrecognized tile generator {}".format(tile_generator))
-        self._bsp = tile_generator.gen(sizex, sizey)
+        if tilemap is None:
+            tilemap = cache.generate(tile_generator, sizex, sizey, seed, gen_cache)
+        self.tilemap = tilemap
+        self._telemap = {}
+        self._walkable = None
+        self._exits = None
+        self._blocked = None
+        self._tele_partners = None
+        self.rebuild_index()
+
+        if build:
+            for _ in self.build_steps():
+                pass
+
+    def rebuild_index(self):
+        """Recompute the tile query tables, call this after editing the tile map"""
+        self._telemap = self.tilemap.teleporter_pairs()
+        self._walkable = self.tilemap.walkable_mask()
+        self._exits = self.tilemap.mask(EXIT)
+        # Flat list for the per-tile lookups of ray casts
+        self._blocked = (~self._walkable).reshape(-1).tolist()
+
+        # Tile coordinates of the other end of every linked teleporter, -1 elsewhere
+        self._tele_partners = np.full(self.tilemap.tiles.shape + (2,), -1, dtype=np.int32)
+        for telepair in self._telemap.values():
+            if len(telepair) < 2:
+                continue
+            (startx, starty), (endx, endy) = telepair[:2]
+            self._tele_partners[starty, startx] = endx, endy
+            self._tele_partners[endy, endx] = startx, starty
+
+    @classmethod
+    def from_file(cls, path, **kwargs):
+        tilemap, seed = tilefile.load(path)
+        return cls(None, tilemap.width, tilemap.height, seed=seed, tilemap=tilemap, **kwargs)
+
+    @classmethod
+    def from_buffer(cls, buffer, **kwargs):
+        tilemap, seed = tilefile.loads(buffer)
+        return cls(None, tilemap.width, tilemap.height, seed=seed, tilemap=tilemap, **kwargs)
+
+    def save(self, path):
+        tilefile.save(path, self.tilemap, self.seed)
+
+    def dumps(self):
+        return tilefile.dumps(self.tilemap, self.seed)
+
+    def build_steps(self):
+        """Place models for the tile map, a generator that yields between batches of work
+
+        Floor tiles are written into one mesh (or hardware instanced node) per
+        TILE_CHUNK_SIZE square chunk so that off-screen chunks can be culled,
+        and only special tiles get their own nodes. Yields once per floor chunk
+        and then after every BUILD_BATCH_SIZE special tiles, so the scene graph
+        can be built over several frames.
+        """
+        # Models are loaded and searched once and shared by every layer
+        assets = get_asset_manager()
+        tile_model = assets.get_model('dungeon.bam', 'DungeonTile')
+        spawn_model = assets.get_model('dungeon.bam', 'MonsterSpawn')
+        tele_model = assets.get_model('dungeon.bam', 'Teleporter')
+        telelink_model = assets.get_model('dungeon.bam', 'TeleLink')
+
+        # Build the floor mesh
+        jitter_rng = random.Random(self.seed)
+        coords = self.tilemap.coords(FLOOR, ENCOUNTER, START, EXIT, TELEPORTER)
+        tile_positions = np.empty((len(coords), 3), dtype=np.float32)
+        tile_positions[:, 0] = coords[:, 0] - self.sizex / 2.0
+        tile_positions[:, 1] = coords[:, 1] - self.sizey / 2.0
+        tile_positions[:, 2] = [-jitter_rng.random() * 0.1 for _ in range(len(coords))]
+        tile_geoms = assets.get_derived(
+            ('tile_geoms', 'dungeon.bam'),
+            lambda: tilemesh.collect_geoms(tile_model)
+        )
+        chunks = tilemesh.group_by_chunk(coords, self.TILE_CHUNK_SIZE)
+        for chunk, indices in chunks:
+            name = 'TileChunk-{}-{}'.format(*chunk)
+            if self.instanced:
+                tiles = tilemesh.build_instanced_tiles(
+                    name, tile_model, tile_positions[indices], tile_geoms
+                )
+                tiles.reparent_to(self._tile_root)
+            else:
+                self._tile_root.attach_new_node(tilemesh.build_tile_mesh(
+                    name, tile_model, tile_positions[indices], tile_geoms
+                ))
+            yield
 
         # Parse tile map and place models
-        def process_tile(x, y):
-            tile = self._bsp[y][x]
-
-            if tile != '.':
-                tilenp = self._tile_root.attach_new_node('TileNode')
-                tile_model.instance_to(tilenp)
-                tile_pos = p3d.LVector3(x - sizex / 2.0, y - sizey / 2.0, -random.random() * 0.1)
-                tilenp.set_pos(tile_pos)
-
-                if tile == '*':
-                    # Player start
-                    self.player_start.x = tile_pos.x
-                    self.player_start.y = tile_pos.y
-                elif tile == '&':
-                    # Exit
-                    self.exit_loc.x = tile_pos.x
-                    self.exit_loc.y = tile_pos.y
-
-                    exitnp = p3d.NodePath('Exit')
-                    tele_model.instance_to(exitnp)
-                    exitnp.set_pos(tile_pos + p3d.LVector3(0, 0, 1))
-                    exitnp.reparent_to(self.model_root)
-                elif tile == '$':
-                    # Monster spawn
-                    spawnnp = p3d.NodePath('Spawn')
-                    spawn_model.instance_to(spawnnp)
-                    spawnnp.set_pos(tile_pos + p3d.LVector3(0, 0, 1))
-                    spawnnp.set_h(180)
-                    spawnnp.reparent_to(self.model_root)
-                    self.spawners.append(spawnnp)
-                elif tile.isdigit():
-                    # Teleporter
-                    telenp = self.model_root.attach_new_node('Teleporter')
-                    tele_model.instance_to(telenp)
-                    telenp.set_pos(tile_pos + p3d.LVector3(0, 0, 1))
-
-                    if tile not in self._telemap:
-                        self._telemap[tile] = [(x, y)]
-                    else:
-                        self._telemap[tile].append((x, y))
-
-                        # This is the second teleporter we found for this pair so add a link
-                        tlnp = self.model_root.attach_new_node('TeleporterLink')
-                        telelink_model.instance_to(tlnp)
-                        tlnp.set_pos(tile_pos + p3d.LVector3(0, 0, 1))
-
-                        teleloc = self._tile_to_world(*self._get_tele_loc_from_tile(x, y))
-                        tovec = p3d.LVector3(teleloc, tlnp.get_z())
-                        linkvec = tovec - tlnp.get_pos()
-
-                        tlnp.set_scale(1, linkvec.length(), 1)
-                        tlnp.look_at(tovec)
-
-        for y in range(len(self._bsp)):
-            for x in range(len(self._bsp[y])):
-                process_tile(x, y)
-
-        # Flatten for performance (we've just place a lot of tile objects that don't move)
-        self._tile_root.flatten_strong()
-
-        # Display the tile map for debugging
-        for y in self._bsp:
-            for x in y:
-                print(x, end=" ")
-            print()
-
-    def _tile_to_world(self, x, y):
+        def process_tile(x, y, tile_pos):
+            tile = self.tilemap[x, y]
+
+            if tile == START:
+                # Player start
+                self.player_start.x = tile_pos.x
+                self.player_start.y = tile_pos.y
+            elif tile == EXIT:
+                # Exit
+                self.exit_loc.x = tile_pos.x
+                self.exit_loc.y = tile_pos.y
+
+                exitnp = p3d.NodePath('Exit')
+                tele_model.instance_to(exitnp)
+                exitnp.set_pos(tile_pos + p3d.LVector3(0, 0, 1))
+                exitnp.reparent_to(self.model_root)
+            elif tile == ENCOUNTER:
+                # Monster spawn
+                spawnnp = p3d.NodePath('Spawn')
+                spawn_model.instance_to(spawnnp)
+                spawnnp.set_pos(tile_pos + p3d.LVector3(0, 0, 1))
+                spawnnp.set_h(180)
+                spawnnp.reparent_to(self.model_root)
+                self.spawners.append(spawnnp)
+            elif tile == TELEPORTER:
+                # Teleporter
+                telenp = self.model_root.attach_new_node('Teleporter')
+                tele_model.instance_to(telenp)
+                telenp.set_pos(tile_pos + p3d.LVector3(0, 0, 1))
+
+                telepair = self._telemap[self.tilemap.teleporters[(x, y)]]
+                if len(telepair) > 1 and telepair[-1] == (x, y):
+                    # This is the second teleporter we found for this pair so add a link
+                    tlnp = self.model_root.attach_new_node('TeleporterLink')
+                    telelink_model.instance_to(tlnp)
+                    tlnp.set_pos(tile_pos + p3d.LVector3(0, 0, 1))
+
+                    teleloc = self.tile_to_world(*self._get_tele_loc_from_tile(x, y))
+                    tovec = p3d.LVector3(teleloc, tlnp.get_z())
+                    linkvec = tovec - tlnp.get_pos()
+
+                    tlnp.set_scale(1, linkvec.length(), 1)
+                    tlnp.look_at(tovec)
+
+        tiles = self.tilemap.tiles[coords[:, 1], coords[:, 0]]
+        special = np.flatnonzero(tiles != FLOOR).tolist()
+        for idx, tileidx in enumerate(special, 1):
+            x, y = coords[tileidx].tolist()
+            process_tile(x, y, p3d.LVector3(*tile_positions[tileidx].tolist()))
+            if idx % self.BUILD_BATCH_SIZE == 0:
+                yield
+
+    def tile_to_world(self, x, y):
         return x - self.sizex / 2.0, y - self.sizey / 2.0
 
-    def _world_to_tile(self, x, y):
-        return int(x + 0.5 + self.sizex / 2.0), int(y + 0.5 + self.sizey / 2.0)
+    def world_to_tile(self, x, y):
+        return math.floor(x + 0.5 + self.sizex / 2.0), math.floor(y + 0.5 + self.sizey / 2.0)
+
+    def _in_bounds(self, tilex, tiley):
+        height, width = self._walkable.shape
+        return 0 <= tilex < width and 0 <= tiley < height
 
     def _get_tele_loc_from_tile(self, x, y):
-        tile = self._bsp[y][x]
+        if not self._in_bounds(x, y):
+            return None
 
-        if not tile.isdigit():
+        partnerx, partnery = self._tele_partners[y, x].tolist()
+        if partnerx < 0:
             return None
 
-        return [i for i in self._telemap[tile] if i[0] != x or i[1] != y][0]
+        return partnerx, partnery
 
     def get_tele_loc(self, x, y):
-        loc = self._get_tele_loc_from_tile(*self._world_to_tile(x, y))
+        loc = self._get_tele_loc_from_tile(*self.world_to_tile(x, y))
         if loc is not None:
-            loc = self._tile_to_world(*loc)
+            loc = self.tile_to_world(*loc)
 
         return loc
 
     def is_exit(self, x, y):
-        tilex, tiley = self._world_to_tile(x, y)
-        tile = self._bsp[tiley][tilex]
-        return tile == '&'
+        tilex, tiley = self.world_to_tile(x, y)
+        return self._in_bounds(tilex, tiley) and bool(self._exits[tiley, tilex])
 
     def is_walkable(self, x, y):
-        tilex, tiley = self._world_to_tile(x, y)
-        tile = self._bsp[tiley][tilex]
-        return tile != '.'
+        tilex, tiley = self.world_to_tile(x, y)
+        return self._in_bounds(tilex, tiley) and bool(self._walkable[tiley, tilex])
+
+    def is_blocked_tile(self, tilex, tiley):
+        """Return True if tile (tilex, tiley) can not be walked on or is outside of the map"""
+        width = self.tilemap.width
+        if not (0 <= tilex < width and 0 <= tiley < self.tilemap.height):
+            return True
+        return self._blocked[tiley * width + tilex]
+
+    def raycast(self, startx, starty, endx, endy):
+        """Return the first unwalkable tile between two world positions as a gridcast.RayHit
+
+        Returns None if the whole segment is walkable.
+        """
+        offx = 0.5 + self.sizex / 2.0
+        offy = 0.5 + self.sizey / 2.0
+        return gridcast.raycast(
+            self.is_blocked_tile, startx + offx, starty + offy, endx + offx, endy + offy
+        )
+
+    def has_line_of_sight(self, startx, starty, endx, endy):
+        return self.raycast(startx, starty, endx, endy) is None
+
+    def move_and_slide(self, x, y, deltax, deltay, radius):
+        """Move a circle at world position (x, y), sliding along unwalkable tiles"""
+        offx = 0.5 + self.sizex / 2.0
+        offy = 0.5 + self.sizey / 2.0
+        x, y = gridcast.move_and_slide(
+            self.is_blocked_tile, x + offx, y + offy, deltax, deltay, radius
+        )
+        return x - offx, y - offy
+
+    def world_to_tiles(self, positions):
+        """Return (tiles, in_bounds) for an (N, 2) array of world positions"""
+        positions = np.asarray(positions, dtype=np.float64).reshape(-1, 2)
+        tiles = np.floor(positions + [0.5 + self.sizex / 2.0, 0.5 + self.sizey / 2.0])
+        tiles = tiles.astype(np.int64)
+
+        height, width = self._walkable.shape
+        in_bounds = (tiles >= 0).all(axis=1) & (tiles[:, 0] < width) & (tiles[:, 1] < height)
+        return tiles, in_bounds
+
+    def _lookup(self, table, positions, default):
+        tiles, in_bounds = self.world_to_tiles(positions)
+        result = np.full((len(tiles),) + table.shape[2:], default, dtype=table.dtype)
+        valid = tiles[in_bounds]
+        result[in_bounds] = table[valid[:, 1], valid[:, 0]]
+        return result
+
+    def are_exits(self, positions):
+        """Vectorized is_exit() for an (N, 2) array of world positions"""
+        return self._lookup(self._exits, positions, False)
+
+    def are_walkable(self, positions):
+        """Vectorized is_walkable() for an (N, 2) array of world positions"""
+        return self._lookup(self._walkable, positions, False)
+
+    def get_tele_locs(self, positions):
+        """Vectorized get_tele_loc() for an (N, 2) array of world positions
+
+        Returns an (N, 2) array of destinations with NaN rows for positions that
+        are not on a linked teleporter.
+        """
+        partners = self._lookup(self._tele_partners, positions, -1)
+        locs = partners - [self.sizex / 2.0, self.sizey / 2.0]
+        locs[partners[:, 0] < 0] = np.nan
+        return locs
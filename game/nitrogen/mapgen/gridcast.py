@@ -0,0 +1,178 @@
+"""Ray casts and circle movement against a grid of blocked tiles
+
+Positions are in tile space, where tile (x, y) covers [x, x + 1) by [y, y + 1).
+Tiles are looked up through an is_blocked(tilex, tiley) callable so the same
+code works for a single tile map and for chunked maps. Everything works on
+plain floats so it is cheap enough to run for many movers every frame.
+"""
+from collections import namedtuple
+import math
+
+
+RayHit = namedtuple('RayHit', 'tilex tiley normalx normaly fraction')
+
+# Circles are pushed this much past the tile edge so they never end up on a blocked tile
+SKIN = 1e-4
+
+# Longest step of a swept move, shorter than half a tile. Steps are also kept
+# no longer than the circle's radius so the center can never get from one side
+# of two diagonally touching tiles to the other in a single step.
+MAX_STEP = 0.45
+
+# A push out of one tile can push into another, so a few passes may be needed
+PUSH_PASSES = 4
+
+
+def raycast(is_blocked, startx, starty, endx, endy):
+    """Return the first blocked tile crossed going from start to end, or None
+
+    Tiles are visited in order with a DDA walk. The hit has the tile, the
+    normal of the tile face that was crossed and the fraction of the segment
+    travelled before reaching it. If the start tile is blocked the normal is
+    (0, 0) and the fraction is 0.
+    """
+    tilex = math.floor(startx)
+    tiley = math.floor(starty)
+    if is_blocked(tilex, tiley):
+        return RayHit(tilex, tiley, 0, 0, 0.0)
+
+    dirx = endx - startx
+    diry = endy - starty
+    if dirx > 0:
+        stepx = 1
+        deltax = 1.0 / dirx
+        nextx = (tilex + 1 - startx) * deltax
+    elif dirx < 0:
+        stepx = -1
+        deltax = -1.0 / dirx
+        nextx = (startx - tilex) * deltax
+    else:
+        stepx = 0
+        deltax = nextx = math.inf
+
+    if diry > 0:
+        stepy = 1
+        deltay = 1.0 / diry
+        nexty = (tiley + 1 - starty) * deltay
+    elif diry < 0:
+        stepy = -1
+        deltay = -1.0 / diry
+        nexty = (starty - tiley) * deltay
+    else:
+        stepy = 0
+        deltay = nexty = math.inf
+
+    while True:
+        if nextx < nexty:
+            if nextx > 1.0:
+                return None
+            tilex += stepx
+            if is_blocked(tilex, tiley):
+                return RayHit(tilex, tiley, -stepx, 0, nextx)
+            nextx += deltax
+        else:
+            if nexty > 1.0:
+                return None
+            tiley += stepy
+            if is_blocked(tilex, tiley):
+                return RayHit(tilex, tiley, 0, -stepy, nexty)
+            nexty += deltay
+
+
+def _push_out_once(is_blocked, x, y, radius, fromx, fromy):
+    for tiley in range(math.floor(y - radius), math.floor(y + radius) + 1):
+        for tilex in range(math.floor(x - radius), math.floor(x + radius) + 1):
+            if not is_blocked(tilex, tiley):
+                continue
+
+            if tilex <= x <= tilex + 1 and tiley <= y <= tiley + 1:
+                # The center is inside the tile, leave through the closest
+                # face that faces the previous position so the circle goes
+                # back the way it came instead of through the tile
+                left = x - tilex if fromx <= tilex else math.inf
+                right = tilex + 1 - x if fromx >= tilex + 1 else math.inf
+                bottom = y - tiley if fromy <= tiley else math.inf
+                top = tiley + 1 - y if fromy >= tiley + 1 else math.inf
+                closest = min(left, right, bottom, top)
+                if closest == math.inf:
+                    # No previous position outside the tile, use any face
+                    left = x - tilex
+                    right = tilex + 1 - x
+                    bottom = y - tiley
+                    top = tiley + 1 - y
+                    closest = min(left, right, bottom, top)
+                if closest == left:
+                    x = tilex - radius - SKIN
+                elif closest == right:
+                    x = tilex + 1 + radius + SKIN
+                elif closest == bottom:
+                    y = tiley - radius - SKIN
+                else:
+                    y = tiley + 1 + radius + SKIN
+                continue
+
+            # Push away from the closest point of the tile
+            offx = x - min(max(x, tilex), tilex + 1)
+            offy = y - min(max(y, tiley), tiley + 1)
+            dist_squared = offx * offx + offy * offy
+            if dist_squared >= radius * radius:
+                continue
+            dist = math.sqrt(dist_squared)
+            push = (radius + SKIN - dist) / dist
+            x += offx * push
+            y += offy * push
+
+    return x, y
+
+
+def push_out(is_blocked, x, y, radius, fromx=None, fromy=None):
+    """Return (x, y) moved so a circle there no longer overlaps blocked tiles
+
+    A center inside a blocked tile leaves it towards (fromx, fromy), the
+    position the circle moved from, when that is given. Returns None if the
+    circle is still overlapping after PUSH_PASSES, which happens when it is
+    wedged between tiles.
+    """
+    if fromx is None:
+        fromx = x
+        fromy = y
+    for _ in range(PUSH_PASSES):
+        newx, newy = _push_out_once(is_blocked, x, y, radius, fromx, fromy)
+        if newx == x and newy == y:
+            return x, y
+        x = newx
+        y = newy
+
+    return None
+
+
+def move_and_slide(is_blocked, x, y, deltax, deltay, radius):
+    """Move a circle by (deltax, deltay), sliding along blocked tiles
+
+    The move is split into steps of at most MAX_STEP (and at most radius) so
+    movers can not skip over a tile or squeeze between tiles touching at a
+    corner, and the circle is pushed out of blocked tiles back towards where
+    it came from after every step, which removes the part of the motion going
+    into a wall. The move stops early at a step that leaves the circle wedged
+    between tiles or whose center path crosses a blocked tile. Returns the
+    new (x, y).
+    """
+    length = math.sqrt(deltax * deltax + deltay * deltay)
+    if length == 0.0:
+        return x, y
+
+    max_step = min(MAX_STEP, radius) if radius > 0.0 else MAX_STEP
+    steps = math.ceil(length / max_step)
+    stepx = deltax / steps
+    stepy = deltay / steps
+    for _ in range(steps):
+        newpos = push_out(is_blocked, x + stepx, y + stepy, radius, x, y)
+        if newpos is None or newpos == (x, y):
+            # Stuck in a corner
+            break
+        if raycast(is_blocked, x, y, newpos[0], newpos[1]) is not None:
+            # Pushed out on the far side of a wall
+            break
+        x, y = newpos
+
+    return x, y
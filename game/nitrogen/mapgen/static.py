@@ -1,29 +1,33 @@
 import random
 
+from .tilegrid import TileGrid, FLOOR, ENCOUNTER, START, EXIT
 
-def gen(width, height, num_encounters=5):
-    dungeon = [['.' for _ in range(width)] for _ in range(height)]
+
+VERSION = 1
+
+
+def gen(width, height, num_encounters=5, seed=None):
+    rng = random.Random(seed)
+    dungeon = TileGrid(width, height)
 
     # Fill the space with dungeon tiles leaving a one tile empty border
-    for y in range(1, height - 1):
-        for x in range(1, width - 1):
-            dungeon[y][x] = '#'
+    dungeon.fill(FLOOR, 1, 1, width - 1, height - 1)
 
     # Place the start point in the bottom left corner
-    dungeon[1][1] = '*'
+    dungeon[1, 1] = START
 
     # Place the exit in the center
-    dungeon[height // 2][width // 2] = '&'
+    dungeon[width // 2, height // 2] = EXIT
 
     # Place some random encounters
     for _ in range(num_encounters):
-        tile = ''
+        tile = None
 
-        while tile != '#':
-            x = random.randrange(1, width - 1)
-            y = random.randrange(1, height - 1)
-            tile = dungeon[y][x]
+        while tile != FLOOR:
+            x = rng.randrange(1, width - 1)
+            y = rng.randrange(1, height - 1)
+            tile = dungeon[x, y]
 
-        dungeon[y][x] = '$'
+        dungeon[x, y] = ENCOUNTER
 
     return dungeon
@@ -0,0 +1,125 @@
+"""Binary tile map format
+
+A tile map file is laid out as:
+
+* header (see _HEADER)
+* width * height uint8 tile codes, row major
+* teleporter table of (id, x, y) uint32 triples
+* spawner table of (x, y) uint32 pairs
+
+All values are little-endian. Files can be memory-mapped and the tile plane is
+used in place without any parsing.
+"""
+import mmap
+import os
+import struct
+import tempfile
+
+import numpy as np
+
+from .tilegrid import TileGrid, ENCOUNTER
+
+
+MAGIC = b'NTIL'
+VERSION = 1
+
+# magic, version, reserved, width, height, seed, teleporter count, spawner count
+_HEADER = struct.Struct('<4sHHIIqII')
+_TELEPORTER_DTYPE = np.dtype([('id', '<u4'), ('x', '<u4'), ('y', '<u4')])
+_SPAWNER_DTYPE = np.dtype([('x', '<u4'), ('y', '<u4')])
+
+
+class TileFile:
+    """A parsed view over a tile map buffer (bytes or mmap)"""
+
+    def __init__(self, buffer):
+        if len(buffer) < _HEADER.size:
+            raise ValueError("Tile map buffer is too small")
+        magic, version, _, width, height, seed, num_teles, num_spawners = \
+            _HEADER.unpack_from(buffer, 0)
+
+        if magic != MAGIC:
+            raise ValueError("Not a tile map file")
+        if version > VERSION:
+            raise ValueError("Unsupported tile map version {}".format(version))
+
+        offset = _HEADER.size
+        self.version = version
+        self.width = width
+        self.height = height
+        self.seed = None if seed < 0 else seed
+
+        self.tiles = np.frombuffer(buffer, np.uint8, width * height, offset)
+        self.tiles = self.tiles.reshape(height, width)
+        offset += width * height
+
+        self.teleporters = np.frombuffer(buffer, _TELEPORTER_DTYPE, num_teles, offset)
+        offset += self.teleporters.nbytes
+
+        self.spawners = np.frombuffer(buffer, _SPAWNER_DTYPE, num_spawners, offset)
+
+    def to_tilegrid(self):
+        """Build a TileGrid that shares the tile plane with this buffer"""
+        grid = TileGrid.from_array(self.tiles)
+        grid.teleporters = {
+            (int(x), int(y)): int(tele_id)
+            for tele_id, x, y in self.teleporters.tolist()
+        }
+        return grid
+
+
+def dumps(tilemap, seed=None):
+    spawners = tilemap.coords(ENCOUNTER)
+    teleporters = sorted(
+        (tele_id, x, y) for (x, y), tele_id in tilemap.teleporters.items()
+    )
+
+    header = _HEADER.pack(
+        MAGIC,
+        VERSION,
+        0,
+        tilemap.width,
+        tilemap.height,
+        -1 if seed is None else seed,
+        len(teleporters),
+        len(spawners)
+    )
+    return b''.join([
+        header,
+        np.ascontiguousarray(tilemap.tiles, dtype=np.uint8).tobytes(),
+        np.array(teleporters, dtype=_TELEPORTER_DTYPE).tobytes(),
+        np.array([tuple(i) for i in spawners.tolist()], dtype=_SPAWNER_DTYPE).tobytes(),
+    ])
+
+
+def loads(buffer):
+    """Return (tilemap, seed) from a tile map buffer"""
+    tilefile = TileFile(buffer)
+    return tilefile.to_tilegrid(), tilefile.seed
+
+
+def save(path, tilemap, seed=None):
+    dirname = os.path.dirname(os.path.abspath(path))
+    os.makedirs(dirname, exist_ok=True)
+
+    # Write to a temporary file first so readers never see a partial map
+    tmpfd, tmppath = tempfile.mkstemp(dir=dirname)
+    try:
+        with os.fdopen(tmpfd, 'wb') as tilefile:
+            tilefile.write(dumps(tilemap, seed))
+        os.replace(tmppath, path)
+    except OSError:
+        if os.path.exists(tmppath):
+            os.remove(tmppath)
+        raise
+
+
+def load(path):
+    """Return (tilemap, seed) from a tile map file
+
+    The file is memory-mapped copy-on-write, so the tile plane is not read
+    until it is used and changes to the returned map never reach the file.
+    """
+    with open(path, 'rb') as tilefile:
+        buffer = mmap.mmap(tilefile.fileno(), 0, access=mmap.ACCESS_COPY)
+    return loads(buffer)
@@ -0,0 +1,139 @@
+import numpy as np
+
+
+# Tile codes
+EMPTY = 0
+FLOOR = 1
+ENCOUNTER = 2
+START = 3
+EXIT = 4
+TELEPORTER = 5
+
+_CODE_TO_CHAR = {
+    EMPTY: '.',
+    FLOOR: '#',
+    ENCOUNTER: '$',
+    START: '*',
+    EXIT: '&',
+}
+_CHAR_TO_CODE = {char: code for code, char in _CODE_TO_CHAR.items()}
+
+
+class TileGrid:
+    def __init__(self, width, height, fill=EMPTY):
+        self.width = width
+        self.height = height
+        self.tiles = np.full((height, width), fill, dtype=np.uint8)
+
+        # Teleporter ids keyed by (x, y)
+        self.teleporters = {}
+
+    def __getitem__(self, pos):
+        x, y = pos
+        return int(self.tiles[y, x])
+
+    def __setitem__(self, pos, code):
+        x, y = pos
+        self.tiles[y, x] = code
+        if code != TELEPORTER:
+            self.teleporters.pop((x, y), None)
+
+    def __eq__(self, other):
+        if not isinstance(other, TileGrid):
+            return NotImplemented
+        return np.array_equal(self.tiles, other.tiles) and self.teleporters == other.teleporters
+
+    def __str__(self):
+        return '\n'.join(' '.join(row) for row in self.to_strings())
+
+    def in_bounds(self, x, y):
+        return 0 <= x < self.width and 0 <= y < self.height
+
+    def fill(self, code, startx=0, starty=0, endx=None, endy=None):
+        self.tiles[starty:endy, startx:endx] = code
+        if code != TELEPORTER:
+            endx = self.width if endx is None else endx
+            endy = self.height if endy is None else endy
+            for x, y in list(self.teleporters):
+                if startx <= x < endx and starty <= y < endy:
+                    del self.teleporters[(x, y)]
+
+    def mask(self, *codes):
+        return np.isin(self.tiles, codes)
+
+    def walkable_mask(self):
+        return self.tiles != EMPTY
+
+    def count(self, *codes):
+        return int(np.count_nonzero(self.mask(*codes)))
+
+    def coords(self, *codes):
+        """Return an (N, 2) array of (x, y) coordinates of tiles matching codes"""
+        return np.argwhere(self.mask(*codes))[:, ::-1]
+
+    def neighbor_counts(self, *codes):
+        """Count the 4-connected neighbors of every tile that match codes
+
+        Tiles outside of the grid never match.
+        """
+        padded = np.pad(self.mask(*codes), 1).astype(np.uint8)
+        return padded[:-2, 1:-1] + padded[2:, 1:-1] + padded[1:-1, :-2] + padded[1:-1, 2:]
+
+    def set_teleporter(self, x, y, tele_id):
+        self.tiles[y, x] = TELEPORTER
+        self.teleporters[(x, y)] = tele_id
+
+    def teleporter_pairs(self):
+        pairs = {}
+        for coord, tele_id in sorted(self.teleporters.items(), key=lambda i: i[0][::-1]):
+            pairs.setdefault(tele_id, []).append(coord)
+        return pairs
+
+    def copy(self):
+        grid = TileGrid(self.width, self.height)
+        grid.tiles[...] = self.tiles
+        grid.teleporters = dict(self.teleporters)
+        return grid
+
+    def to_strings(self):
+        """Return a list of rows of tile tokens, teleporters are their id in digits
+
+        Ids can be more than one digit long, so when rows are written out as
+        text the tokens need to be separated like str() does.
+        """
+        rows = [[_CODE_TO_CHAR.get(code, '?') for code in row] for row in self.tiles.tolist()]
+        for (x, y), tele_id in self.teleporters.items():
+            rows[y][x] = str(tele_id)
+        return rows
+
+    @classmethod
+    def from_array(cls, tiles):
+        """Wrap an existing (height, width) uint8 array without copying it"""
+        grid = cls.__new__(cls)
+        grid.height, grid.width = tiles.shape
+        grid.tiles = tiles
+        grid.teleporters = {}
+        return grid
+
+    @classmethod
+    def from_strings(cls, rows):
+        """Make a grid from rows of tile tokens
+
+        A row is either a list of tokens like to_strings returns, or a string
+        with whitespace between tokens like str() gives. A string without
+        whitespace has one token per character, so its teleporter ids are
+        single digits.
+        """
+        rows = [
+            (row.split() if any(char.isspace() for char in row) else list(row))
+            if isinstance(row, str) else row
+            for row in rows
+        ]
+        grid = cls(len(rows[0]) if rows else 0, len(rows))
+        for y, row in enumerate(rows):
+            for x, token in enumerate(row):
+                if token.isdigit():
+                    grid.set_teleporter(x, y, int(token))
+                else:
+                    grid.tiles[y, x] = _CHAR_TO_CODE[token]
+        return grid
@@ -0,0 +1,265 @@
+import numpy as np
+import panda3d.core as p3d
+
+
+# Shader input holding the buffer texture of tile offsets of an instanced chunk
+TILE_OFFSETS_INPUT = 'tile_offsets'
+
+# Shader inputs that FieldOfView.apply_to() sets (with a higher priority) to fog
+# instanced tiles, since custom shaders do not see its texture stage
+FOV_TEXTURE_INPUT = 'fov_texture'
+FOV_TRANSFORM_INPUT = 'fov_transform'
+
+
+_INSTANCE_VERT = """
+#version 140
+uniform mat4 p3d_ModelMatrix;
+uniform mat4 p3d_ModelViewMatrix;
+uniform mat4 p3d_ProjectionMatrix;
+uniform mat3 p3d_NormalMatrix;
+uniform samplerBuffer tile_offsets;
+uniform mat4 fov_transform;
+
+in vec4 p3d_Vertex;
+in vec3 p3d_Normal;
+in vec2 p3d_MultiTexCoord0;
+
+out vec2 texcoord;
+out vec2 fov_texcoord;
+out vec4 view_position;
+out vec3 view_normal;
+
+void main() {
+    vec4 offset = texelFetch(tile_offsets, gl_InstanceID);
+    vec4 position = p3d_Vertex + vec4(offset.xyz, 0.0);
+    texcoord = p3d_MultiTexCoord0;
+    fov_texcoord = (fov_transform * p3d_ModelMatrix * position).xy;
+    view_position = p3d_ModelViewMatrix * position;
+    view_normal = p3d_NormalMatrix * p3d_Normal;
+    gl_Position = p3d_ProjectionMatrix * view_position;
+}
+"""
+
+
+_INSTANCE_FRAG = """
+#version 140
+uniform sampler2D p3d_Texture0;
+uniform sampler2D fov_texture;
+uniform vec4 p3d_ColorScale;
+uniform struct {
+    vec4 ambient;
+} p3d_LightModel;
+uniform struct {
+    vec4 color;
+    vec4 position;
+    sampler2DShadow shadowMap;
+    mat4 shadowViewMatrix;
+} p3d_LightSource[4];
+
+in vec2 texcoord;
+in vec2 fov_texcoord;
+in vec4 view_position;
+in vec3 view_normal;
+
+out vec4 o_color;
+
+void main() {
+    vec3 normal = normalize(view_normal);
+    vec3 light = p3d_LightModel.ambient.rgb;
+    for (int i = 0; i < p3d_LightSource.length(); ++i) {
+        vec3 lightdir = normalize(p3d_LightSource[i].position.xyz);
+        vec4 shadowcoord = p3d_LightSource[i].shadowViewMatrix * view_position;
+        float lit = textureProj(p3d_LightSource[i].shadowMap, shadowcoord);
+        light += p3d_LightSource[i].color.rgb * max(dot(normal, lightdir), 0.0) * lit;
+    }
+
+    vec4 color = texture(p3d_Texture0, texcoord) * p3d_ColorScale;
+    color.rgb *= texture(fov_texture, fov_texcoord).rgb;
+    o_color = vec4(color.rgb * light, color.a);
+}
+"""
+
+
+_INSTANCE_SHADER = None
+_NO_FOV_TEXTURE = None
+
+
+def get_instance_shader():
+    global _INSTANCE_SHADER  # pylint: disable=global-statement
+    if _INSTANCE_SHADER is None:
+        _INSTANCE_SHADER = p3d.Shader.make(p3d.Shader.SL_GLSL, _INSTANCE_VERT, _INSTANCE_FRAG)
+    return _INSTANCE_SHADER
+
+
+def _get_no_fov_texture():
+    """Return a white texture for tiles without a field of view"""
+    global _NO_FOV_TEXTURE  # pylint: disable=global-statement
+    if _NO_FOV_TEXTURE is None:
+        _NO_FOV_TEXTURE = p3d.Texture('NoFieldOfView')
+        _NO_FOV_TEXTURE.setup_2d_texture(1, 1, p3d.Texture.T_unsigned_byte, p3d.Texture.F_luminance)
+        _NO_FOV_TEXTURE.set_ram_image(b'\xff')
+    return _NO_FOV_TEXTURE
+
+
+def _as_bytes(array_data):
+    return np.frombuffer(memoryview(array_data).cast('B'), dtype=np.uint8)
+
+
+def collect_geoms(model):
+    """Return (geom, state) for every Geom in model with its transforms applied"""
+    root = p3d.NodePath('TileModel')
+    model.copy_to(root)
+    root.flatten_light()
+
+    geoms = []
+    for geomnp in root.find_all_matches('**/+GeomNode'):
+        geomnode = geomnp.node()
+        netstate = geomnp.get_net_state()
+        for idx in range(geomnode.get_num_geoms()):
+            geom = geomnode.get_geom(idx).decompose()
+            geoms.append((geom, netstate.compose(geomnode.get_geom_state(idx))))
+
+    return geoms
+
+
+def _build_geom(geom, offsets):
+    vdata = geom.get_vertex_data()
+    vformat = vdata.get_format()
+    num_tiles = len(offsets)
+    num_rows = vdata.get_num_rows()
+
+    column = vformat.get_column(p3d.InternalName.get_vertex())
+    if column.get_numeric_type() != p3d.GeomEnums.NT_float32 or column.get_num_components() < 3:
+        raise ValueError("Tile model vertices must be stored as 3 component float32")
+
+    newdata = p3d.GeomVertexData(vdata.get_name(), vformat, p3d.Geom.UH_static)
+    newdata.unclean_set_num_rows(num_rows * num_tiles)
+
+    # Repeat every vertex array once per tile
+    vertex_array = vformat.get_array_with(p3d.InternalName.get_vertex())
+    for arrayidx in range(vdata.get_num_arrays()):
+        stride = vformat.get_array(arrayidx).get_stride()
+        src = _as_bytes(vdata.get_array(arrayidx)).reshape(num_rows, stride)
+        dst = _as_bytes(newdata.modify_array(arrayidx))
+        dst = dst.reshape(num_tiles, num_rows, stride)
+        dst[...] = src
+
+        if arrayidx == vertex_array:
+            # Offset the positions of each copy by its tile position
+            start = column.get_start()
+            positions = dst[:, :, start:start + 12].copy().view(np.float32)
+            positions += offsets[:, np.newaxis, :]
+            dst[:, :, start:start + 12] = positions.view(np.uint8)
+
+    # Repeat the triangle indices, pointing each copy at its own vertices
+    triangles = p3d.GeomTriangles(p3d.Geom.UH_static)
+    triangles.set_index_type(p3d.GeomEnums.NT_uint32)
+    for primidx in range(geom.get_num_primitives()):
+        indices = np.array(geom.get_primitive(primidx).get_vertex_list(), dtype=np.uint32)
+        allindices = indices[np.newaxis, :] + \
+            (np.arange(num_tiles, dtype=np.uint32) * num_rows)[:, np.newaxis]
+
+        vertices = triangles.modify_vertices()
+        start = vertices.get_num_rows()
+        vertices.unclean_set_num_rows(start + allindices.size)
+        _as_bytes(vertices).view(np.uint32)[start:] = allindices.reshape(-1)
+
+    newgeom = p3d.Geom(newdata)
+    newgeom.add_primitive(triangles)
+    return newgeom
+
+
+def build_tile_mesh(name, tile_model, offsets, tile_geoms=None):
+    """Build a single GeomNode with a copy of tile_model at each offset
+
+    offsets is an (N, 3) array of tile positions. Vertex and index data are
+    written in bulk, so no per-tile nodes or flattening are needed. Pass
+    tile_geoms from collect_geoms() to skip re-processing tile_model when
+    building many meshes.
+    """
+    offsets = np.asarray(offsets, dtype=np.float32).reshape(-1, 3)
+    geomnode = p3d.GeomNode(name)
+    if len(offsets) == 0:
+        return geomnode
+
+    if tile_geoms is None:
+        tile_geoms = collect_geoms(tile_model)
+    for geom, state in tile_geoms:
+        geomnode.add_geom(_build_geom(geom, offsets), state)
+
+    return geomnode
+
+
+def make_offset_texture(name, offsets):
+    """Store (N, 3) tile offsets in a buffer texture for the instancing shader"""
+    offsets = np.asarray(offsets, dtype=np.float32).reshape(-1, 3)
+    texels = np.zeros((len(offsets), 4), dtype=np.float32)
+    texels[:, :3] = offsets
+
+    tex = p3d.Texture(name)
+    tex.setup_buffer_texture(
+        max(len(offsets), 1),
+        p3d.Texture.T_float,
+        p3d.Texture.F_rgba32,
+        p3d.GeomEnums.UH_static
+    )
+    if len(offsets):
+        tex.set_ram_image(texels.tobytes())
+    return tex
+
+
+def build_instanced_tiles(name, tile_model, offsets, tile_geoms=None):
+    """Draw tile_model once per offset using hardware instancing
+
+    Only one copy of the tile geometry is kept in vertex memory. Offsets are
+    read from a buffer texture in the vertex shader. The shader lights tiles
+    per pixel from the ambient light and up to four directional lights with
+    their shadow maps, and fogs them through the FOV_TEXTURE_INPUT and
+    FOV_TRANSFORM_INPUT shader inputs (no fog unless an ancestor sets them).
+    """
+    offsets = np.asarray(offsets, dtype=np.float32).reshape(-1, 3)
+    geomnode = p3d.GeomNode(name)
+    if tile_geoms is None:
+        tile_geoms = collect_geoms(tile_model)
+    for geom, state in tile_geoms:
+        geomnode.add_geom(geom, state)
+
+    nodepath = p3d.NodePath(geomnode)
+    if len(offsets) == 0:
+        return nodepath
+
+    nodepath.set_instance_count(len(offsets))
+    nodepath.set_shader(get_instance_shader())
+    nodepath.set_shader_input(TILE_OFFSETS_INPUT, make_offset_texture(name, offsets))
+    nodepath.set_shader_input(FOV_TEXTURE_INPUT, _get_no_fov_texture())
+    nodepath.set_shader_input(FOV_TRANSFORM_INPUT, p3d.LMatrix4.ident_mat())
+
+    # The culler only sees one tile, so give it bounds that cover every instance
+    tilemin, tilemax = p3d.LPoint3(), p3d.LPoint3()
+    if not nodepath.calc_tight_bounds(tilemin, tilemax):
+        tilemin, tilemax = p3d.LPoint3(), p3d.LPoint3()
+    offmin = offsets.min(axis=0).tolist()
+    offmax = offsets.max(axis=0).tolist()
+    geomnode.set_bounds(p3d.BoundingBox(
+        tilemin + p3d.LVector3(*offmin),
+        tilemax + p3d.LVector3(*offmax)
+    ))
+    geomnode.set_final(True)
+
+    return nodepath
+
+
+def group_by_chunk(coords, chunk_size):
+    """Split tile indices into spatial chunks
+
+    Returns a list of ((chunkx, chunky), indices) for every chunk that contains
+    at least one of the (N, 2) tile coords.
+    """
+    if len(coords) == 0:
+        return []
+
+    chunks = coords // chunk_size
+    keys = chunks[:, 1] * (int(chunks[:, 0].max()) + 1) + chunks[:, 0]
+    order = np.argsort(keys, kind='stable')
+    groups = np.split(order, np.flatnonzero(np.diff(keys[order])) + 1)
+    return [(tuple(chunks[group[0]].tolist()), group) for group in groups]
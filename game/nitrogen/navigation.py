@@ -0,0 +1,700 @@
+"""Path finding over dungeon tile maps"""
+import collections
+import heapq
+import math
+
+import numpy as np
+
+from .mapgen import bsp
+from .mapgen.tilegrid import FLOOR, ENCOUNTER, START, EXIT, TELEPORTER
+
+
+_SQRT2 = math.sqrt(2)
+_DIRECTIONS = [(-1, -1), (0, -1), (1, -1), (-1, 0), (1, 0), (-1, 1), (0, 1), (1, 1)]
+_MISSING = object()
+
+
+def _octile(deltax, deltay):
+    return max(deltax, deltay) + (_SQRT2 - 1) * min(deltax, deltay)
+
+
+def _padded_grid(tilemap):
+    """Return (walkable, teleporters, partners) for tilemap padded with a blocked border
+
+    walkable excludes linked teleporters, which are marked in teleporters, and
+    partners maps the flat index of every linked teleporter to its partner's.
+    """
+    height, width = tilemap.tiles.shape
+    stride = width + 2
+
+    partners = {}
+    for coords in tilemap.teleporter_pairs().values():
+        if len(coords) < 2:
+            continue
+        (startx, starty), (endx, endy) = coords[:2]
+        start = (starty + 1) * stride + startx + 1
+        end = (endy + 1) * stride + endx + 1
+        partners[start] = end
+        partners[end] = start
+
+    teleporters = np.zeros((height + 2, stride), dtype=bool)
+    teleporters.reshape(-1)[list(partners)] = True
+    walkable = np.zeros_like(teleporters)
+    walkable[1:-1, 1:-1] = tilemap.walkable_mask()
+    walkable &= ~teleporters
+
+    return walkable, teleporters, partners
+
+
+class NavGrid:
+    """Jump point search over the walkable tiles of a Dungeon
+
+    Paths move between tile centers in the eight compass directions without
+    cutting corners. Linked teleporter tiles are never walked across: stepping
+    onto one is a zero-cost edge to its partner. Results are kept in an LRU
+    cache keyed by (start, goal) tile, which rebuild() clears when the tile map
+    changes.
+
+    The heuristic is the octile distance to the goal or, through the graph of
+    teleporters, to a teleporter on the same island plus a lower bound on the
+    rest of the way from it. Only cached queries meet the sub-millisecond
+    target. Uncached queries on 200x200 bsp maps take about 3.5 ms (median) and
+    13 ms (90th percentile), mostly spent going around walls. Even an exact
+    heuristic would only bring that down to about 0.7 ms and 1.3 ms.
+    The NavGrid.find_path stage of benchmark.py tracks this.
+    """
+
+    CACHE_SIZE = 256
+
+    def __init__(self, dungeon, cache_size=None):
+        self.dungeon = dungeon
+        self.cache_size = self.CACHE_SIZE if cache_size is None else cache_size
+        self.hits = 0
+        self.misses = 0
+        self._cache = collections.OrderedDict()
+        self._width = 0
+        self._height = 0
+        self._stride = 0
+        self._walkable = []
+        self._stops = []
+        self._jumps = {}
+        self._runs = {}
+        self._partners = {}
+        self._islands = []
+        self._arrivals = {}
+        self.rebuild()
+
+    def rebuild(self):
+        tilemap = self.dungeon.tilemap
+        self._height, self._width = tilemap.tiles.shape
+        self._stride = self._width + 2
+
+        # The blocked border means jumps never need bounds checks
+        walkable, teleporters, self._partners = _padded_grid(tilemap)
+
+        # Islands only reachable from each other through teleporters
+        _, labels = bsp.find_connected_components(
+            tilemap,
+            codes=(FLOOR, ENCOUNTER, START, EXIT, TELEPORTER)
+        )
+        islands = np.full(teleporters.shape, -1, dtype=np.int32)
+        islands[1:-1, 1:-1] = labels
+        self._islands = islands.reshape(-1).tolist()
+
+        # Teleporter graph: the teleporters whose partner is on each island
+        self._arrivals = {}
+        for tele, partner in sorted(self._partners.items()):
+            self._arrivals.setdefault(self._islands[partner], []).append(tele)
+
+        # Jumps stop next to teleporters so they can be taken as edges
+        near = np.zeros_like(teleporters)
+        for deltax, deltay in _DIRECTIONS:
+            near |= np.roll(teleporters, (deltay, deltax), axis=(0, 1))
+
+        self._walkable = walkable.reshape(-1).tolist()
+        self._stops = near.reshape(-1).tolist()
+        for direction in _DIRECTIONS:
+            if not all(direction):
+                self._build_jump_table(walkable, near, direction)
+
+        self._cache.clear()
+
+    def _build_jump_table(self, walkable, stops, direction):
+        """Precompute straight jumps from every tile in direction
+
+        _jumps holds the jump point reached (or -1) ignoring the goal and
+        _runs the number of walkable tiles before the first blocked one.
+        """
+        deltax, deltay = direction
+
+        # A tile is a jump point if it has a forced neighbor or is next to a teleporter
+        def shifted(grid, offx, offy):
+            return np.roll(grid, (-offy, -offx), axis=(0, 1))
+        sidex, sidey = abs(deltay), abs(deltax)
+        forced = (shifted(walkable, -sidex, -sidey)
+                  & ~shifted(walkable, -sidex - deltax, -sidey - deltay)) | \
+            (shifted(walkable, sidex, sidey) & ~shifted(walkable, sidex - deltax, sidey - deltay))
+        flags = walkable & (stops | forced)
+
+        # Lay the grid out so that moving in direction is moving forward in memory
+        indices = np.arange(walkable.size).reshape(walkable.shape)
+        if deltay:
+            walkable, flags, indices = walkable.T, flags.T, indices.T
+        if deltax + deltay < 0:
+            walkable, flags, indices = walkable[:, ::-1], flags[:, ::-1], indices[:, ::-1]
+        walkable = walkable.reshape(-1)
+        flags = flags.reshape(-1)
+        indices = indices.reshape(-1)
+
+        # First flagged and first blocked position after every position
+        positions = np.arange(walkable.size)
+        end = walkable.size
+        nextflag = np.where(flags, positions, end)[::-1]
+        nextflag = np.minimum.accumulate(nextflag)[::-1]
+        nextflag = np.append(nextflag[1:], end)
+        nextblock = np.where(walkable, end, positions)[::-1]
+        nextblock = np.minimum.accumulate(nextblock)[::-1]
+        nextblock = np.append(nextblock[1:], end)
+
+        jumps = np.full(walkable.size, -1, dtype=np.int64)
+        found = nextflag < nextblock
+        jumps[indices[found]] = indices[nextflag[found]]
+        runs = np.zeros(walkable.size, dtype=np.int64)
+        runs[indices] = np.minimum(nextblock, end) - positions - 1
+
+        self._jumps[direction] = jumps.tolist()
+        self._runs[direction] = runs.tolist()
+
+    def _index(self, x, y):
+        return (y + 1) * self._stride + x + 1
+
+    def _coords(self, node):
+        y, x = divmod(node, self._stride)
+        return x - 1, y - 1
+
+    def _teleporter_bounds(self, goal):
+        """Lower bounds on the cost from stepping onto each teleporter to goal
+
+        Walking from one tile to another costs at least the octile distance
+        between them, so this is a Dijkstra backwards from goal over the
+        teleporter graph with those distances as edge costs. Teleporters that
+        can not lead to goal are left out.
+        """
+        stride = self._stride
+        partners = self._partners
+        islands = self._islands
+        goaly, goalx = divmod(goal, stride)
+        bounds = {}
+        pending = []
+        for tele in self._arrivals.get(islands[goal], ()):
+            partnery, partnerx = divmod(partners[tele], stride)
+            pending.append((_octile(abs(partnerx - goalx), abs(partnery - goaly)), tele))
+        heapq.heapify(pending)
+
+        while pending:
+            cost, tele = heapq.heappop(pending)
+            if tele in bounds:
+                continue
+            bounds[tele] = cost
+            teley, telex = divmod(tele, stride)
+            for source in self._arrivals.get(islands[tele], ()):
+                if source not in bounds:
+                    partnery, partnerx = divmod(partners[source], stride)
+                    walk = _octile(abs(partnerx - telex), abs(partnery - teley))
+                    heapq.heappush(pending, (cost + walk, source))
+
+        return bounds
+
+    def find_path(self, start, goal):
+        """Return the tiles from start to goal or None if goal cannot be reached
+
+        A teleporter tile in the path is always followed by its partner.
+        """
+        key = (tuple(start), tuple(goal))
+        path = self._cache.get(key, _MISSING)
+        if path is not _MISSING:
+            self.hits += 1
+            self._cache.move_to_end(key)
+            return path
+
+        self.misses += 1
+        path = self._search(*key)
+        self._cache[key] = path
+        if len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+        return path
+
+    def _search(self, start, goal):
+        for x, y in (start, goal):
+            if not (0 <= x < self._width and 0 <= y < self._height):
+                return None
+
+        startidx = self._index(*start)
+        goalidx = self._index(*goal)
+        if startidx == goalidx:
+            return (start,)
+        if not self._walkable[goalidx] and goalidx not in self._partners:
+            return None
+
+        # Each island's teleporters with a lower bound on the rest of the way
+        # from stepping onto them, islands left out can not reach the goal
+        islands = self._islands
+        goal_island = islands[goalidx]
+        stride = self._stride
+        island_teles = {}
+        for tele, bound in self._teleporter_bounds(goalidx).items():
+            teley, telex = divmod(tele, stride)
+            island_teles.setdefault(islands[tele], []).append((telex, teley, bound))
+        start_island = islands[startidx]
+        if start_island >= 0 and start_island != goal_island and start_island not in island_teles:
+            return None
+
+        goalx, goaly = goal[0] + 1, goal[1] + 1
+
+        def heuristic(node):
+            y, x = divmod(node, stride)
+            island = islands[node]
+            if island == goal_island:
+                best = _octile(abs(x - goalx), abs(y - goaly))
+            else:
+                best = math.inf
+            for telex, teley, bound in island_teles.get(island, ()):
+                dist = bound + _octile(abs(x - telex), abs(y - teley))
+                if dist < best:
+                    best = dist
+            return best
+
+        gscores = {startidx: 0.0}
+        parents = {startidx: (None, None)}
+        directions = {startidx: None}
+        openset = [(heuristic(startidx), 0, startidx)]
+        closed = set()
+        counter = 0
+
+        while openset:
+            _, _, node = heapq.heappop(openset)
+            if node == goalidx:
+                return self._reconstruct(parents, node)
+            if node in closed:
+                continue
+            closed.add(node)
+
+            gscore = gscores[node]
+            for succ, cost, direction, via in self._successors(node, directions[node], goalidx):
+                newg = gscore + cost
+                if succ in closed or newg >= gscores.get(succ, math.inf):
+                    continue
+                gscores[succ] = newg
+                parents[succ] = (node, via)
+                directions[succ] = direction
+                counter += 1
+                heapq.heappush(openset, (newg + heuristic(succ), counter, succ))
+
+        return None
+
+    def _reconstruct(self, parents, node):
+        path = []
+        while node is not None:
+            path.append(self._coords(node))
+            node, via = parents[node]
+            if via is not None:
+                path.append(self._coords(via))
+        path.reverse()
+        return tuple(path)
+
+    def _neighbors(self, node, direction):
+        walk = self._walkable
+        stride = self._stride
+
+        if direction is None:
+            # Start and teleporter arrivals have no parent to prune with
+            neighbors = []
+            for deltax, deltay in _DIRECTIONS:
+                if deltax and deltay:
+                    if walk[node + deltax] and walk[node + deltay * stride]:
+                        neighbors.append((deltax, deltay))
+                elif walk[node + deltax + deltay * stride]:
+                    neighbors.append((deltax, deltay))
+            return neighbors
+
+        deltax, deltay = direction
+        neighbors = []
+        if deltax and deltay:
+            vertical = walk[node + deltay * stride]
+            horizontal = walk[node + deltax]
+            if vertical:
+                neighbors.append((0, deltay))
+            if horizontal:
+                neighbors.append((deltax, 0))
+            if vertical and horizontal:
+                neighbors.append((deltax, deltay))
+        elif deltax:
+            ahead = walk[node + deltax]
+            above = walk[node + stride]
+            below = walk[node - stride]
+            if ahead:
+                neighbors.append((deltax, 0))
+                if above:
+                    neighbors.append((deltax, 1))
+                if below:
+                    neighbors.append((deltax, -1))
+            if above:
+                neighbors.append((0, 1))
+            if below:
+                neighbors.append((0, -1))
+        else:
+            ahead = walk[node + deltay * stride]
+            right = walk[node + 1]
+            left = walk[node - 1]
+            if ahead:
+                neighbors.append((0, deltay))
+                if right:
+                    neighbors.append((1, deltay))
+                if left:
+                    neighbors.append((-1, deltay))
+            if right:
+                neighbors.append((1, 0))
+            if left:
+                neighbors.append((-1, 0))
+        return neighbors
+
+    def _successors(self, node, direction, goal):
+        """Yield (successor, cost, direction, teleporter) for every edge out of node"""
+        stride = self._stride
+        nodey, nodex = divmod(node, stride)
+        for deltax, deltay in self._neighbors(node, direction):
+            jumpnode = self._jump(node, deltax, deltay, goal)
+            if jumpnode is not None:
+                jumpy, jumpx = divmod(jumpnode, stride)
+                cost = _octile(abs(jumpx - nodex), abs(jumpy - nodey))
+                yield jumpnode, cost, (deltax, deltay), None
+
+        if direction is not None and not self._stops[node]:
+            return
+
+        walk = self._walkable
+        for deltax, deltay in _DIRECTIONS:
+            tele = node + deltax + deltay * stride
+            partner = self._partners.get(tele)
+            if partner is None:
+                continue
+            if deltax and deltay and not (walk[node + deltax] and walk[node + deltay * stride]):
+                continue
+
+            cost = _SQRT2 if deltax and deltay else 1.0
+            if tele == goal:
+                yield tele, cost, None, None
+            else:
+                yield partner, cost, None, tele
+
+    def _jump_straight(self, node, direction, goal):
+        jumpnode = self._jumps[direction][node]
+        step = direction[0] + direction[1] * self._stride
+        if jumpnode < 0:
+            limit = self._runs[direction][node]
+        else:
+            limit = (jumpnode - node) // step
+
+        # Stop early if the goal is on the way
+        offset = goal - node
+        if offset % step == 0 and 0 < offset // step <= limit and \
+                (direction[1] or goal // self._stride == node // self._stride):
+            return goal
+        return jumpnode if jumpnode >= 0 else None
+
+    def _jump(self, node, deltax, deltay, goal):
+        if not (deltax and deltay):
+            return self._jump_straight(node, (deltax, deltay), goal)
+
+        walk = self._walkable
+        stops = self._stops
+        stride = self._stride
+        step = deltax + deltay * stride
+        while True:
+            node += step
+            if not walk[node]:
+                return None
+            if node == goal or stops[node]:
+                return node
+            if self._jump_straight(node, (deltax, 0), goal) is not None or \
+                    self._jump_straight(node, (0, deltay), goal) is not None:
+                return node
+            if not (walk[node + deltax] and walk[node + deltay * stride]):
+                return None
+
+    def find_world_path(self, start, goal):
+        """Return world space waypoints from start to goal or None
+
+        The first waypoint is the center of the start tile and the last one is
+        goal itself (unless goal is a teleporter).
+        """
+        dungeon = self.dungeon
+        path = self.find_path(dungeon.world_to_tile(*start), dungeon.world_to_tile(*goal))
+        if path is None:
+            return None
+
+        waypoints = [dungeon.tile_to_world(*tile) for tile in path]
+        if self._index(*path[-1]) not in self._partners:
+            waypoints[-1] = tuple(goal)
+        return waypoints
+
+
+class FlowField:
+    """Distance map from every tile to a single goal tile, usually the player
+
+    The map is computed once per goal tile with a vectorized Dial's algorithm
+    (orthogonal steps cost 2, diagonal steps 3) and stepping onto a linked
+    teleporter continues from its partner. Afterwards, any number of agents
+    can look up the best next tile in constant time. Fields for the last few
+    goal tiles are cached since the player often moves back and forth.
+
+    When the goal walks away from the last computed goal one step at a time,
+    the new field is repaired from the old one: every old distance plus the
+    cost of the steps walked is a valid upper bound, so the search only has
+    to expand the tiles that got closer. A step changes the distances of about
+    half of the map, so this saves less than it sounds (around 20% for a
+    single step on 200x200 maps, next to nothing after several). The field is
+    only recomputed when the goal moves to another tile, and only once it is
+    queried, so the same goal moves always give the same fields.
+    """
+
+    CACHE_SIZE = 8
+    ORTHOGONAL_COST = 2
+    DIAGONAL_COST = 3
+
+    def __init__(self, dungeon, cache_size=None):
+        self.dungeon = dungeon
+        self.cache_size = self.CACHE_SIZE if cache_size is None else cache_size
+        self.goal = None
+        self.hits = 0
+        self.misses = 0
+        self.repairs = 0
+        self._cache = collections.OrderedDict()
+        self._field_goal = None
+        # Cost of the single steps the goal took since _field_goal, None if it jumped
+        self._walked_cost = None
+        self._stride = 0
+        self._walkable = None
+        self._standable = None
+        self._partner_table = None
+        self._steps = []
+        self._distances = None
+        self._next_tiles = None
+        self.rebuild()
+
+    def rebuild(self):
+        tilemap = self.dungeon.tilemap
+        self._stride = stride = tilemap.width + 2
+        walkable, teleporters, partners = _padded_grid(tilemap)
+        self._walkable = walkable.reshape(-1)
+        self._standable = (walkable | teleporters).reshape(-1)
+
+        # Flat index of every tile's teleporter partner or itself
+        self._partner_table = np.arange(walkable.size)
+        if partners:
+            self._partner_table[list(partners)] = list(partners.values())
+
+        # Steps grouped by cost, with a (direction, tile) mask of allowed moves
+        self._steps = []
+        for diagonal in (True, False):
+            directions = [i for i in _DIRECTIONS if all(i) == diagonal]
+            offsets = np.array([deltax + deltay * stride for deltax, deltay in directions])
+            allowed = np.ones((len(directions), walkable.size), dtype=bool)
+            if diagonal:
+                # Diagonal steps must not cut corners
+                for idx, (deltax, deltay) in enumerate(directions):
+                    allowed[idx] = (
+                        np.roll(walkable, -deltax, axis=1) & np.roll(walkable, -deltay, axis=0)
+                    ).reshape(-1)
+            cost = self.DIAGONAL_COST if diagonal else self.ORTHOGONAL_COST
+            self._steps.append((offsets, cost, allowed))
+
+        self._cache.clear()
+        self._field_goal = None
+        self._walked_cost = None
+        self._distances = None
+        self._next_tiles = None
+        if self.goal is not None:
+            goal, self.goal = self.goal, None
+            self.set_goal_tile(*goal)
+
+    def set_goal(self, x, y):
+        """Point the field at the tile under world position (x, y)"""
+        self.set_goal_tile(*self.dungeon.world_to_tile(x, y))
+
+    def set_goal_tile(self, tilex, tiley):
+        if (tilex, tiley) == self.goal:
+            return
+
+        if self._walked_cost is not None:
+            stepcost = self._step_cost(self.goal, (tilex, tiley))
+            self._walked_cost = None if stepcost is None else self._walked_cost + stepcost
+        self.goal = (tilex, tiley)
+        # The field itself is only computed once someone asks for it
+
+    def _step_cost(self, fromtile, totile):
+        """Cost of a single step from one tile to another as the search sees it, or None"""
+        tilemap = self.dungeon.tilemap
+        for x, y in (fromtile, totile):
+            if not (0 <= x < tilemap.width and 0 <= y < tilemap.height):
+                return None
+
+        fromnode = (fromtile[1] + 1) * self._stride + fromtile[0] + 1
+        source = self._partner_table[(totile[1] + 1) * self._stride + totile[0] + 1]
+        if not self._standable[fromnode]:
+            return None
+        for offsets, cost, allowed in self._steps:
+            for idx, offset in enumerate(offsets.tolist()):
+                if source + offset == fromnode and allowed[idx, source]:
+                    return cost
+        return None
+
+    def _update(self):
+        if self.goal is None or self.goal == self._field_goal:
+            return
+
+        field = self._cache.get(self.goal)
+        if field is not None:
+            self.hits += 1
+            self._cache.move_to_end(self.goal)
+        else:
+            self.misses += 1
+            bounds = None
+            if self._walked_cost is not None:
+                # Old distances plus the walk from the old goal to the new one
+                self.repairs += 1
+                unreached = np.iinfo(np.int32).max
+                reached = self._distances < unreached
+                bounds = np.full_like(self._distances, unreached)
+                bounds[reached] = self._distances[reached] + self._walked_cost
+            field = self._compute(*self.goal, bounds=bounds)
+            self._cache[self.goal] = field
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        self._distances, self._next_tiles = field
+        self._field_goal = self.goal
+        self._walked_cost = 0
+
+    def _compute(self, tilex, tiley, bounds=None):
+        size = self._walkable.size
+        unreached = np.iinfo(np.int32).max
+        tilemap = self.dungeon.tilemap
+        if not (0 <= tilex < tilemap.width and 0 <= tiley < tilemap.height):
+            return np.full(size, unreached, dtype=np.int32), np.full(size, -1, dtype=np.int64)
+
+        # Known path lengths only need to be improved on, tiles that can not
+        # get closer keep them and are never expanded
+        if bounds is None:
+            distances = np.full(size, unreached, dtype=np.int32)
+        else:
+            distances = bounds
+
+        # Search backwards from the goal: a settled tile passes its distance on
+        # to its neighbors, a settled teleporter passes it on to the neighbors
+        # of its partner (stepping onto the partner lands on it)
+        goal = (tiley + 1) * self._stride + tilex + 1
+        distances[goal] = 0
+        marks = np.empty(size, dtype=np.int64)
+        buckets = {0: [np.array([goal])]}
+        current = 0
+        while buckets:
+            nodes = buckets.pop(current, None)
+            if nodes is None:
+                current += 1
+                continue
+            nodes = np.concatenate(nodes) if len(nodes) > 1 else nodes[0]
+            nodes = nodes[distances[nodes] == current]
+
+            # Drop duplicates without sorting, only one position per tile
+            # survives in marks
+            order = np.arange(len(nodes))
+            marks[nodes] = order
+            nodes = nodes[marks[nodes] == order]
+            sources = self._partner_table[nodes]
+
+            # Cheaper steps go last so they overwrite more expensive ones
+            for offsets, cost, allowed in self._steps:
+                targets = sources[np.newaxis, :] + offsets[:, np.newaxis]
+                targets = targets[allowed[:, sources]]
+                targets = targets[self._standable[targets]]
+                targets = targets[distances[targets] > current + cost]
+                if len(targets):
+                    distances[targets] = current + cost
+                    buckets.setdefault(current + cost, []).append(targets)
+            current += 1
+
+        # Cost of stepping onto every tile, then the cheapest step out of each
+        entry = np.where(self._walkable, distances, distances[self._partner_table])
+        entry = entry.astype(np.int64)
+        best = np.full(size, unreached, dtype=np.int64)
+        next_tiles = np.full(size, -1, dtype=np.int64)
+        indices = np.arange(size)
+        inner = slice(self._stride + 1, size - self._stride - 1)
+        for offsets, cost, allowed in self._steps:
+            for offset, dir_allowed in zip(offsets.tolist(), allowed):
+                targets = indices[inner] + offset
+                candidate = np.where(
+                    dir_allowed[inner] & self._standable[inner],
+                    entry[targets] + cost,
+                    unreached
+                )
+                better = candidate < best[inner]
+                best[inner] = np.where(better, candidate, best[inner])
+                next_tiles[inner] = np.where(better, targets, next_tiles[inner])
+        next_tiles[best >= unreached] = -1
+        next_tiles[goal] = -1
+
+        return distances, next_tiles
+
+    def _coords(self, node):
+        y, x = divmod(node, self._stride)
+        return x - 1, y - 1
+
+    def distance(self, x, y):
+        """Walking distance in tiles from world position (x, y) to the goal or None"""
+        self._update()
+        tilex, tiley = self.dungeon.world_to_tile(x, y)
+        tilemap = self.dungeon.tilemap
+        if self._distances is None or \
+                not (0 <= tilex < tilemap.width and 0 <= tiley < tilemap.height):
+            return None
+
+        dist = int(self._distances[(tiley + 1) * self._stride + tilex + 1])
+        if dist == np.iinfo(np.int32).max:
+            return None
+        return dist / self.ORTHOGONAL_COST
+
+    def next_step(self, x, y):
+        """World position of the next tile to walk to from (x, y) or None"""
+        self._update()
+        tilex, tiley = self.dungeon.world_to_tile(x, y)
+        tilemap = self.dungeon.tilemap
+        if self._next_tiles is None or \
+                not (0 <= tilex < tilemap.width and 0 <= tiley < tilemap.height):
+            return None
+
+        node = int(self._next_tiles[(tiley + 1) * self._stride + tilex + 1])
+        if node < 0:
+            return None
+        return self.dungeon.tile_to_world(*self._coords(node))
+
+    def next_steps(self, positions):
+        """Vectorized next_step() for an (N, 2) array of world positions
+
+        Returns an (N, 2) array of world positions with NaN rows where there is
+        no step to take.
+        """
+        self._update()
+        tiles, in_bounds = self.dungeon.world_to_tiles(positions)
+        steps = np.full((len(tiles), 2), np.nan)
+        if self._next_tiles is None:
+            return steps
+
+        tiles = tiles[in_bounds]
+        nodes = self._next_tiles[(tiles[:, 1] + 1) * self._stride + tiles[:, 0] + 1]
+        valid = np.flatnonzero(in_bounds)[nodes >= 0]
+        nodes = nodes[nodes >= 0]
+        tiley, tilex = np.divmod(nodes, self._stride)
+        steps[valid, 0] = tilex - 1 - self.dungeon.sizex / 2.0
+        steps[valid, 1] = tiley - 1 - self.dungeon.sizey / 2.0
+        return steps
@@ -0,0 +1,103 @@
+from concurrent import futures
+import multiprocessing
+import sys
+import time
+
+from .mapgen import cache
+from .mapgen.dungeon import Dungeon
+
+
+class LayerPrefetcher:
+    """Generate dungeon layers ahead of time
+
+    Tile maps are generated in a worker process and the scene graph is then
+    built in small steps from a task so that no single frame pays for a full
+    layer.
+    """
+
+    FRAME_BUDGET = 0.004
+
+    def __init__(self, taskmgr):
+        self.taskmgr = taskmgr
+        if hasattr(sys, 'frozen'):
+            # Frozen builds cannot spawn fresh interpreters, fall back to a thread
+            self._executor = futures.ThreadPoolExecutor(max_workers=1)
+        else:
+            self._executor = futures.ProcessPoolExecutor(
+                max_workers=1,
+                mp_context=multiprocessing.get_context('spawn')
+            )
+        self._pending = {}
+
+    def request(self, key, tile_generator, sizex, sizey, seed, gen_cache=None):
+        if key in self._pending:
+            return
+
+        future = self._executor.submit(
+            cache.generate,
+            tile_generator,
+            sizex,
+            sizey,
+            seed,
+            gen_cache
+        )
+        pending = {
+            'future': future,
+            'args': (tile_generator, sizex, sizey, seed),
+            'dungeon': None,
+            'steps': None,
+            'task': None,
+        }
+        self._pending[key] = pending
+
+        def build_task(task):
+            if self._advance(pending, self.FRAME_BUDGET):
+                return task.done
+            return task.cont
+        pending['task'] = self.taskmgr.add(build_task, 'LayerPrefetch-{}'.format(key))
+
+    def is_ready(self, key):
+        pending = self._pending.get(key)
+        return pending is not None and pending['steps'] is None and pending['dungeon'] is not None
+
+    def get(self, key):
+        """Return the prefetched dungeon for key, finishing any remaining work now"""
+        pending = self._pending.pop(key)
+        self.taskmgr.remove(pending['task'])
+        self._advance(pending, None)
+        return pending['dungeon']
+
+    def _advance(self, pending, budget):
+        if pending['dungeon'] is None:
+            future = pending['future']
+            if budget is not None and not future.done():
+                return False
+
+            tile_generator, sizex, sizey, seed = pending['args']
+            pending['dungeon'] = Dungeon(
+                tile_generator,
+                sizex,
+                sizey,
+                seed=seed,
+                tilemap=future.result(),
+                build=False
+            )
+            pending['steps'] = pending['dungeon'].build_steps()
+
+        if pending['steps'] is None:
+            return True
+
+        starttime = time.perf_counter()
+        for _ in pending['steps']:
+            if budget is not None and time.perf_counter() - starttime > budget:
+                return False
+
+        pending['steps'] = None
+        return True
+
+    def shutdown(self):
+        for pending in self._pending.values():
+            self.taskmgr.remove(pending['task'])
+            pending['future'].cancel()
+        self._pending.clear()
+        self._executor.shutdown(wait=False)
@@ -1,55 +1,194 @@
 import math
+import os
+import tempfile
 
+import numpy as np
 import panda3d.core as p3d
 
+from .gpucache import get_gpu_cache
 
-_SDF_SIZE = 64
+
+SDF_SIZE = p3d.ConfigVariableInt(
+    'range-indicator-sdf-size', 64,
+    'Resolution of the distance field textures used by range indicators'
+)
+SDF_CACHE_DIR = p3d.ConfigVariableFilename(
+    'sdf-cache-dir', '',
+    'Directory to cache range indicator distance fields in, leave empty to disable caching'
+)
+
+# Bump when the distance fields change so old cached ones are not used
+_SDF_VERSION = 1
 
 
 def _lin_remap(value, low1, high1, low2, high2):
     return low2 + (value - low1) * (high2 - low2) / (high1 - low1)
 
 
-def _make_sdf_circle():
-    sdfimg = p3d.PNMImage(_SDF_SIZE, _SDF_SIZE)
+def _sdf_circle(normx, normy):
     maxneg = -math.sqrt(2) + 1
+    length = normx ** 2 + normy ** 2
+    return np.where(
+        length < 1.0,
+        _lin_remap(1 - length, 0, 1, 0.5, 1),
+        _lin_remap(-length + 1, maxneg, 0, 0, 0.5)
+    )
 
-    for imgx in range(_SDF_SIZE):
-        normx = (imgx / (_SDF_SIZE - 1)) * 2.0 - 1.0
-        for imgy in range(_SDF_SIZE):
-            normy = (imgy / (_SDF_SIZE - 1)) * 2.0 - 1.0
 
-            length = normx ** 2 + normy ** 2
-            if length < 1.0:
-                dist = _lin_remap(1 - length, 0, 1, 0.5, 1)
-            else:
-                dist = _lin_remap(-length + 1, maxneg, 0, 0, 0.5)
+def _sdf_box(normx, normy):
+    return _lin_remap(1 - np.maximum(np.abs(normx), np.abs(normy)), 0, 1, 0.5, 1)
 
-            sdfimg.setXel(imgx, imgy, dist)
 
-    sdftex = p3d.Texture()
-    sdftex.load(sdfimg)
-    return sdftex
+def _sdf_ring(normx, normy, inner):
+    """Band between radius inner and 1"""
+    length = np.hypot(normx, normy)
+    return 0.5 + 0.5 * np.minimum(1 - length, length - inner)
+
 
+def _sdf_cone(normx, normy, angle):
+    """Circle sector facing forward (+y), angle is the full width in degrees"""
+    length = np.hypot(normx, normy)
+    half = math.radians(angle) / 2.0
+    # Angle past the side of the sector, negative inside of it
+    past = np.abs(np.arctan2(normx, normy)) - half
+    side = np.where(np.abs(past) < math.pi / 2, -length * np.sin(past), -length * np.sign(past))
+    return 0.5 + 0.5 * np.minimum(1 - length, side)
 
-def _make_sdf_box():
-    sdfimg = p3d.PNMImage(_SDF_SIZE, _SDF_SIZE)
 
-    for imgx in range(_SDF_SIZE):
-        normx = abs((imgx / _SDF_SIZE) * 2.0 - 1.0)
-        for imgy in range(_SDF_SIZE):
-            normy = abs((imgy / _SDF_SIZE) * 2.0 - 1.0)
+def _sdf_capsule(normx, normy, aspect):
+    """Capsule along y, aspect is the half length divided by the radius"""
+    # Work in units of the radius, the card is stretched along y by aspect
+    posy = normy * aspect
+    offset = np.maximum(np.abs(posy) - (aspect - 1), 0)
+    return 0.5 + 0.5 * (1 - np.hypot(normx, offset))
 
-            dist = _lin_remap(1 - max(normx, normy), 0, 1, 0.5, 1)
-            sdfimg.setXel(imgx, imgy, dist)
 
-    sdftex = p3d.Texture()
-    sdftex.load(sdfimg)
+_SDF_SHAPES = {
+    'circle': _sdf_circle,
+    'box': _sdf_box,
+    'ring': _sdf_ring,
+    'cone': _sdf_cone,
+    'capsule': _sdf_capsule,
+}
+
+
+def make_sdf(shape, size, **params):
+    """Return a (size, size) uint8 distance field for shape
+
+    Values are 128 on the edge of the shape and go up inside of it. Rows go
+    from the back (-1) to the front (1) of the card the field is drawn on.
+    """
+    coords = (np.arange(size) + 0.5) / size * 2.0 - 1.0
+    normx, normy = np.meshgrid(coords, coords)
+    dist = _SDF_SHAPES[shape](normx, normy, **params)
+    return np.round(np.clip(dist, 0.0, 1.0) * 255).astype(np.uint8)
+
+
+def _sdf_cache_path(cache_dir, shape, size, params):
+    paramstr = ''.join('-{}{}'.format(key, value) for key, value in sorted(params.items()))
+    filename = 'sdf{}-{}-{}{}.raw'.format(_SDF_VERSION, shape, size, paramstr)
+    return os.path.join(cache_dir, filename)
+
+
+def _load_sdf(shape, size, params):
+    cache_dir = SDF_CACHE_DIR.get_value()
+    if not cache_dir:
+        return make_sdf(shape, size, **params)
+
+    path = _sdf_cache_path(cache_dir.to_os_specific(), shape, size, params)
+    try:
+        with open(path, 'rb') as sdffile:
+            data = np.frombuffer(sdffile.read(), dtype=np.uint8)
+        if data.size == size * size:
+            return data.reshape(size, size)
+    except OSError:
+        pass
+
+    data = make_sdf(shape, size, **params)
+    try:
+        _save_sdf(path, data)
+    except OSError:
+        # The cache is optional, keep going with the computed field
+        pass
+    return data
+
+
+def _save_sdf(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # Write to a temporary file first so readers never see a partial field
+    tmpfd, tmppath = tempfile.mkstemp(dir=os.path.dirname(path))
+    try:
+        with os.fdopen(tmpfd, 'wb') as sdffile:
+            sdffile.write(data.tobytes())
+        os.replace(tmppath, path)
+    except OSError:
+        if os.path.exists(tmppath):
+            os.remove(tmppath)
+        raise
+
+
+_SDF_DATA = {}
+_SDF_TEXTURES = {}
+
+
+def _sdf_key(shape, size, params):
+    if size is None:
+        size = SDF_SIZE.get_value()
+    if shape not in _SDF_SHAPES:
+        raise ValueError("Unknown shape for RangeIndicator: {}".format(shape))
+
+    # Indicators with nearly the same proportions share a field
+    return shape, size, tuple(sorted((key, round(value, 3)) for key, value in params.items()))
+
+
+def _get_sdf_data(key):
+    data = _SDF_DATA.get(key)
+    if data is None:
+        shape, size, params = key
+        data = _load_sdf(shape, size, dict(params))
+        _SDF_DATA[key] = data
+    return data
+
+
+def get_sdf_texture(shape, size=None, **params):
+    """Return the distance field texture for shape, building it on first use"""
+    key = _sdf_key(shape, size, params)
+    sdftex = _SDF_TEXTURES.get(key)
+    if sdftex is None:
+        size = key[1]
+        sdftex = p3d.Texture('SDF_' + shape)
+        sdftex.setup_2d_texture(size, size, p3d.Texture.T_unsigned_byte, p3d.Texture.F_luminance)
+        sdftex.set_wrap_u(p3d.SamplerState.WM_clamp)
+        sdftex.set_wrap_v(p3d.SamplerState.WM_clamp)
+        sdftex.set_ram_image(_get_sdf_data(key).tobytes())
+        _SDF_TEXTURES[key] = sdftex
     return sdftex
 
 
-_SDF_CIRCLE = _make_sdf_circle()
-_SDF_BOX = _make_sdf_box()
+def _shape_layout(shape, kwargs):
+    """Return (sdf shape, sdf params, half width, half length, forward offset) for an indicator"""
+    if shape == 'circle':
+        radius = kwargs['radius']
+        return 'circle', {}, radius, radius, 0.0
+    if shape == 'box':
+        length = kwargs['length']
+        return 'box', {}, kwargs['width'] / 2.0, length / 2.0, length / 2.0
+    if shape == 'ring':
+        radius = kwargs['radius']
+        return 'ring', {'inner': kwargs['inner_radius'] / radius}, radius, radius, 0.0
+    if shape == 'cone':
+        radius = kwargs['radius']
+        return 'cone', {'angle': kwargs['angle']}, radius, radius, 0.0
+    if shape == 'capsule':
+        length = kwargs['length']
+        radius = kwargs['radius']
+        return 'capsule', {'aspect': length / 2.0 / radius}, radius, length / 2.0, length / 2.0
+
+    raise ValueError("Unknown shape for RangeIndicator: {}".format(shape))
+
+
+DEFAULT_COLOR = (0.8, 0.0, 0.0, 0.3)
+DEFAULT_OUTLINE_COLOR = (0.0, 0.0, 0.0, 0.8)
 
 
 _RI_VERT = """
@@ -68,6 +207,23 @@ void main() {
 """
 
 
+# Shared by the single and batched fragment shaders
+_SDF_SHADING = """
+const float outline_size = 0.05;
+const float smoothing = 0.005;
+
+vec4 shade_sdf(float dist, vec4 ricolor, vec4 outline_color) {
+    float outline_dist = 0.5 + outline_size;
+
+    float outline_factor = smoothstep(outline_dist - smoothing, outline_dist + smoothing, dist);
+    vec4 color = mix(outline_color, ricolor, outline_factor);
+    float alpha = smoothstep(0.5 - smoothing, 0.5 + smoothing, dist);
+
+    return vec4(color.rgb, color.a * alpha);
+}
+"""
+
+
 _RI_FRAG = """
 #version 130
 uniform sampler2D sdftex;
@@ -77,42 +233,106 @@ uniform vec4 outline_color;
 in vec2 texcoord;
 
 out vec4 o_color;
+""" + _SDF_SHADING + """
+void main() {
+    o_color = shade_sdf(texture(sdftex, texcoord).r, ricolor, outline_color);
+}
+"""
 
-const float outline_size = 0.05;
-const float smoothing = 0.005;
+
+_SHADER = None
+
+
+def get_shader():
+    global _SHADER  # pylint: disable=global-statement
+    if _SHADER is None:
+        _SHADER = p3d.Shader.make(p3d.Shader.SL_GLSL, _RI_VERT, _RI_FRAG)
+    return _SHADER
+
+
+_BATCH_VERT = """
+#version 140
+uniform mat4 p3d_ModelViewProjectionMatrix;
+uniform samplerBuffer instances;
+
+in vec4 p3d_Vertex;
+in vec2 p3d_MultiTexCoord0;
+
+out vec2 texcoord;
+flat out float layer;
+flat out vec4 ricolor;
+flat out vec4 outline_color;
 
 void main() {
-    float dist = texture(sdftex, texcoord).r;
-    float outline_dist = 0.5 + outline_size;
+    // Each instance is (x, y, z, heading), (half width, half length, offset, layer),
+    // color and outline color
+    int first = gl_InstanceID * 4;
+    vec4 placement = texelFetch(instances, first);
+    vec4 extents = texelFetch(instances, first + 1);
+    ricolor = texelFetch(instances, first + 2);
+    outline_color = texelFetch(instances, first + 3);
+    texcoord = p3d_MultiTexCoord0;
+    layer = extents.w;
+
+    if (layer < 0.0) {
+        // Hidden, put every vertex outside of the clip volume
+        gl_Position = vec4(2.0, 2.0, 2.0, 1.0);
+        return;
+    }
+
+    vec2 local = vec2(p3d_Vertex.x * extents.x, p3d_Vertex.y * extents.y + extents.z);
+    float sinh = sin(placement.w);
+    float cosh = cos(placement.w);
+    vec2 rotated = vec2(local.x * cosh - local.y * sinh, local.x * sinh + local.y * cosh);
+    gl_Position = p3d_ModelViewProjectionMatrix * vec4(placement.xy + rotated, placement.z, 1.0);
+}
+"""
 
-    float outline_factor = smoothstep(outline_dist - smoothing, outline_dist + smoothing, dist);
-    vec4 color = mix(outline_color, ricolor, outline_factor);
-    float alpha = smoothstep(0.5 - smoothing, 0.5 + smoothing, dist);
 
-    o_color = vec4(color.rgb, color.a * alpha);
+_BATCH_FRAG = """
+#version 140
+uniform sampler2DArray sdfatlas;
+
+in vec2 texcoord;
+flat in float layer;
+flat in vec4 ricolor;
+flat in vec4 outline_color;
+
+out vec4 o_color;
+""" + _SDF_SHADING + """
+void main() {
+    o_color = shade_sdf(texture(sdfatlas, vec3(texcoord, layer)).r, ricolor, outline_color);
 }
 """
 
 
-_SHADER = p3d.Shader.make(p3d.Shader.SL_GLSL, _RI_VERT, _RI_FRAG)
+_BATCH_SHADER = None
+
+
+def get_batch_shader():
+    global _BATCH_SHADER  # pylint: disable=global-statement
+    if _BATCH_SHADER is None:
+        _BATCH_SHADER = p3d.Shader.make(p3d.Shader.SL_GLSL, _BATCH_VERT, _BATCH_FRAG)
+    return _BATCH_SHADER
+
+
+# What the player's abilities need, so it can be made while the game is loading
+get_gpu_cache().register('rangeindicator.shader', get_shader)
+get_gpu_cache().register('rangeindicator.sdf.circle', lambda: get_sdf_texture('circle'))
+get_gpu_cache().register('rangeindicator.sdf.box', lambda: get_sdf_texture('box'))
 
 
 class RangeIndicator:
     def __init__(self, shape, **kwargs):
-        sdftex = None
+        sdfshape, sdfparams, halfwidth, halflength, offset = _shape_layout(shape, kwargs)
+        sdftex = get_sdf_texture(sdfshape, **sdfparams)
         frame = p3d.LVector4(-1, 1, -1, 1)
-        scale = p3d.LVector3(1, 1, 1)
-        offset = p3d.LVector3(0, 0, 0)
-
-        if shape == 'circle':
-            sdftex = _SDF_CIRCLE
-            scale *= kwargs['radius']
-        elif shape == 'box':
-            sdftex = _SDF_BOX
-            scale = p3d.LVector3(kwargs['width'] / 2.0, 1, kwargs['length'] / 2.0)
-            offset = p3d.LVector3(0, kwargs['length'] / 2.0, 0)
-        else:
-            raise ValueError("Unknown shape for RangeIndicator: {}".format(shape))
+        scale = p3d.LVector3(halfwidth, 1, halflength)
+        offset = p3d.LVector3(0, offset, 0)
+
+        self.shape = shape
+        # Shape arguments, e.g. for SpatialHash.query_shape()
+        self.params = dict(kwargs)
 
         cardmaker = p3d.CardMaker('RI_' + shape)
         cardmaker.set_frame(frame)
@@ -125,13 +345,26 @@ class RangeIndicator:
 
         card.set_texture(sdftex)
 
-        card.set_shader(_SHADER)
+        card.set_shader(get_shader())
         card.set_shader_input('sdftex', sdftex)
-        card.set_shader_input('ricolor', p3d.LVector4(0.8, 0.0, 0.0, 0.3))
-        card.set_shader_input('outline_color', p3d.LVector4(0.0, 0.0, 0.0, 0.8))
+        card.set_shader_input('ricolor', p3d.LVector4(*DEFAULT_COLOR))
+        card.set_shader_input('outline_color', p3d.LVector4(*DEFAULT_OUTLINE_COLOR))
 
         self.graphics = card
 
+    @property
+    def length(self):
+        """How far a box reaches in front of its parent, can be shortened to stop at walls"""
+        return self.params.get('length')
+
+    @length.setter
+    def length(self, value):
+        if self.shape != 'box':
+            raise ValueError("Only box RangeIndicators have a length")
+        self.params['length'] = value
+        self.graphics.set_y(value / 2.0)
+        self.graphics.set_sz(value / 2.0)
+
     @property
     def visible(self):
         return not self.graphics.is_hidden()
@@ -142,3 +375,159 @@ class RangeIndicator:
             self.graphics.show()
         else:
             self.graphics.hide()
+
+
+class RangeIndicatorBatch:
+    """Many range indicators drawn with one instanced draw call
+
+    Every distance field used by the batch is a layer of one texture array.
+    Each indicator has a slot in a buffer texture holding its placement, size,
+    layer and colors, so moving, recoloring, showing or hiding an indicator
+    only writes its own slot. Indicators are placed in the space of the
+    batch's graphics node and heading is in degrees, like NodePath.set_h().
+    """
+
+    INITIAL_CAPACITY = 16
+    # Texels per slot: (x, y, z, heading), (half width, half length, offset, layer),
+    # color and outline color
+    _TEXELS = 4
+
+    def __init__(self, name='RangeIndicatorBatch', sdf_size=None):
+        self.sdf_size = SDF_SIZE.get_value() if sdf_size is None else sdf_size
+        self._layers = {}
+        self._layer_keys = []
+        self._count = 0
+        self._free = []
+        self._capacity = self.INITIAL_CAPACITY
+        self._slots = np.zeros((self._capacity, self._TEXELS, 4), dtype=np.float32)
+        self._slots[:, 1, 3] = -1
+        # Layer of every slot, also while it is hidden
+        self._slot_layers = np.full(self._capacity, -1, dtype=np.float32)
+
+        self._atlas = p3d.Texture(name + '_atlas')
+        self._atlas.set_wrap_u(p3d.SamplerState.WM_clamp)
+        self._atlas.set_wrap_v(p3d.SamplerState.WM_clamp)
+        self._instances = p3d.Texture(name + '_instances')
+        self._setup_instances()
+
+        vdata = p3d.GeomVertexData(name, p3d.GeomVertexFormat.get_v3t2(), p3d.Geom.UH_static)
+        vdata.set_num_rows(4)
+        vertex = p3d.GeomVertexWriter(vdata, 'vertex')
+        texcoord = p3d.GeomVertexWriter(vdata, 'texcoord')
+        for posx, posy in ((-1, -1), (1, -1), (1, 1), (-1, 1)):
+            vertex.add_data3(posx, posy, 0)
+            texcoord.add_data2((posx + 1) / 2.0, (posy + 1) / 2.0)
+        tris = p3d.GeomTriangles(p3d.Geom.UH_static)
+        tris.add_vertices(0, 1, 2)
+        tris.add_vertices(0, 2, 3)
+        geom = p3d.Geom(vdata)
+        geom.add_primitive(tris)
+        geomnode = p3d.GeomNode(name)
+        geomnode.add_geom(geom)
+        # Instances are placed by the shader, so the culler can not know where they are
+        geomnode.set_bounds(p3d.OmniBoundingVolume())
+        geomnode.set_final(True)
+
+        self.graphics = p3d.NodePath(geomnode)
+        self.graphics.set_transparency(p3d.TransparencyAttrib.MAlpha)
+        self.graphics.set_two_sided(True)
+        self.graphics.set_shader(get_batch_shader())
+        self.graphics.set_shader_input('instances', self._instances)
+        self.graphics.set_shader_input('sdfatlas', self._atlas)
+        self.graphics.set_instance_count(0)
+
+    def __len__(self):
+        return self._count - len(self._free)
+
+    def _setup_instances(self):
+        self._instances.setup_buffer_texture(
+            self._capacity * self._TEXELS,
+            p3d.Texture.T_float,
+            p3d.Texture.F_rgba32,
+            p3d.GeomEnums.UH_dynamic
+        )
+        self._instances.set_ram_image(self._slots.tobytes())
+
+    def _get_layer(self, sdfshape, sdfparams):
+        key = _sdf_key(sdfshape, self.sdf_size, sdfparams)
+        layer = self._layers.get(key)
+        if layer is None:
+            # New shapes are rare, so the whole array is uploaded again
+            layer = len(self._layer_keys)
+            self._layers[key] = layer
+            self._layer_keys.append(key)
+            self._atlas.setup_2d_texture_array(
+                self.sdf_size,
+                self.sdf_size,
+                len(self._layer_keys),
+                p3d.Texture.T_unsigned_byte,
+                p3d.Texture.F_luminance
+            )
+            layers = np.stack([_get_sdf_data(i) for i in self._layer_keys])
+            self._atlas.set_ram_image(layers.tobytes())
+        return layer
+
+    def _write_slot(self, slot):
+        texels = np.frombuffer(self._instances.modify_ram_image(), dtype=np.float32)
+        start = slot * self._TEXELS * 4
+        texels[start:start + self._TEXELS * 4] = self._slots[slot].reshape(-1)
+
+    def _grow(self):
+        self._capacity *= 2
+        slots = np.zeros((self._capacity, self._TEXELS, 4), dtype=np.float32)
+        slots[:, 1, 3] = -1
+        slots[:len(self._slots)] = self._slots
+        self._slots = slots
+        slot_layers = np.full(self._capacity, -1, dtype=np.float32)
+        slot_layers[:len(self._slot_layers)] = self._slot_layers
+        self._slot_layers = slot_layers
+        self._setup_instances()
+
+    def add(self, shape, pos=(0, 0, 0), heading=0, color=DEFAULT_COLOR,
+            outline_color=DEFAULT_OUTLINE_COLOR, visible=True, **kwargs):
+        """Add an indicator taking the same shape arguments as RangeIndicator, return its slot"""
+        sdfshape, sdfparams, halfwidth, halflength, offset = _shape_layout(shape, kwargs)
+        layer = self._get_layer(sdfshape, sdfparams)
+
+        if self._free:
+            slot = self._free.pop()
+        else:
+            slot = self._count
+            self._count += 1
+            if slot >= self._capacity:
+                self._grow()
+            self.graphics.set_instance_count(self._count)
+
+        self._slot_layers[slot] = layer
+        data = self._slots[slot]
+        data[0, :3] = pos
+        data[0, 3] = math.radians(heading)
+        data[1] = halfwidth, halflength, offset, layer if visible else -1
+        data[2] = color
+        data[3] = outline_color
+        self._write_slot(slot)
+        return slot
+
+    def remove(self, slot):
+        """Hide the indicator in slot and let add() reuse the slot"""
+        self.set_visible(slot, False)
+        self._slot_layers[slot] = -1
+        self._free.append(slot)
+
+    def is_visible(self, slot):
+        return self._slots[slot, 1, 3] >= 0
+
+    def set_visible(self, slot, visible):
+        self._slots[slot, 1, 3] = self._slot_layers[slot] if visible else -1
+        self._write_slot(slot)
+
+    def set_transform(self, slot, pos, heading):
+        self._slots[slot, 0, :3] = pos
+        self._slots[slot, 0, 3] = math.radians(heading)
+        self._write_slot(slot)
+
+    def set_color(self, slot, color, outline_color=None):
+        self._slots[slot, 2] = color
+        if outline_color is not None:
+            self._slots[slot, 3] = outline_color
+        self._write_slot(slot)
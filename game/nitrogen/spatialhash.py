@@ -0,0 +1,288 @@
+import heapq
+import math
+
+from .mapgen.chunked import ChunkedDungeon
+
+
+class SpatialHash:
+    """Uniform grid of entity positions lined up with a dungeon's tiles
+
+    Every cell covers cell_tiles by cell_tiles tiles and only cells holding
+    entities are stored, so the grid also works for endless layers. Entities
+    can be any hashable value and are treated as points. Queries look at the
+    occupied cells overlapping the query area (or at every occupied cell when
+    there are fewer of those), so their cost does not grow with the total
+    number of entities.
+
+    Area queries take the same parameters as RangeIndicator: x, y and heading
+    place the indicator like its parent node (heading in degrees, forward is
+    +y at heading 0).
+    """
+
+    CELL_TILES = 4
+
+    def __init__(self, dungeon, cell_tiles=None):
+        self.cell_tiles = self.CELL_TILES if cell_tiles is None else cell_tiles
+        if isinstance(dungeon, ChunkedDungeon):
+            sizex = sizey = dungeon.CHUNK_SIZE
+        else:
+            sizex, sizey = dungeon.sizex, dungeon.sizey
+        # World position of the lower corner of tile (0, 0)
+        self._originx = -0.5 - sizex / 2.0
+        self._originy = -0.5 - sizey / 2.0
+        self._cells = {}
+        self._positions = {}
+        self._entity_cells = {}
+
+    def __len__(self):
+        return len(self._positions)
+
+    def __contains__(self, entity):
+        return entity in self._positions
+
+    def get_pos(self, entity):
+        return self._positions[entity]
+
+    def _get_cell(self, x, y):
+        return (
+            math.floor((x - self._originx) / self.cell_tiles),
+            math.floor((y - self._originy) / self.cell_tiles),
+        )
+
+    def insert(self, entity, x, y):
+        if entity in self._positions:
+            self.move(entity, x, y)
+            return
+
+        cell = self._get_cell(x, y)
+        self._positions[entity] = (x, y)
+        self._entity_cells[entity] = cell
+        self._cells.setdefault(cell, set()).add(entity)
+
+    def move(self, entity, x, y):
+        self._positions[entity] = (x, y)
+        cell = self._get_cell(x, y)
+        oldcell = self._entity_cells[entity]
+        if cell == oldcell:
+            return
+
+        self._remove_from_cell(entity, oldcell)
+        self._entity_cells[entity] = cell
+        self._cells.setdefault(cell, set()).add(entity)
+
+    def remove(self, entity):
+        del self._positions[entity]
+        self._remove_from_cell(entity, self._entity_cells.pop(entity))
+
+    def _remove_from_cell(self, entity, cell):
+        entities = self._cells[cell]
+        entities.discard(entity)
+        if not entities:
+            del self._cells[cell]
+
+    def _candidates(self, minx, miny, maxx, maxy):
+        """Yield (entity, x, y) for entities in cells overlapping the bounding box"""
+        mincellx, mincelly = self._get_cell(minx, miny)
+        maxcellx, maxcelly = self._get_cell(maxx, maxy)
+        numcells = (maxcellx - mincellx + 1) * (maxcelly - mincelly + 1)
+        positions = self._positions
+
+        if numcells > len(self._cells):
+            cells = (
+                entities for (cellx, celly), entities in self._cells.items()
+                if mincellx <= cellx <= maxcellx and mincelly <= celly <= maxcelly
+            )
+        else:
+            cells = (
+                self._cells[(cellx, celly)]
+                for celly in range(mincelly, maxcelly + 1)
+                for cellx in range(mincellx, maxcellx + 1)
+                if (cellx, celly) in self._cells
+            )
+
+        for entities in cells:
+            for entity in entities:
+                posx, posy = positions[entity]
+                yield entity, posx, posy
+
+    def query_circle(self, x, y, radius):
+        """Return the entities within radius of (x, y)"""
+        radius_squared = radius * radius
+        candidates = self._candidates(x - radius, y - radius, x + radius, y + radius)
+        return [
+            entity for entity, posx, posy in candidates
+            if (posx - x) ** 2 + (posy - y) ** 2 <= radius_squared
+        ]
+
+    def query_box(self, x, y, heading, length, width):
+        """Return the entities in a box reaching length forward from (x, y), width across"""
+        heading = math.radians(heading)
+        forwardx = -math.sin(heading)
+        forwardy = math.cos(heading)
+        halfwidth = width / 2.0
+
+        # Bounds of the four corners
+        endx = x + forwardx * length
+        endy = y + forwardy * length
+        sidex = forwardy * halfwidth
+        sidey = -forwardx * halfwidth
+        cornersx = (x + sidex, x - sidex, endx + sidex, endx - sidex)
+        cornersy = (y + sidey, y - sidey, endy + sidey, endy - sidey)
+
+        found = []
+        candidates = self._candidates(min(cornersx), min(cornersy), max(cornersx), max(cornersy))
+        for entity, posx, posy in candidates:
+            offx = posx - x
+            offy = posy - y
+            along = offx * forwardx + offy * forwardy
+            across = offx * forwardy - offy * forwardx
+            if 0 <= along <= length and abs(across) <= halfwidth:
+                found.append(entity)
+        return found
+
+    def query_ring(self, x, y, radius, inner_radius):
+        """Return the entities between inner_radius and radius of (x, y)"""
+        inner_squared = inner_radius * inner_radius
+        radius_squared = radius * radius
+        candidates = self._candidates(x - radius, y - radius, x + radius, y + radius)
+        return [
+            entity for entity, posx, posy in candidates
+            if inner_squared <= (posx - x) ** 2 + (posy - y) ** 2 <= radius_squared
+        ]
+
+    def query_cone(self, x, y, heading, radius, angle):
+        """Return the entities within radius of (x, y) and angle degrees wide around forward"""
+        heading = math.radians(heading)
+        forwardx = -math.sin(heading)
+        forwardy = math.cos(heading)
+        mincos = math.cos(math.radians(angle) / 2.0)
+        radius_squared = radius * radius
+
+        found = []
+        candidates = self._candidates(x - radius, y - radius, x + radius, y + radius)
+        for entity, posx, posy in candidates:
+            offx = posx - x
+            offy = posy - y
+            dist_squared = offx * offx + offy * offy
+            if dist_squared > radius_squared:
+                continue
+            if offx * forwardx + offy * forwardy >= mincos * math.sqrt(dist_squared):
+                found.append(entity)
+        return found
+
+    def query_capsule(self, x, y, heading, length, radius):
+        """Return the entities in a capsule reaching length forward from (x, y), radius wide"""
+        heading = math.radians(heading)
+        forwardx = -math.sin(heading)
+        forwardy = math.cos(heading)
+        endx = x + forwardx * length
+        endy = y + forwardy * length
+        radius_squared = radius * radius
+
+        # The segment between the centers of the round ends
+        startx = x + forwardx * radius
+        starty = y + forwardy * radius
+        seglength = max(length - 2 * radius, 0.0)
+
+        found = []
+        candidates = self._candidates(
+            min(x, endx) - radius,
+            min(y, endy) - radius,
+            max(x, endx) + radius,
+            max(y, endy) + radius
+        )
+        for entity, posx, posy in candidates:
+            along = (posx - startx) * forwardx + (posy - starty) * forwardy
+            along = min(max(along, 0.0), seglength)
+            offx = posx - startx - forwardx * along
+            offy = posy - starty - forwardy * along
+            if offx * offx + offy * offy <= radius_squared:
+                found.append(entity)
+        return found
+
+    def query_shape(self, shape, x, y, heading=0, **kwargs):
+        """Return the entities covered by a RangeIndicator of shape placed at (x, y, heading)"""
+        if shape == 'circle':
+            return self.query_circle(x, y, kwargs['radius'])
+        if shape == 'box':
+            return self.query_box(x, y, heading, kwargs['length'], kwargs['width'])
+        if shape == 'ring':
+            return self.query_ring(x, y, kwargs['radius'], kwargs['inner_radius'])
+        if shape == 'cone':
+            return self.query_cone(x, y, heading, kwargs['radius'], kwargs['angle'])
+        if shape == 'capsule':
+            return self.query_capsule(x, y, heading, kwargs['length'], kwargs['radius'])
+
+        raise ValueError("Unknown shape for RangeIndicator: {}".format(shape))
+
+    def query_nearest(self, x, y, count, max_radius=None):
+        """Return up to count entities closest to (x, y), nearest first
+
+        Rings of cells are searched outward from (x, y) until the closest
+        entities found so far are nearer than any cell left to search. Once a
+        ring would have more cells than there are occupied cells, the occupied
+        cells are scanned instead.
+        """
+        if max_radius is None:
+            max_radius = math.inf
+        max_radius_squared = max_radius * max_radius
+        centerx, centery = self._get_cell(x, y)
+        positions = self._positions
+
+        # Max-heap of (-distance squared, tiebreak, entity) holding the best so far
+        best = []
+        tiebreak = 0
+
+        def consider(entities):
+            nonlocal tiebreak
+            for entity in entities:
+                posx, posy = positions[entity]
+                dist_squared = (posx - x) ** 2 + (posy - y) ** 2
+                if dist_squared > max_radius_squared:
+                    continue
+                tiebreak += 1
+                if len(best) < count:
+                    heapq.heappush(best, (-dist_squared, tiebreak, entity))
+                elif dist_squared < -best[0][0]:
+                    heapq.heapreplace(best, (-dist_squared, tiebreak, entity))
+
+        ring = 0
+        visited = 0
+        while visited < len(self._cells) and count > 0:
+            # Anything in this ring or farther out is at least this far away
+            nearest_possible = max(ring - 1, 0) * self.cell_tiles
+            if nearest_possible > max_radius:
+                break
+            if len(best) == count and nearest_possible ** 2 > -best[0][0]:
+                break
+
+            if 8 * ring > len(self._cells):
+                # Sparse: finish with the occupied cells outside of the searched square
+                for (cellx, celly), entities in self._cells.items():
+                    if max(abs(cellx - centerx), abs(celly - centery)) >= ring:
+                        consider(entities)
+                break
+
+            for cell in _ring_cells(centerx, centery, ring):
+                entities = self._cells.get(cell)
+                if entities is not None:
+                    visited += 1
+                    consider(entities)
+            ring += 1
+
+        best.sort(key=lambda i: (-i[0], i[1]))
+        return [entity for _, _, entity in best]
+
+
+def _ring_cells(centerx, centery, ring):
+    """Yield the cells on the border of the square ring cells out from the center"""
+    if ring == 0:
+        yield centerx, centery
+        return
+
+    for offx in range(-ring, ring + 1):
+        yield centerx + offx, centery - ring
+        yield centerx + offx, centery + ring
+    for offy in range(-ring + 1, ring):
+        yield centerx - ring, centery + offy
+        yield centerx + ring, centery + offy
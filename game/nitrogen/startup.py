@@ -0,0 +1,48 @@
+import contextlib
+import importlib
+import time
+
+import panda3d.core as p3d
+
+
+STARTUP_TIMING = p3d.ConfigVariableBool(
+    'startup-timing', False,
+    'Print how long module imports and startup phases took once the first frame is drawn'
+)
+
+
+_START_TIME = time.perf_counter()
+_TIMINGS = []
+
+
+@contextlib.contextmanager
+def timed(label):
+    """Record how long the body of the with statement takes"""
+    starttime = time.perf_counter()
+    try:
+        yield
+    finally:
+        _TIMINGS.append((label, time.perf_counter() - starttime))
+
+
+def import_module(name):
+    """Import a module and record how long it took, including modules it imports first"""
+    with timed('import ' + name):
+        return importlib.import_module(name)
+
+
+def get_timings():
+    """Return a list of (label, seconds) in the order they were recorded"""
+    return list(_TIMINGS)
+
+
+def report():
+    """Print recorded timings and the time since startup, if startup-timing is set"""
+    if not STARTUP_TIMING.get_value():
+        return
+
+    print("Startup timings:")
+    for label, duration in _TIMINGS:
+        print("  {:<36}{:>9.1f}ms".format(label, duration * 1000))
+    total = time.perf_counter() - _START_TIME
+    print("  {:<36}{:>9.1f}ms".format('time to first frame', total * 1000))
@@ -0,0 +1,43 @@
+import panda3d.core as p3d
+
+
+SIM_TICK_RATE = p3d.ConfigVariableInt(
+    'sim-tick-rate', 60,
+    'Simulation ticks per second, independent of the frame rate'
+)
+SIM_MAX_STEPS = p3d.ConfigVariableInt(
+    'sim-max-steps', 5,
+    'Most simulation ticks to run in one frame, time beyond that is dropped'
+)
+
+
+class FixedTimestep:
+    """Turn variable frame times into a whole number of fixed ticks
+
+    Frame time is added to an accumulator and every full tick in it is run.
+    After a hitch at most max_steps ticks are run and the rest of the time is
+    dropped (and counted in dropped_time), so a slow frame never snowballs.
+    What is left in the accumulator is returned as the fraction of a tick to
+    interpolate drawn transforms by.
+    """
+
+    def __init__(self, tick_rate=None, max_steps=None):
+        if tick_rate is None:
+            tick_rate = SIM_TICK_RATE.get_value()
+        self.step = 1.0 / tick_rate
+        self.max_steps = SIM_MAX_STEPS.get_value() if max_steps is None else max_steps
+        self.accumulator = 0.0
+        self.ticks = 0
+        self.dropped_time = 0.0
+
+    def advance(self, dt):
+        """Add dt seconds, return (ticks to run now, interpolation fraction)"""
+        self.accumulator += dt
+        steps = int(self.accumulator / self.step)
+        if steps > self.max_steps:
+            self.dropped_time += (steps - self.max_steps) * self.step
+            self.accumulator -= (steps - self.max_steps) * self.step
+            steps = self.max_steps
+        self.accumulator = max(self.accumulator - steps * self.step, 0.0)
+        self.ticks += steps
+        return steps, min(self.accumulator / self.step, 1.0)
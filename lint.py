@@ -6,6 +6,10 @@ args = [
     'pylint',
     'game',
     'setup.py',
+    'benchmark.py',
+    'rendercheck.py',
+    'standin.py',
+    'tests',
 ]
 retcode = subprocess.call(args, stdout=sys.stdout, stderr=sys.stderr)
 
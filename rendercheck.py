@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""Check that instanced tile rendering matches the merged mesh
+
+Builds the same dungeon with both tile render paths, renders each into an
+offscreen buffer from the same camera and compares the images.
+
+    python rendercheck.py --size 100 --seed 3
+"""
+import argparse
+import contextlib
+import os
+import sys
+
+GAME_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'game')
+sys.path.insert(0, GAME_DIR)
+
+# pylint: disable=wrong-import-position
+from direct.showbase.ShowBase import ShowBase  # noqa: E402
+import numpy as np  # noqa: E402
+import panda3d.core as p3d  # noqa: E402
+
+from nitrogen.mapgen import cache  # noqa: E402
+from nitrogen.mapgen.dungeon import Dungeon  # noqa: E402
+
+import standin  # noqa: E402
+
+
+IMAGE_SIZE = 512
+
+
+def init_panda(model_path):
+    p3d.load_prc_file_data('', '\n'.join([
+        'window-type offscreen',
+        'audio-library-name null',
+        'win-size {0} {0}'.format(IMAGE_SIZE),
+        'sync-video false',
+        'model-path {}'.format(model_path),
+    ]))
+    return ShowBase()
+
+
+def render_image(base, nodepath):
+    nodepath.reparent_to(base.render)
+    for _ in range(2):
+        base.graphicsEngine.render_frame()
+    tex = base.win.get_screenshot()
+    nodepath.detach_node()
+
+    image = np.frombuffer(bytes(tex.get_ram_image_as('RGB')), dtype=np.uint8)
+    return image.reshape(tex.get_y_size(), tex.get_x_size(), 3).astype(np.int16), tex
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--generator', choices=['bsp', 'static'], default='bsp')
+    parser.add_argument('--size', type=int, default=50)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--threshold', type=int, default=8,
+                        help='largest per-channel difference that still counts as a match')
+    parser.add_argument('--max-mismatch', type=float, default=0.001,
+                        help='allowed fraction of mismatched pixels')
+    parser.add_argument('--save-images', metavar='PREFIX',
+                        help='write both renders and the difference to PREFIX-*.png')
+    parser.add_argument('--model-path', default=os.path.join(GAME_DIR, 'assets'))
+    parser.add_argument('--stand-in-models', action='store_true',
+                        help='use generated boxes instead of dungeon.bam (see standin.py)')
+    args = parser.parse_args()
+    if args.stand_in_models:
+        args.model_path = standin.write_stand_in_models()
+
+    base = init_panda(args.model_path)
+    base.disableMouse()
+
+    sun = base.render.attach_new_node(p3d.DirectionalLight('sun'))
+    sun.node().set_color((0.8, 0.8, 0.8, 1))
+    sun.set_hpr(30, -60, 0)
+    base.render.set_light(sun)
+    ambient = base.render.attach_new_node(p3d.AmbientLight('ambient'))
+    ambient.node().set_color((0.2, 0.2, 0.2, 1))
+    base.render.set_light(ambient)
+
+    base.camLens.set_fov(60)
+    base.cam.set_pos(0, -args.size * 0.6, args.size * 0.9)
+    base.cam.look_at(0, 0, 0)
+
+    with open(os.devnull, 'w', encoding='utf8') as devnull, contextlib.redirect_stdout(devnull):
+        tilemap = cache.generate(args.generator, args.size, args.size, args.seed)
+
+    images = {}
+    for name, instanced in (('mesh', False), ('instanced', True)):
+        dungeon = Dungeon(
+            args.generator,
+            args.size,
+            args.size,
+            seed=args.seed,
+            tilemap=tilemap,
+            instanced=instanced
+        )
+        images[name] = render_image(base, dungeon.model_root)
+
+    diff = np.abs(images['mesh'][0] - images['instanced'][0])
+    mismatch = float(np.mean(diff.max(axis=2) > args.threshold))
+    print("Max difference: {}, mismatched pixels: {:.4%}".format(int(diff.max()), mismatch))
+
+    if args.save_images:
+        for name, (_, tex) in images.items():
+            tex.write('{}-{}.png'.format(args.save_images, name))
+        difftex = p3d.Texture('diff')
+        difftex.setup_2d_texture(IMAGE_SIZE, IMAGE_SIZE, p3d.Texture.T_unsigned_byte,
+                                 p3d.Texture.F_rgb)
+        difftex.set_ram_image_as(diff.astype(np.uint8).tobytes(), 'RGB')
+        difftex.write('{}-diff.png'.format(args.save_images))
+
+    if mismatch > args.max_mismatch:
+        print("Instanced rendering does not match the merged mesh")
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,39 @@
+"""Stand-in dungeon models for benchmark.py and rendercheck.py
+
+dungeon.bam is converted from assets/dungeon.blend, which needs Blender. These
+unit boxes carry the same node names so the Dungeon code paths can be timed
+and compared anywhere. Numbers measured with them are only comparable to
+other runs that also use them.
+"""
+import os
+import tempfile
+
+import panda3d.core as p3d
+
+
+MODEL_NAMES = ['DungeonTile', 'MonsterSpawn', 'Teleporter', 'TeleLink']
+
+
+def make_box(name):
+    """Return a unit box centered on the origin as a single flattened node"""
+    cardmaker = p3d.CardMaker(name)
+    cardmaker.set_frame(-0.5, 0.5, -0.5, 0.5)
+    box = p3d.NodePath(name)
+    for heading, pitch in ((0, -90), (0, 90), (0, 0), (90, 0), (180, 0), (270, 0)):
+        side = box.attach_new_node(cardmaker.generate())
+        side.set_hpr(heading, pitch, 0)
+        side.set_pos(side.get_quat().get_forward() * -0.5)
+    box.flatten_strong()
+    return box
+
+
+def write_stand_in_models(directory=None):
+    """Write a stand-in dungeon.bam and return the directory it is in"""
+    if directory is None:
+        directory = tempfile.mkdtemp(prefix='nitrogen-standin-')
+
+    root = p3d.NodePath('Scene')
+    for name in MODEL_NAMES:
+        make_box(name).reparent_to(root)
+    root.write_bam_file(p3d.Filename.from_os_specific(os.path.join(directory, 'dungeon.bam')))
+    return directory
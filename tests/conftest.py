@@ -0,0 +1,5 @@
+import os
+import sys
+
+GAME_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'game')
+sys.path.insert(0, GAME_DIR)
@@ -0,0 +1,59 @@
+import collections
+import random
+
+import numpy as np
+
+from nitrogen.mapgen import bsp
+from nitrogen.mapgen.tilegrid import TileGrid, EMPTY, FLOOR, ENCOUNTER
+
+
+def flood_fill_labels(grid, codes):
+    """Reference labels from a breadth first flood fill in row major order"""
+    labels = np.full((grid.height, grid.width), -1, dtype=np.int32)
+    walkable = grid.mask(*codes)
+    count = 0
+    for posy, posx in np.argwhere(walkable).tolist():
+        if labels[posy, posx] >= 0:
+            continue
+        labels[posy, posx] = count
+        pending = collections.deque([(posy, posx)])
+        while pending:
+            tiley, tilex = pending.popleft()
+            for adjy, adjx in ((tiley + 1, tilex), (tiley - 1, tilex),
+                               (tiley, tilex + 1), (tiley, tilex - 1)):
+                if 0 <= adjy < grid.height and 0 <= adjx < grid.width and \
+                        walkable[adjy, adjx] and labels[adjy, adjx] < 0:
+                    labels[adjy, adjx] = count
+                    pending.append((adjy, adjx))
+        count += 1
+    return labels
+
+
+def test_labels_match_flood_fill():
+    rng = random.Random(1)
+    for _ in range(50):
+        grid = TileGrid(rng.randint(1, 30), rng.randint(1, 30))
+        for posy in range(grid.height):
+            for posx in range(grid.width):
+                grid[posx, posy] = rng.choice((EMPTY, EMPTY, FLOOR, FLOOR, ENCOUNTER))
+        islands, labels = bsp.find_connected_components(grid)
+        assert np.array_equal(labels, flood_fill_labels(grid, (FLOOR, ENCOUNTER)))
+        assert len(islands) == labels.max() + 1
+        for idx, island in enumerate(islands):
+            assert np.array_equal(island, np.argwhere(labels == idx))
+
+
+def test_snake_is_one_island():
+    grid = TileGrid(9, 9)
+    grid.tiles[::2, :] = FLOOR
+    grid.tiles[1::4, -1] = FLOOR
+    grid.tiles[3::4, 0] = FLOOR
+    islands, labels = bsp.find_connected_components(grid)
+    assert len(islands) == 1
+    assert (labels >= 0).sum() == len(islands[0])
+
+
+def test_empty_map():
+    islands, labels = bsp.find_connected_components(TileGrid(4, 3))
+    assert not islands
+    assert (labels == -1).all()
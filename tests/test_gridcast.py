@@ -0,0 +1,53 @@
+import math
+
+from nitrogen.mapgen import gridcast
+
+
+RADIUS = 0.3
+
+
+def blocked_set(*tiles):
+    """Return an is_blocked callable for the given tiles"""
+    tiles = set(tiles)
+    return lambda tilex, tiley: (tilex, tiley) in tiles
+
+
+def test_diagonal_gap_is_rejected():
+    is_blocked = blocked_set((14, 27), (15, 26))
+    startx, starty = 15.3001, 27.3001
+    x, y = gridcast.move_and_slide(is_blocked, startx, starty, -0.6002, -0.6002, RADIUS)
+    assert (math.floor(x), math.floor(y)) == (15, 27)
+
+    is_blocked = blocked_set((21, 17), (22, 18))
+    startx, starty = 21.6999, 18.3001
+    x, y = gridcast.move_and_slide(is_blocked, startx, starty, 0.6002, -0.6002, RADIUS)
+    assert (math.floor(x), math.floor(y)) == (21, 18)
+
+
+def test_long_move_keeps_to_side():
+    is_blocked = blocked_set((4, 5), (5, 4))
+    x, y = gridcast.move_and_slide(is_blocked, 5.5, 5.5, -2.0, -2.0, RADIUS)
+    assert x >= 5.0 and y >= 5.0
+
+
+def test_slides_along_wall():
+    def is_blocked(_tilex, tiley):
+        return tiley >= 5
+    x, y = gridcast.move_and_slide(is_blocked, 3.5, 4.5, 1.0, 0.5, RADIUS)
+    assert math.isclose(x, 4.5)
+    assert math.isclose(y, 5 - RADIUS - gridcast.SKIN)
+
+
+def test_push_out_goes_back():
+    is_blocked = blocked_set((5, 5))
+    # Closer to the top face, but the circle came from below
+    x, y = gridcast.push_out(is_blocked, 5.5, 5.6, RADIUS, 5.5, 4.6)
+    assert math.isclose(y, 5 - RADIUS - gridcast.SKIN)
+    assert x == 5.5
+
+
+def test_raycast_first_hit():
+    is_blocked = blocked_set((3, 0), (5, 0))
+    hit = gridcast.raycast(is_blocked, 0.5, 0.5, 6.5, 0.5)
+    assert (hit.tilex, hit.tiley, hit.normalx, hit.normaly) == (3, 0, -1, 0)
+    assert math.isclose(hit.fraction, 2.5 / 6.0)
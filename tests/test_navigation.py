@@ -0,0 +1,144 @@
+import contextlib
+import heapq
+import io
+import math
+import random
+import types
+
+from nitrogen.mapgen import bsp
+from nitrogen.mapgen.tilegrid import (
+    TileGrid, EMPTY, FLOOR, ENCOUNTER, START, EXIT, TELEPORTER
+)
+from nitrogen.navigation import NavGrid
+
+
+_SQRT2 = math.sqrt(2)
+_DIRECTIONS = [(-1, -1), (0, -1), (1, -1), (-1, 0), (1, 0), (-1, 1), (0, 1), (1, 1)]
+
+
+def linked_partners(tilemap):
+    partners = {}
+    for coords in tilemap.teleporter_pairs().values():
+        if len(coords) >= 2:
+            partners[coords[0]] = coords[1]
+            partners[coords[1]] = coords[0]
+    return partners
+
+
+def reference_costs(tilemap, start):
+    """Dijkstra from start to every tile a path can end on, with NavGrid's moves"""
+    partners = linked_partners(tilemap)
+
+    def walkable(x, y):
+        return tilemap.in_bounds(x, y) and tilemap[x, y] != EMPTY and (x, y) not in partners
+
+    costs = {start: 0.0}
+    standing = {start: 0.0}
+    pending = [(0.0, start)]
+    while pending:
+        cost, (x, y) = heapq.heappop(pending)
+        if cost > standing[(x, y)]:
+            continue
+        for deltax, deltay in _DIRECTIONS:
+            if deltax and deltay and not (walkable(x + deltax, y) and walkable(x, y + deltay)):
+                continue
+            nextcost = cost + (_SQRT2 if deltax and deltay else 1.0)
+            tile = (x + deltax, y + deltay)
+            if tile in partners:
+                # Either the path ends on the teleporter or continues from its partner
+                costs[tile] = min(costs.get(tile, math.inf), nextcost)
+                tile = partners[tile]
+            elif not walkable(*tile):
+                continue
+            if nextcost < standing.get(tile, math.inf):
+                standing[tile] = nextcost
+                costs[tile] = min(costs.get(tile, math.inf), nextcost)
+                heapq.heappush(pending, (nextcost, tile))
+    return costs
+
+
+def path_cost(tilemap, path):
+    partners = linked_partners(tilemap)
+    cost = 0.0
+    for (startx, starty), (endx, endy) in zip(path, path[1:]):
+        if partners.get((startx, starty)) == (endx, endy):
+            continue
+        deltax, deltay = abs(endx - startx), abs(endy - starty)
+        cost += max(deltax, deltay) + (_SQRT2 - 1) * min(deltax, deltay)
+    return cost
+
+
+def check_queries(tilemap, queries):
+    nav = NavGrid(types.SimpleNamespace(tilemap=tilemap), cache_size=0)
+    for start, goal in queries:
+        expected = reference_costs(tilemap, start).get(goal)
+        path = nav.find_path(start, goal)
+        if expected is None:
+            assert path is None, (start, goal)
+        else:
+            assert path is not None, (start, goal)
+            assert (path[0], path[-1]) == (start, goal)
+            assert math.isclose(path_cost(tilemap, path), expected), (start, goal)
+
+
+def test_matches_dijkstra_on_bsp():
+    for seed in range(4):
+        with contextlib.redirect_stdout(io.StringIO()):
+            tilemap = bsp.gen(60, 60, seed=seed)
+        assert tilemap.teleporter_pairs()
+        rng = random.Random(seed)
+        coords = tilemap.coords(FLOOR, ENCOUNTER, START, EXIT, TELEPORTER)
+        tiles = [tuple(i) for i in coords.tolist()]
+        check_queries(tilemap, [(rng.choice(tiles), rng.choice(tiles)) for _ in range(25)])
+
+
+def test_teleporter_shortcut():
+    # Two rooms joined by a long corridor and by a teleporter pair
+    tilemap = TileGrid(30, 12)
+    tilemap.fill(FLOOR, 1, 1, 8, 11)
+    tilemap.fill(FLOOR, 22, 1, 29, 11)
+    tilemap.fill(FLOOR, 8, 1, 22, 2)
+    tilemap.set_teleporter(6, 9, 0)
+    tilemap.set_teleporter(23, 9, 0)
+    check_queries(tilemap, [
+        ((2, 9), (27, 9)),
+        ((27, 10), (2, 2)),
+        ((2, 9), (23, 9)),
+        ((20, 1), (27, 10)),
+    ])
+    nav = NavGrid(types.SimpleNamespace(tilemap=tilemap))
+    assert (6, 9) in nav.find_path((2, 9), (27, 9))
+
+
+def test_unreachable_goals():
+    tilemap = TileGrid(20, 10)
+    tilemap.fill(FLOOR, 1, 1, 6, 9)
+    tilemap.fill(FLOOR, 8, 1, 12, 9)
+    tilemap.fill(FLOOR, 14, 1, 19, 9)
+    # Only the first two rooms are linked
+    tilemap.set_teleporter(3, 3, 0)
+    tilemap.set_teleporter(10, 3, 0)
+    tilemap.set_teleporter(16, 3, 1)
+    check_queries(tilemap, [
+        ((1, 1), (11, 8)),
+        ((1, 1), (18, 8)),
+        ((15, 7), (2, 2)),
+        ((1, 1), (0, 0)),
+    ])
+
+
+def test_chained_teleporters():
+    tilemap = TileGrid(20, 10)
+    tilemap.fill(FLOOR, 1, 1, 6, 9)
+    tilemap.fill(FLOOR, 8, 1, 12, 9)
+    tilemap.fill(FLOOR, 14, 1, 19, 9)
+    tilemap.set_teleporter(3, 3, 0)
+    tilemap.set_teleporter(10, 2, 0)
+    tilemap.set_teleporter(9, 7, 1)
+    tilemap.set_teleporter(16, 3, 1)
+    check_queries(tilemap, [
+        ((1, 1), (18, 8)),
+        ((18, 8), (1, 1)),
+        ((11, 8), (14, 1)),
+        ((1, 8), (9, 7)),
+    ])
@@ -0,0 +1,27 @@
+from nitrogen.mapgen.tilegrid import TileGrid, FLOOR, ENCOUNTER
+
+
+def make_grid():
+    grid = TileGrid(14, 3)
+    grid.fill(FLOOR, 1, 1, 13, 2)
+    grid[4, 1] = ENCOUNTER
+    for tele_id in range(12):
+        grid.set_teleporter(1 + tele_id, 0, tele_id)
+        grid.set_teleporter(1 + tele_id, 2, tele_id)
+    return grid
+
+
+def test_round_trip_tokens():
+    grid = make_grid()
+    assert TileGrid.from_strings(grid.to_strings()) == grid
+
+
+def test_round_trip_text():
+    grid = make_grid()
+    assert TileGrid.from_strings(str(grid).splitlines()) == grid
+
+
+def test_compact_rows():
+    grid = TileGrid.from_strings(['.1#', '$#1'])
+    assert grid.teleporter_pairs() == {1: [(1, 0), (2, 1)]}
+    assert grid[0, 1] == ENCOUNTER